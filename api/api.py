@@ -2,57 +2,85 @@
 
 import os
 import json
-import csv
 import re
-from datetime import datetime
 import requests
 import logging
+import threading
 from dotenv import load_dotenv
 from tenacity import retry, stop_after_attempt, wait_fixed, retry_if_exception_type
-from PIL import Image
-from io import BytesIO
 from together import Together
+from image_store import download_content_addressed
+from trends import trend_summary
+import tracing
 
 # Carica variabili ambiente
 load_dotenv()
 
+logging.basicConfig(level=logging.INFO, format='%(asctime)s - %(levelname)s - %(message)s')
+ROOT_DIR = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+# Le chiavi servono solo alle chiamate: il modulo si importa anche senza (es. benchmark con stub)
 FIREWORKS_API_KEY = os.getenv("FIREWORKS_API_KEY_MIA")
 TOGETHER_API_KEY = os.getenv("TOGETHER_API_KEY")
 if not FIREWORKS_API_KEY or not TOGETHER_API_KEY:
-    raise ValueError("❌ FIREWORKS_API_KEY o TOGETHER_API_KEY non trovata")
-
-client = Together(api_key=TOGETHER_API_KEY)
-logging.basicConfig(level=logging.INFO, format='%(asctime)s - %(levelname)s - %(message)s')
-ROOT_DIR = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+    logging.warning("⚠️ FIREWORKS_API_KEY o TOGETHER_API_KEY non trovata: le chiamate relative falliranno")
+
+# Endpoint Fireworks e Together configurabili (es. stub locali per i benchmark)
+FIREWORKS_URL = os.getenv("FIREWORKS_URL", "https://api.fireworks.ai/inference/v1/chat/completions")
+TOGETHER_BASE_URL = os.getenv("TOGETHER_BASE_URL") or None
+FIREWORKS_RETRY_WAIT_SECONDS = float(os.getenv("FIREWORKS_RETRY_WAIT_SECONDS", "10"))
+FIREWORKS_MODEL = os.getenv("FIREWORKS_MODEL", "accounts/fireworks/models/llama4-scout-instruct-basic")
+IMAGE_MODEL = os.getenv("IMAGE_MODEL", "black-forest-labs/FLUX.1-schnell-Free")
+IMAGE_STEPS = int(os.getenv("IMAGE_STEPS", "3"))
+# Chiamate Fireworks contemporanee nell'intero processo: campagne, /generate, streaming,
+# INCI e prodotti passano tutti da qui. È un semaforo tra thread: va preso solo fuori
+# dall'event loop e mai tenuto attraverso uno yield
+FIREWORKS_CONCURRENCY = int(os.getenv("FIREWORKS_CONCURRENCY", "8"))
+fireworks_slots = threading.BoundedSemaphore(FIREWORKS_CONCURRENCY)
+
+_client = None
+
+def get_together_client() -> Together:
+    global _client
+    if _client is None:
+        if not TOGETHER_API_KEY:
+            raise ValueError("❌ TOGETHER_API_KEY non trovata")
+        _client = Together(api_key=TOGETHER_API_KEY, base_url=TOGETHER_BASE_URL)
+    return _client
 
 # --- Traduzione ---
+@tracing.traced("fireworks_translate")
 def translate(text: str, target_language: str) -> str:
     logging.info(f"🌐 Traduzione in {target_language}")
-    url = "https://api.fireworks.ai/inference/v1/chat/completions"
+    url = FIREWORKS_URL
     headers = {"Authorization": f"Bearer {FIREWORKS_API_KEY}", "Content-Type": "application/json"}
     
     # Prompt aggiornato per rispondere solo con il testo tradotto senza spiegazioni
     prompt = f"Translate the following text to {target_language}. Return ONLY the translated text, no explanations or introductory phrases:\n\n{text}"
     
     payload = {
-        "model": "accounts/fireworks/models/llama4-scout-instruct-basic",
+        "model": FIREWORKS_MODEL,
         "max_tokens": 1024,
         "messages": [{"role": "user", "content": prompt}]
     }
     
-    resp = requests.post(url, headers=headers, data=json.dumps(payload))
+    with fireworks_slots:
+        resp = requests.post(url, headers=headers, data=json.dumps(payload))
     if resp.status_code == 200:
         return resp.json()['choices'][0]['message']['content'].strip()
     else:
+        tracing.count_upstream_error("fireworks", resp.status_code)
         raise RuntimeError(f"API Fireworks error (translation): {resp.status_code}")
 
 # --- Generazione contenuti ---
-@retry(stop=stop_after_attempt(3), wait=wait_fixed(10), retry=retry_if_exception_type(RuntimeError))
-def call_fireworks(question: str, context: str, platform: str = "Instagram") -> str:
+def build_post_payload(question: str, context: str, platform: str = "Instagram", language: str = "English") -> dict:
     platform = platform.capitalize()  # Assicura che sia 'Instagram' o 'Twitter' con iniziale maiuscola
-    logging.info(f"✍️ Generazione contenuto con Fireworks per piattaforma: {platform}")
-    url = "https://api.fireworks.ai/inference/v1/chat/completions"
-    headers = {"Authorization": f"Bearer {FIREWORKS_API_KEY}", "Content-Type": "application/json"}
+
+    # Generazione nativa: il post viene scritto direttamente nella lingua dell'utente
+    language_extra = f"""
+- Write the post in {language}, even if the context documents are in another language.
+- Keep hashtags from the context verbatim; do not translate them.
+""" if language != "English" else ""
 
     instagram_extra = """
 For Instagram:
@@ -92,7 +120,7 @@ You are a professional AI assistant for social media content creation.
 - Do NOT include any URLs, links, or references to websites in the post.
 - Ensure the post is natural, human-like, and engaging.
 - Please ensure the post ends with a complete sentence and NO trailing ellipsis ("...").
-- Please do NOT end with ellipsis or incomplete sentences. End with a full, clear sentence.
+- Please do NOT end with ellipsis or incomplete sentences. End with a full, clear sentence.{language_extra}
 
 🎯 Task:
 Based on the materials and request above, generate a complete and engaging **social media post** tailored for **{platform}**.
@@ -109,8 +137,8 @@ Return only the post text, nothing else.
     max_tokens = 150 if platform == "Instagram" else 120
     temperature = 0.6 if platform == "Instagram" else 0.5
 
-    payload = {
-        "model": "accounts/fireworks/models/llama4-scout-instruct-basic",
+    return {
+        "model": FIREWORKS_MODEL,
         "max_tokens": max_tokens,
         "temperature": temperature,
         "messages": [{"role": "user", "content": prompt}],
@@ -118,7 +146,16 @@ Return only the post text, nothing else.
         "stop": ["...", "\n"]
     }
 
-    resp = requests.post(url, headers=headers, data=json.dumps(payload))
+@tracing.traced("fireworks_post")
+@retry(stop=stop_after_attempt(3), wait=wait_fixed(FIREWORKS_RETRY_WAIT_SECONDS), retry=retry_if_exception_type(RuntimeError), before_sleep=tracing.count_retry)
+def call_fireworks(question: str, context: str, platform: str = "Instagram", language: str = "English") -> str:
+    logging.info(f"✍️ Generazione contenuto con Fireworks per piattaforma: {platform.capitalize()}")
+    url = FIREWORKS_URL
+    headers = {"Authorization": f"Bearer {FIREWORKS_API_KEY}", "Content-Type": "application/json"}
+    payload = build_post_payload(question, context, platform, language)
+
+    with fireworks_slots:
+        resp = requests.post(url, headers=headers, data=json.dumps(payload))
     if resp.status_code == 200:
         text = resp.json()['choices'][0]['message']['content'].strip()
 
@@ -131,47 +168,85 @@ Return only the post text, nothing else.
             text += "."
 
         return text
-    elif resp.status_code == 429:
+    tracing.count_upstream_error("fireworks", resp.status_code)
+    if resp.status_code == 429:
         logging.warning("⚠️ Rate limit Fireworks raggiunto, retry in corso...")
         raise RuntimeError("Rate limit Fireworks")
     else:
         raise RuntimeError(f"API Fireworks error: {resp.status_code}")
 
+# --- Generazione contenuti in streaming ---
+@tracing.traced("fireworks_stream_open")
+@retry(stop=stop_after_attempt(3), wait=wait_fixed(FIREWORKS_RETRY_WAIT_SECONDS), retry=retry_if_exception_type(RuntimeError), before_sleep=tracing.count_retry)
+def _open_fireworks_stream(payload: dict):
+    headers = {"Authorization": f"Bearer {FIREWORKS_API_KEY}", "Content-Type": "application/json", "Accept": "text/event-stream"}
+    # Lo slot copre l'apertura dello stream, non la lettura: tra un token e l'altro il
+    # generatore resta sospeso in attesa del client e non deve bloccare gli altri
+    with fireworks_slots:
+        resp = requests.post(FIREWORKS_URL, headers=headers, data=json.dumps({**payload, "stream": True}), stream=True, timeout=60)
+    if resp.status_code == 200:
+        return resp
+    resp.close()
+    tracing.count_upstream_error("fireworks", resp.status_code)
+    if resp.status_code == 429:
+        logging.warning("⚠️ Rate limit Fireworks raggiunto, retry in corso...")
+        raise RuntimeError("Rate limit Fireworks")
+    raise RuntimeError(f"API Fireworks error: {resp.status_code}")
+
+def stream_fireworks(question: str, context: str, platform: str = "Instagram", language: str = "English"):
+    """Come call_fireworks, ma restituisce i frammenti di testo man mano che arrivano."""
+    logging.info(f"✍️ Generazione in streaming con Fireworks per piattaforma: {platform.capitalize()}")
+    resp = _open_fireworks_stream(build_post_payload(question, context, platform, language))
+    try:
+        for line in resp.iter_lines(chunk_size=None, decode_unicode=True):
+            if not line or not line.startswith("data:"):
+                continue
+            data = line[len("data:"):].strip()
+            if data == "[DONE]":
+                break
+            delta = json.loads(data)["choices"][0].get("delta", {}).get("content")
+            if delta:
+                yield delta
+    finally:
+        resp.close()
+
 # --- Generazione immagine ---
-def generate_image(prompt: str, output_dir: str = "data/images", output_filename: str = None) -> str:
+def generate_image(prompt: str, output_dir: str = "data/images") -> str:
     logging.info(f"🖼️ Chiamata generate_image con prompt: {prompt}")
     abs_output_dir = os.path.join(ROOT_DIR, output_dir)
-    os.makedirs(abs_output_dir, exist_ok=True)
 
-    if not output_filename:
-        output_filename = f"generated_image_{datetime.utcnow().strftime('%Y%m%d%H%M%S%f')}.png"
-    output_path = os.path.join(abs_output_dir, output_filename)
-
-    response = client.images.generate(
-        prompt=prompt,
-        model="black-forest-labs/FLUX.1-schnell-Free",
-        steps=3,
-        n=1
-    )
+    try:
+        with tracing.span("together_image"):
+            response = get_together_client().images.generate(
+                prompt=prompt,
+                model=IMAGE_MODEL,
+                steps=IMAGE_STEPS,
+                n=1
+            )
+    except Exception as e:
+        # Il client Together ritenta da solo i 429/5xx: qui arriva solo l'errore finale
+        tracing.count_upstream_error("together", getattr(e, "status_code", type(e).__name__))
+        raise
 
     if not response.data or not hasattr(response.data[0], 'url'):
         raise RuntimeError("Risposta API Together senza dati immagine")
 
-    image_url = response.data[0].url
-    image_resp = requests.get(image_url)
-    if image_resp.status_code != 200:
-        raise RuntimeError("Errore download immagine")
-
-    image = Image.open(BytesIO(image_resp.content))
-    image.save(output_path)
+    # Download in streaming su disco, nome = hash del contenuto (nessuna decodifica)
+    with tracing.span("image_download"):
+        output_path = download_content_addressed(response.data[0].url, abs_output_dir)
     logging.info(f"✅ Immagine salvata: {output_path}")
     return output_path
 
-@retry(stop=stop_after_attempt(3), wait=wait_fixed(10), retry=retry_if_exception_type(RuntimeError))
+@tracing.traced("fireworks_product")
+@retry(stop=stop_after_attempt(3), wait=wait_fixed(FIREWORKS_RETRY_WAIT_SECONDS), retry=retry_if_exception_type(RuntimeError), before_sleep=tracing.count_retry)
 def create_product_from_trends(context: str, hint: str = "") -> dict:
     logging.info("🧪 Creazione nuovo prodotto basato su trend...")
 
-    url = "https://api.fireworks.ai/inference/v1/chat/completions"
+    # Trend aggregati sull'intero corpus (digest precalcolato) + contesto specifico del suggerimento
+    trends = trend_summary()
+    context = "\n\n".join(part for part in (trends, context) if part)
+
+    url = FIREWORKS_URL
     headers = {"Authorization": f"Bearer {FIREWORKS_API_KEY}", "Content-Type": "application/json"}
 
     prompt = f"""
@@ -206,14 +281,16 @@ Formato risposta in JSON, ad esempio:
 """
 
     payload = {
-        "model": "accounts/fireworks/models/llama4-scout-instruct-basic",
+        "model": FIREWORKS_MODEL,
         "max_tokens": 512,
         "temperature": 0.6,
         "messages": [{"role": "user", "content": prompt}]
     }
 
-    resp = requests.post(url, headers=headers, data=json.dumps(payload))
+    with fireworks_slots:
+        resp = requests.post(url, headers=headers, data=json.dumps(payload))
     if resp.status_code != 200:
+        tracing.count_upstream_error("fireworks", resp.status_code)
         raise RuntimeError(f"API Fireworks error: {resp.status_code}")
 
     content = resp.json()['choices'][0]['message']['content'].strip()
@@ -226,59 +303,15 @@ Formato risposta in JSON, ad esempio:
         product_data = {"raw_output": content}
         return product_data
 
-    # genera immagine frontale (unica immagine)
-    if "image_prompt" in product_data:
-        try:
-            img_path = generate_image(product_data["image_prompt"], output_dir="data/product_images")
-            product_data["image_url"] = "/" + os.path.relpath(img_path, ROOT_DIR).replace(os.sep, "/")
-        except Exception as e:
-            logging.error(f"⚠️ Errore generazione immagine: {e}")
-
+    # L'immagine frontale viene generata in background da /create_product (image_jobs)
     return product_data
 
-PRODUCTS_CSV = os.path.join(ROOT_DIR, "data", "products_history.csv")
-
-def save_product_to_csv(product: dict, csv_path: str = PRODUCTS_CSV):
-    # Assicura cartella
-    os.makedirs(os.path.dirname(csv_path), exist_ok=True)
-
-    # Normalizza i campi
-    nome = product.get("nome_prodotto", "")
-    descrizione = product.get("descrizione", "")
-    ingredienti = ", ".join(product.get("ingredienti", []))
-    sostenibilita = product.get("note_sostenibilita", "")
-    image_url = product.get("image_url", "")
-    timestamp = datetime.utcnow().isoformat()
-
-    # Scrive o aggiunge al CSV
-    write_header = not os.path.exists(csv_path)
-    with open(csv_path, mode="a", newline="", encoding="utf-8") as f:
-        writer = csv.writer(f)
-        if write_header:
-            writer.writerow([
-                "timestamp",
-                "nome_prodotto",
-                "descrizione",
-                "ingredienti",
-                "note_sostenibilita",
-                "image_url"
-            ])
-        writer.writerow([
-            timestamp,
-            nome,
-            descrizione,
-            ingredienti,
-            sostenibilita,
-            image_url
-        ])
-
-    logging.info(f"💾 Prodotto salvato in CSV: {csv_path}")
-
 # --- Controllo INCI ---
-@retry(stop=stop_after_attempt(3), wait=wait_fixed(10), retry=retry_if_exception_type(RuntimeError))
+@tracing.traced("fireworks_inci")
+@retry(stop=stop_after_attempt(3), wait=wait_fixed(FIREWORKS_RETRY_WAIT_SECONDS), retry=retry_if_exception_type(RuntimeError), before_sleep=tracing.count_retry)
 def call_fireworks_for_ingredient(ingredient: str) -> str:
     logging.info(f"🔎 Verifica ingrediente con Fireworks: {ingredient}")
-    url = "https://api.fireworks.ai/inference/v1/chat/completions"
+    url = FIREWORKS_URL
     headers = {"Authorization": f"Bearer {FIREWORKS_API_KEY}", "Content-Type": "application/json"}
 
     prompt = f"""
@@ -290,35 +323,74 @@ Question: Is this ingredient harmful, sustainable, or neutral in cosmetic produc
 """
 
     payload = {
-        "model": "accounts/fireworks/models/llama4-scout-instruct-basic",
+        "model": FIREWORKS_MODEL,
         "max_tokens": 50,
         "temperature": 0,
         "messages": [{"role": "user", "content": prompt}]
     }
 
-    resp = requests.post(url, headers=headers, data=json.dumps(payload))
+    with fireworks_slots:
+        resp = requests.post(url, headers=headers, data=json.dumps(payload))
     if resp.status_code == 200:
         return resp.json()['choices'][0]['message']['content'].strip().lower()
     else:
+        tracing.count_upstream_error("fireworks", resp.status_code)
         raise RuntimeError(f"API Fireworks error: {resp.status_code}")
 
-# --- Salvataggio CSV ---
-def save_to_csv(question: str, answer: str, csv_path: str):
-    os.makedirs(os.path.dirname(csv_path), exist_ok=True)
-    current_id = 1
-    if os.path.exists(csv_path):
-        try:
-            with open(csv_path, newline="", encoding="utf-8") as f:
-                reader = csv.DictReader(f)
-                ids = [int(row["id_q"]) for row in reader if row["id_q"].isdigit()]
-                current_id = max(ids) + 1 if ids else 1
-        except Exception:
-            current_id = 1
-
-    with open(csv_path, mode="a", newline="", encoding="utf-8") as f:
-        writer = csv.writer(f)
-        if current_id == 1 and f.tell() == 0:
-            writer.writerow(["id_q", "question", "answer"])
-        writer.writerow([current_id, question, answer])
+@tracing.traced("fireworks_inci_batch")
+@retry(stop=stop_after_attempt(3), wait=wait_fixed(FIREWORKS_RETRY_WAIT_SECONDS), retry=retry_if_exception_type(RuntimeError), before_sleep=tracing.count_retry)
+def call_fireworks_for_ingredients_batch(ingredients: list) -> dict:
+    """Classifica più ingredienti con una sola chiamata.
+
+    Ritorna un dict {ingrediente: {"status": ..., "reason": ...}}; solleva
+    ValueError se la risposta non contiene un JSON valido.
+    """
+    logging.info(f"🔎 Verifica batch di {len(ingredients)} ingredienti con Fireworks")
+    url = FIREWORKS_URL
+    headers = {"Authorization": f"Bearer {FIREWORKS_API_KEY}", "Content-Type": "application/json"}
+
+    prompt = f"""
+You are an AI assistant specialized in cosmetic ingredient analysis.
+
+For each ingredient in the list below, decide whether it is harmful, sustainable, or neutral in cosmetic products.
+
+Ingredients (JSON): {json.dumps(ingredients, ensure_ascii=False)}
+
+Answer ONLY with a JSON array, one object per ingredient, in the same order, for example:
+[
+  {{"ingredient": "...", "status": "harmful | sustainable | neutral", "reason": "short explanation"}}
+]
+"""
+
+    payload = {
+        "model": FIREWORKS_MODEL,
+        "max_tokens": 50 + 40 * len(ingredients),
+        "temperature": 0,
+        "messages": [{"role": "user", "content": prompt}]
+    }
 
+    with fireworks_slots:
+        resp = requests.post(url, headers=headers, data=json.dumps(payload))
+    if resp.status_code != 200:
+        tracing.count_upstream_error("fireworks", resp.status_code)
+    if resp.status_code == 429:
+        logging.warning("⚠️ Rate limit Fireworks raggiunto, retry in corso...")
+        raise RuntimeError("Rate limit Fireworks")
+    if resp.status_code != 200:
+        raise RuntimeError(f"API Fireworks error: {resp.status_code}")
 
+    content = resp.json()['choices'][0]['message']['content'].strip()
+    match = re.search(r"\[.*\]", content, re.DOTALL)
+    if not match:
+        raise ValueError("Nessun array JSON nella risposta batch")
+    items = json.loads(match.group(0))
+
+    verdicts = {}
+    for item in items:
+        if not isinstance(item, dict) or "ingredient" not in item:
+            continue
+        verdicts[str(item["ingredient"]).strip().lower()] = {
+            "status": str(item.get("status", "")).strip().lower(),
+            "reason": str(item.get("reason", "")).strip(),
+        }
+    return verdicts
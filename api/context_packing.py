@@ -0,0 +1,103 @@
+# context_packing.py
+#
+# Composizione del contesto per i prompt: i documenti del retriever vengono
+# ripuliti (link t.co/URL ed entità HTML come &amp; solo costo in token, il
+# prompt vieta comunque gli URL), deduplicati e inseriti in ordine di
+# rilevanza finché stanno nel budget di token. Il conteggio usa tiktoken se
+# installato, altrimenti una stima locale.
+
+import os
+import re
+import html
+import math
+import logging
+from dotenv import load_dotenv
+
+load_dotenv()
+
+CONTEXT_TOKEN_BUDGET = int(os.getenv("CONTEXT_TOKEN_BUDGET", "1500"))
+NEAR_DUPLICATE_JACCARD = 0.9
+
+URL_RE = re.compile(r"(?i)\b(?:https?://|www\.|t\.co/)\S+")
+WORD_RE = re.compile(r"\w+|[^\w\s]")
+
+try:
+    import tiktoken
+    _encoding = tiktoken.get_encoding("cl100k_base")
+except Exception as e:
+    # tiktoken assente (o tabella BPE non scaricabile): stima locale
+    logging.warning(f"⚠️ Tokenizer cl100k_base non disponibile ({e}): conteggio token stimato")
+    _encoding = None
+
+
+def count_tokens(text: str) -> int:
+    if _encoding is not None:
+        return len(_encoding.encode(text))
+    # Circa un token ogni 4 caratteri di parola, uno per segno di punteggiatura
+    return sum(math.ceil(len(piece) / 4) for piece in WORD_RE.findall(text))
+
+
+def normalize_chunk(text: str) -> str:
+    text = html.unescape(html.unescape(text))  # anche entità doppie come &amp;amp;
+    text = URL_RE.sub("", text)
+    return re.sub(r"[ \t]+", " ", re.sub(r"\s*\n\s*", "\n", text)).strip()
+
+
+def _fingerprint(text: str) -> set:
+    return set(re.findall(r"\w+", text.lower()))
+
+
+def _is_duplicate(words: set, kept: list) -> bool:
+    for other in kept:
+        smaller = min(len(words), len(other))
+        if not smaller:
+            continue
+        overlap = len(words & other)
+        # stesso testo, chunk contenuto in un altro o quasi identico
+        if overlap == smaller or overlap / len(words | other) >= NEAR_DUPLICATE_JACCARD:
+            return True
+    return False
+
+
+def pack_context(docs: list, budget: int = CONTEXT_TOKEN_BUDGET) -> tuple:
+    """Ritorna (contesto, report) con i documenti già ordinati per rilevanza dal retriever."""
+    raw = "\n".join(doc.get("content", "") for doc in docs)
+    chunks, kept_words, duplicates, dropped = [], [], 0, 0
+    used = 0
+
+    for doc in docs:
+        chunk = normalize_chunk(doc.get("content", ""))
+        if not chunk:
+            continue
+        words = _fingerprint(chunk)
+        if _is_duplicate(words, kept_words):
+            duplicates += 1
+            continue
+        tokens = count_tokens(chunk)
+        if used + tokens > budget:
+            # Non entra: si prova con i successivi, più corti
+            dropped += 1
+            continue
+        chunks.append(chunk)
+        kept_words.append(words)
+        used += tokens
+
+    context = "\n".join(chunks)
+    tokens_raw = count_tokens(raw)
+    tokens_packed = count_tokens(context)
+    report = {
+        "chunks_in": len(docs),
+        "chunks_out": len(chunks),
+        "duplicates": duplicates,
+        "over_budget": dropped,
+        "tokens_raw": tokens_raw,
+        "tokens_packed": tokens_packed,
+        "tokens_saved": tokens_raw - tokens_packed,
+        "budget": budget,
+        "tokenizer": "tiktoken" if _encoding is not None else "stima",
+    }
+    logging.info(
+        f"🧮 Contesto: {tokens_raw} → {tokens_packed} token "
+        f"({report['tokens_saved']} risparmiati, {duplicates} duplicati, {dropped} oltre il budget)"
+    )
+    return context, report
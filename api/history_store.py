@@ -0,0 +1,347 @@
+# history_store.py
+#
+# Storico unico (SQLite in WAL) per Q&A, prodotti e controlli INCI.
+# Le scritture passano da una coda e vengono committate a blocchi da un thread
+# in background, quindi gli endpoint non aspettano il disco; le letture usano
+# connessioni separate e non bloccano lo scrittore.
+
+import os
+import csv
+import queue
+import atexit
+import sqlite3
+import logging
+import argparse
+import threading
+from datetime import datetime
+from dotenv import load_dotenv
+
+load_dotenv()
+
+ROOT_DIR = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+DATA_DIR = os.path.join(ROOT_DIR, "data")
+
+def getenv_path(env_var: str, default: str) -> str:
+    val = os.getenv(env_var)
+    if val:
+        return val if os.path.isabs(val) else os.path.abspath(os.path.join(ROOT_DIR, val))
+    return default
+
+HISTORY_DB = getenv_path("HISTORY_DB", os.path.join(DATA_DIR, "history.db"))
+
+# CSV storici importati alla prima apertura del database
+LEGACY_CSV = {
+    "qa_history": getenv_path("CSV_PATH", os.path.join(DATA_DIR, "qa_history_prompt.csv")),
+    "products": os.path.join(DATA_DIR, "products_history.csv"),
+    "inci_checks": os.path.join(DATA_DIR, "inci_checks.csv"),
+}
+
+# Colonne esportate in CSV, nello stesso ordine dei vecchi file
+EXPORT_COLUMNS = {
+    "qa_history": ["id_q", "question", "answer"],
+    "products": ["timestamp", "nome_prodotto", "descrizione", "ingredienti", "note_sostenibilita", "image_url"],
+    "inci_checks": ["timestamp", "ingredienti", "risultati"],
+}
+
+# Vista delle tabelle: i prodotti prendono l'immagine dal job asincrono quando pronta
+TABLE_VIEWS = {
+    "qa_history": "SELECT * FROM qa_history",
+    "products": """
+        SELECT p.id, p.timestamp, p.nome_prodotto, p.descrizione, p.ingredienti, p.note_sostenibilita,
+               COALESCE(NULLIF(p.image_url, ''), j.image_url, '') AS image_url, p.image_job_id
+        FROM products p LEFT JOIN image_jobs j ON j.id = p.image_job_id
+    """,
+    "inci_checks": "SELECT * FROM inci_checks",
+}
+
+# Colonne aggiunte dopo la prima versione dello schema
+ADDED_COLUMNS = {
+    "products": {"image_job_id": "TEXT"},
+    "image_jobs": {"variants": "TEXT", "cache_key": "TEXT"},
+    "image_cache": {"variants": "TEXT"},
+}
+
+# Indici sulle colonne aggiunte (creati dopo l'eventuale ALTER TABLE)
+ADDED_INDEXES = [
+    "CREATE INDEX IF NOT EXISTS idx_image_jobs_cache_key ON image_jobs(cache_key)",
+]
+
+SCHEMA = """
+CREATE TABLE IF NOT EXISTS qa_history (
+    id_q INTEGER PRIMARY KEY AUTOINCREMENT,
+    timestamp TEXT NOT NULL,
+    question TEXT,
+    answer TEXT
+);
+CREATE INDEX IF NOT EXISTS idx_qa_history_timestamp ON qa_history(timestamp);
+CREATE INDEX IF NOT EXISTS idx_qa_history_question ON qa_history(question);
+
+CREATE TABLE IF NOT EXISTS products (
+    id INTEGER PRIMARY KEY AUTOINCREMENT,
+    timestamp TEXT NOT NULL,
+    nome_prodotto TEXT,
+    descrizione TEXT,
+    ingredienti TEXT,
+    note_sostenibilita TEXT,
+    image_url TEXT,
+    image_job_id TEXT
+);
+CREATE INDEX IF NOT EXISTS idx_products_timestamp ON products(timestamp);
+CREATE INDEX IF NOT EXISTS idx_products_nome ON products(nome_prodotto);
+
+CREATE TABLE IF NOT EXISTS inci_checks (
+    id INTEGER PRIMARY KEY AUTOINCREMENT,
+    timestamp TEXT NOT NULL,
+    ingredienti TEXT,
+    risultati TEXT
+);
+CREATE INDEX IF NOT EXISTS idx_inci_checks_timestamp ON inci_checks(timestamp);
+CREATE INDEX IF NOT EXISTS idx_inci_checks_ingredienti ON inci_checks(ingredienti);
+
+CREATE TABLE IF NOT EXISTS image_jobs (
+    id TEXT PRIMARY KEY,
+    prompt TEXT NOT NULL,
+    output_dir TEXT NOT NULL,
+    status TEXT NOT NULL,
+    image_url TEXT,
+    variants TEXT,
+    cache_key TEXT,
+    error TEXT,
+    created_at TEXT NOT NULL,
+    updated_at TEXT NOT NULL
+);
+CREATE INDEX IF NOT EXISTS idx_image_jobs_status ON image_jobs(status);
+
+CREATE TABLE IF NOT EXISTS image_cache (
+    key TEXT PRIMARY KEY,
+    job_id TEXT NOT NULL,
+    image_path TEXT NOT NULL,
+    created_at TEXT NOT NULL
+);
+
+CREATE TABLE IF NOT EXISTS migrations (
+    name TEXT PRIMARY KEY,
+    applied_at TEXT NOT NULL
+);
+"""
+
+
+def connect(db_path: str = HISTORY_DB) -> sqlite3.Connection:
+    os.makedirs(os.path.dirname(db_path), exist_ok=True)
+    conn = sqlite3.connect(db_path, timeout=30, check_same_thread=False)
+    conn.row_factory = sqlite3.Row
+    conn.execute("PRAGMA journal_mode=WAL")
+    conn.execute("PRAGMA synchronous=NORMAL")
+    return conn
+
+
+class HistoryStore:
+    def __init__(self, db_path: str = HISTORY_DB, batch_size: int = 100):
+        self.db_path = db_path
+        self.batch_size = batch_size
+        self._queue = queue.Queue()
+
+        self._conn = connect(db_path)
+        self._conn.executescript(SCHEMA)
+        self._ensure_columns()
+        self._conn.commit()
+
+        self._writer = threading.Thread(target=self._write_loop, name="history-writer", daemon=True)
+        self._writer.start()
+        atexit.register(self.flush)
+
+    def _ensure_columns(self):
+        for table, columns in ADDED_COLUMNS.items():
+            existing = {row["name"] for row in self._conn.execute(f"PRAGMA table_info({table})")}
+            for column, column_type in columns.items():
+                if column not in existing:
+                    self._conn.execute(f"ALTER TABLE {table} ADD COLUMN {column} {column_type}")
+        for statement in ADDED_INDEXES:
+            self._conn.execute(statement)
+
+    # --- Scrittura (asincrona, a blocchi) ---
+    def insert(self, table: str, row: dict):
+        if table not in EXPORT_COLUMNS:
+            raise ValueError(f"Tabella sconosciuta: {table}")
+        self._queue.put((table, row))
+
+    def _write_loop(self):
+        while True:
+            batch = [self._queue.get()]
+            while len(batch) < self.batch_size:
+                try:
+                    batch.append(self._queue.get_nowait())
+                except queue.Empty:
+                    break
+            try:
+                with self._conn:
+                    for table, row in batch:
+                        self._insert_row(table, row)
+            except Exception as e:
+                # Il blocco è stato annullato: si riprova riga per riga, così si perde solo quella sbagliata
+                logging.warning(f"⚠️ Scrittura a blocco dello storico fallita ({len(batch)} righe): {e}")
+                self._write_one_by_one(batch)
+            finally:
+                for _ in batch:
+                    self._queue.task_done()
+
+    def _insert_row(self, table: str, row: dict):
+        columns = ", ".join(row)
+        placeholders = ", ".join("?" for _ in row)
+        self._conn.execute(f"INSERT INTO {table} ({columns}) VALUES ({placeholders})", list(row.values()))
+
+    def _write_one_by_one(self, batch: list):
+        for table, row in batch:
+            try:
+                with self._conn:
+                    self._insert_row(table, row)
+            except Exception as e:
+                logging.error(f"❌ Riga scartata dallo storico '{table}': {e} - {row}")
+
+    def flush(self):
+        """Attende che tutte le scritture in coda siano committate."""
+        self._queue.join()
+
+    # --- Lettura ---
+    def query(self, sql: str, params: tuple = ()) -> list:
+        conn = connect(self.db_path)
+        try:
+            return [dict(row) for row in conn.execute(sql, params)]
+        finally:
+            conn.close()
+
+    def recent(self, table: str, limit: int = 50) -> list:
+        if table not in EXPORT_COLUMNS:
+            raise ValueError(f"Tabella sconosciuta: {table}")
+        return self.query(f"SELECT * FROM ({TABLE_VIEWS[table]}) ORDER BY timestamp DESC LIMIT ?", (limit,))
+
+    # --- Export CSV (compatibilità con i vecchi file) ---
+    def iter_csv_rows(self, table: str):
+        if table not in EXPORT_COLUMNS:
+            raise ValueError(f"Tabella sconosciuta: {table}")
+        columns = EXPORT_COLUMNS[table]
+        conn = connect(self.db_path)
+        try:
+            yield columns
+            order = "id_q" if table == "qa_history" else "id"
+            for row in conn.execute(f"SELECT {', '.join(columns)} FROM ({TABLE_VIEWS[table]}) ORDER BY {order}"):
+                yield list(row)
+        finally:
+            conn.close()
+
+    def export_csv(self, table: str, csv_path: str):
+        self.flush()
+        os.makedirs(os.path.dirname(os.path.abspath(csv_path)), exist_ok=True)
+        with open(csv_path, "w", newline="", encoding="utf-8") as f:
+            csv.writer(f).writerows(self.iter_csv_rows(table))
+        logging.info(f"📤 Storico '{table}' esportato in {csv_path}")
+
+    # --- Migrazione dai CSV storici ---
+    def migrate_from_csv(self, table: str, csv_path: str) -> int:
+        name = f"import_csv:{table}"
+        conn = connect(self.db_path)
+        try:
+            if conn.execute("SELECT 1 FROM migrations WHERE name = ?", (name,)).fetchone():
+                return 0
+            if not os.path.exists(csv_path):
+                return 0
+            imported = self._import_csv(conn, table, csv_path, name)
+        finally:
+            conn.close()
+        logging.info(f"📥 Importate {imported} righe da {csv_path} in '{table}'")
+        return imported
+
+    def _import_csv(self, conn, table: str, csv_path: str, name: str) -> int:
+        columns = EXPORT_COLUMNS[table]
+        imported = 0
+        fallback_ts = datetime.utcfromtimestamp(os.path.getmtime(csv_path)).isoformat()
+        with open(csv_path, newline="", encoding="utf-8") as f, conn:
+            for row in csv.DictReader(f):
+                values = {c: row.get(c, "") for c in columns}
+                if table == "qa_history":
+                    if not (values["id_q"] or "").isdigit():
+                        values.pop("id_q")
+                    values["timestamp"] = fallback_ts
+                placeholders = ", ".join("?" for _ in values)
+                cursor = conn.execute(
+                    f"INSERT OR IGNORE INTO {table} ({', '.join(values)}) VALUES ({placeholders})",
+                    list(values.values()),
+                )
+                imported += cursor.rowcount   # 0 se la riga esisteva già
+            conn.execute(
+                "INSERT INTO migrations (name, applied_at) VALUES (?, ?)",
+                (name, datetime.utcnow().isoformat()),
+            )
+        return imported
+
+    def migrate_legacy_csv(self) -> dict:
+        """Importa i CSV storici non ancora migrati; ritorna le righe importate per tabella."""
+        imported = {}
+        for table, csv_path in LEGACY_CSV.items():
+            try:
+                imported[table] = self.migrate_from_csv(table, csv_path)
+            except Exception as e:
+                logging.error(f"❌ Migrazione {csv_path} fallita: {e}")
+                imported[table] = 0
+        return imported
+
+
+_store = None
+_store_lock = threading.Lock()
+
+
+def get_store() -> HistoryStore:
+    global _store
+    with _store_lock:
+        if _store is None:
+            _store = HistoryStore(HISTORY_DB)
+            _store.migrate_legacy_csv()
+    return _store
+
+
+# --- Funzioni di salvataggio usate dagli endpoint ---
+def save_qa(question: str, answer: str):
+    get_store().insert("qa_history", {
+        "timestamp": datetime.utcnow().isoformat(),
+        "question": question,
+        "answer": answer,
+    })
+
+
+def save_product(product: dict):
+    get_store().insert("products", {
+        "timestamp": datetime.utcnow().isoformat(),
+        "nome_prodotto": product.get("nome_prodotto", ""),
+        "descrizione": product.get("descrizione", ""),
+        "ingredienti": ", ".join(product.get("ingredienti", [])),
+        "note_sostenibilita": product.get("note_sostenibilita", ""),
+        "image_url": product.get("image_url", ""),
+        "image_job_id": product.get("image_job_id"),
+    })
+
+
+def save_inci_check(ingredienti, risultati):
+    get_store().insert("inci_checks", {
+        "timestamp": datetime.utcnow().isoformat(),
+        "ingredienti": "; ".join(ingredienti),
+        "risultati": "; ".join([f"{r['ingrediente']}:{r['status']}" for r in risultati]),
+    })
+
+
+if __name__ == "__main__":
+    logging.basicConfig(level=logging.INFO, format="%(asctime)s - %(levelname)s - %(message)s")
+    parser = argparse.ArgumentParser(description="Gestione dello storico SQLite")
+    sub = parser.add_subparsers(dest="command", required=True)
+    sub.add_parser("migrate", help="Importa i CSV storici (una sola volta per tabella)")
+    export = sub.add_parser("export", help="Esporta una tabella in CSV")
+    export.add_argument("table", choices=list(EXPORT_COLUMNS))
+    export.add_argument("csv_path")
+    args = parser.parse_args()
+
+    if args.command == "migrate":
+        # Migrazione esplicita, senza passare da get_store() che la esegue già all'avvio dell'API
+        store = HistoryStore(HISTORY_DB)
+        for table, count in store.migrate_legacy_csv().items():
+            print(f"{table}: {count} righe importate da {LEGACY_CSV[table]}")
+    elif args.command == "export":
+        get_store().export_csv(args.table, args.csv_path)
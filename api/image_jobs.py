@@ -0,0 +1,210 @@
+# image_jobs.py
+#
+# Coda di job per la generazione immagini: gli endpoint registrano il job e
+# rispondono subito, un pool limitato di worker chiama Together e scarica
+# l'immagine. I job stanno nel database dello storico, così quelli rimasti in
+# coda o in esecuzione vengono ripresi al riavvio.
+#
+# Ogni richiesta è identificata da prompt normalizzato, cartella di
+# destinazione e parametri del modello: se l'immagine esiste già viene
+# riusata, se è in generazione la richiesta si aggancia al job in corso
+# invece di lanciarne un altro.
+
+import os
+import re
+import json
+import uuid
+import hashlib
+import logging
+import threading
+from datetime import datetime
+from concurrent.futures import ThreadPoolExecutor
+from dotenv import load_dotenv
+
+from api import generate_image, IMAGE_MODEL, IMAGE_STEPS
+from image_store import schedule_variants
+from history_store import connect, get_store
+import tracing
+
+load_dotenv()
+
+IMAGE_WORKERS = int(os.getenv("IMAGE_WORKERS", "2"))
+PUBLIC_BASE_URL = os.getenv("PUBLIC_BASE_URL", "http://localhost:8000").rstrip("/")
+
+FINAL_STATUSES = ("done", "error")
+
+
+def public_image_url(image_path: str) -> str:
+    filename = os.path.basename(image_path)                     # es: generated_image_123.png
+    subfolder = os.path.basename(os.path.dirname(image_path))   # es: images
+    return f"{PUBLIC_BASE_URL}/data/{subfolder}/{filename}"
+
+
+def normalize_prompt(prompt: str) -> str:
+    return re.sub(r"\s+", " ", prompt).strip().lower().rstrip(".!? ")
+
+
+def image_cache_key(prompt: str, output_dir: str = "data/images", model: str = IMAGE_MODEL, steps: int = IMAGE_STEPS) -> str:
+    # output_dir fa parte della chiave: il file (e il suo URL pubblico) sta in quella cartella
+    payload = json.dumps(
+        {"prompt": normalize_prompt(prompt), "output_dir": os.path.normpath(output_dir), "model": model, "steps": steps},
+        sort_keys=True,
+    )
+    return hashlib.sha256(payload.encode("utf-8")).hexdigest()
+
+
+class ImageJobQueue:
+    def __init__(self, workers: int = IMAGE_WORKERS):
+        self.db_path = get_store().db_path
+        self._pool = ThreadPoolExecutor(max_workers=workers, thread_name_prefix="image-job")
+        self._lock = threading.Lock()
+        self.stats = {"generated": 0, "cache_hits": 0, "coalesced": 0}
+
+    def _update(self, job_id: str, **fields):
+        fields["updated_at"] = datetime.utcnow().isoformat()
+        assignments = ", ".join(f"{k} = ?" for k in fields)
+        with self._lock:
+            conn = connect(self.db_path)
+            try:
+                with conn:
+                    conn.execute(f"UPDATE image_jobs SET {assignments} WHERE id = ?", [*fields.values(), job_id])
+            finally:
+                conn.close()
+
+    def submit(self, prompt: str, output_dir: str = "data/images") -> str:
+        key = image_cache_key(prompt, output_dir)
+        job_id, is_new = self._register(key, prompt, output_dir)
+        if is_new:
+            tracing.submit(self._pool, self._run, job_id, prompt, output_dir, key)
+            logging.info(f"🗂️ Job immagine {job_id} in coda")
+        return job_id
+
+    def _register(self, key: str, prompt: str, output_dir: str) -> tuple:
+        now = datetime.utcnow().isoformat()
+        with self._lock:
+            conn = connect(self.db_path)
+            try:
+                with conn:
+                    # Stessa immagine già in generazione: si riusa il job in corso
+                    running = conn.execute(
+                        "SELECT id FROM image_jobs WHERE cache_key = ? AND status IN ('queued', 'running')",
+                        (key,),
+                    ).fetchone()
+                    if running:
+                        self.stats["coalesced"] += 1
+                        logging.info(f"🔗 Richiesta immagine agganciata al job {running['id']}")
+                        return running["id"], False
+
+                    job_id = uuid.uuid4().hex
+                    cached = conn.execute(
+                        "SELECT image_path, variants FROM image_cache WHERE key = ?",
+                        (key,),
+                    ).fetchone()
+                    if cached and os.path.exists(cached["image_path"]):
+                        self.stats["cache_hits"] += 1
+                        logging.info(f"♻️ Immagine servita dalla cache per il job {job_id}")
+                        conn.execute(
+                            "INSERT INTO image_jobs (id, prompt, output_dir, status, image_url, variants, cache_key, created_at, updated_at) "
+                            "VALUES (?, ?, ?, 'done', ?, ?, ?, ?, ?)",
+                            (job_id, prompt, output_dir, public_image_url(cached["image_path"]), cached["variants"], key, now, now),
+                        )
+                        if cached["variants"] is None:
+                            # Varianti ancora in creazione: le aggiorna _variants_done tramite cache_key
+                            logging.info(f"⏳ Varianti non ancora pronte per il job {job_id}")
+                        return job_id, False
+
+                    conn.execute(
+                        "INSERT INTO image_jobs (id, prompt, output_dir, status, cache_key, created_at, updated_at) "
+                        "VALUES (?, ?, ?, 'queued', ?, ?, ?)",
+                        (job_id, prompt, output_dir, key, now, now),
+                    )
+                    return job_id, True
+            finally:
+                conn.close()
+
+    def _cache_result(self, key: str, job_id: str, image_path: str):
+        with self._lock:
+            conn = connect(self.db_path)
+            try:
+                with conn:
+                    conn.execute(
+                        "INSERT OR REPLACE INTO image_cache (key, job_id, image_path, created_at) VALUES (?, ?, ?, ?)",
+                        (key, job_id, image_path, datetime.utcnow().isoformat()),
+                    )
+            finally:
+                conn.close()
+
+    def _run(self, job_id: str, prompt: str, output_dir: str, key: str):
+        self._update(job_id, status="running")
+        try:
+            image_path = generate_image(prompt, output_dir=output_dir)
+            self._cache_result(key, job_id, image_path)
+            self._update(job_id, status="done", image_url=public_image_url(image_path))
+            with self._lock:
+                self.stats["generated"] += 1
+            logging.info(f"✅ Job immagine {job_id} completato")
+        except Exception as e:
+            logging.error(f"❌ Job immagine {job_id} fallito: {e}")
+            self._update(job_id, status="error", error=str(e))
+            return
+
+        # Le varianti web arrivano dopo, senza ritardare l'immagine originale
+        try:
+            schedule_variants(image_path).add_done_callback(lambda f: self._variants_done(job_id, key, f))
+        except Exception as e:
+            logging.error(f"⚠️ Varianti non pianificate per il job {job_id}: {e}")
+
+    def _variants_done(self, job_id: str, key: str, future):
+        try:
+            variants = json.dumps({name: public_image_url(path) for name, path in future.result().items()})
+        except Exception as e:
+            logging.error(f"⚠️ Errore creazione varianti per il job {job_id}: {e}")
+            return
+
+        # Le varianti appartengono all'immagine: si salvano in cache e su tutti i job
+        # serviti dalla cache nel frattempo, non solo su quello che l'ha generata
+        with self._lock:
+            conn = connect(self.db_path)
+            try:
+                with conn:
+                    conn.execute("UPDATE image_cache SET variants = ? WHERE key = ?", (variants, key))
+                    conn.execute(
+                        "UPDATE image_jobs SET variants = ?, updated_at = ? WHERE cache_key = ? AND status = 'done'",
+                        (variants, datetime.utcnow().isoformat(), key),
+                    )
+            finally:
+                conn.close()
+
+    def get(self, job_id: str) -> dict | None:
+        rows = get_store().query("SELECT * FROM image_jobs WHERE id = ?", (job_id,))
+        if not rows:
+            return None
+        job = rows[0]
+        job["variants"] = json.loads(job["variants"]) if job["variants"] else {}
+        return job
+
+    def resume_pending(self) -> int:
+        """Rimette in coda i job interrotti da un riavvio."""
+        pending = get_store().query(
+            "SELECT id, prompt, output_dir, cache_key FROM image_jobs WHERE status IN ('queued', 'running') ORDER BY created_at"
+        )
+        for job in pending:
+            key = job["cache_key"] or image_cache_key(job["prompt"], job["output_dir"])
+            self._update(job["id"], status="queued", cache_key=key)
+            tracing.submit(self._pool, self._run, job["id"], job["prompt"], job["output_dir"], key)
+        if pending:
+            logging.info(f"🔁 Ripresi {len(pending)} job immagine in sospeso")
+        return len(pending)
+
+
+_queue = None
+_queue_lock = threading.Lock()
+
+
+def get_image_jobs() -> ImageJobQueue:
+    global _queue
+    with _queue_lock:
+        if _queue is None:
+            _queue = ImageJobQueue()
+            _queue.resume_pending()
+    return _queue
@@ -0,0 +1,110 @@
+# image_store.py
+#
+# Salvataggio delle immagini generate senza decodifica: il download viene
+# scritto direttamente su disco calcolandone l'hash, e il file prende il nome
+# dal contenuto (immagini identiche = un solo file). Le varianti WebP per il
+# web vengono create in un process pool, fuori dal percorso della richiesta.
+
+import os
+import re
+import hashlib
+import logging
+import tempfile
+import threading
+import multiprocessing
+from concurrent.futures import ProcessPoolExecutor
+from dotenv import load_dotenv
+import requests
+
+load_dotenv()
+
+IMAGE_VARIANT_PROCESSES = int(os.getenv("IMAGE_VARIANT_PROCESSES", "1"))
+THUMBNAIL_SIZE = int(os.getenv("IMAGE_THUMBNAIL_SIZE", "512"))
+DOWNLOAD_CHUNK_SIZE = 64 * 1024
+
+# Nomi dei file content-addressed: <sha256>.<ext> e varianti <sha256>_<variante>.webp
+CONTENT_ADDRESSED_NAME = re.compile(r"^[0-9a-f]{64}(_[a-z]+)?\.(png|jpg|webp)$")
+
+MAGIC_EXTENSIONS = (
+    (b"\x89PNG", "png"),
+    (b"\xff\xd8", "jpg"),
+    (b"RIFF", "webp"),
+)
+
+
+def _extension_from_magic(head: bytes) -> str:
+    for magic, ext in MAGIC_EXTENSIONS:
+        if head.startswith(magic):
+            return ext
+    return "png"
+
+
+def download_content_addressed(url: str, output_dir: str, timeout: int = 60) -> str:
+    """Scarica `url` in `output_dir` con nome = sha256 del contenuto; ritorna il percorso."""
+    os.makedirs(output_dir, exist_ok=True)
+    digest = hashlib.sha256()
+    head = b""
+
+    with requests.get(url, stream=True, timeout=timeout) as resp:
+        if resp.status_code != 200:
+            raise RuntimeError("Errore download immagine")
+        with tempfile.NamedTemporaryFile(dir=output_dir, suffix=".part", delete=False) as tmp:
+            try:
+                for chunk in resp.iter_content(chunk_size=DOWNLOAD_CHUNK_SIZE):
+                    if not head:
+                        head = chunk[:8]
+                    digest.update(chunk)
+                    tmp.write(chunk)
+            except Exception:
+                tmp.close()
+                os.remove(tmp.name)
+                raise
+
+    output_path = os.path.join(output_dir, f"{digest.hexdigest()}.{_extension_from_magic(head)}")
+    if os.path.exists(output_path):
+        # Stessa immagine già salvata: scarto il duplicato
+        os.remove(tmp.name)
+    else:
+        os.replace(tmp.name, output_path)
+    return output_path
+
+
+def variant_paths(image_path: str) -> dict:
+    base, _ = os.path.splitext(image_path)
+    return {"webp": f"{base}_web.webp", "thumbnail": f"{base}_thumb.webp"}
+
+
+def make_variants(image_path: str) -> dict:
+    """Eseguita nel process pool: crea le varianti mancanti e ritorna i percorsi."""
+    from PIL import Image
+
+    paths = variant_paths(image_path)
+    part = f".{os.getpid()}.part"
+    with Image.open(image_path) as image:
+        if not os.path.exists(paths["webp"]):
+            image.save(paths["webp"] + part, format="WEBP", quality=85, method=4)
+            os.replace(paths["webp"] + part, paths["webp"])
+        if not os.path.exists(paths["thumbnail"]):
+            image.thumbnail((THUMBNAIL_SIZE, THUMBNAIL_SIZE))
+            image.save(paths["thumbnail"] + part, format="WEBP", quality=80, method=4)
+            os.replace(paths["thumbnail"] + part, paths["thumbnail"])
+    return paths
+
+
+_variant_pool = None
+_variant_pool_lock = threading.Lock()
+
+
+def schedule_variants(image_path: str):
+    """Mette in coda la creazione delle varianti; ritorna un Future con i percorsi."""
+    global _variant_pool
+    with _variant_pool_lock:
+        if _variant_pool is None:
+            # spawn, non fork: il pool nasce da un thread worker di un processo multithread
+            # e un fork potrebbe copiare lock tenuti da altri thread
+            _variant_pool = ProcessPoolExecutor(
+                max_workers=IMAGE_VARIANT_PROCESSES,
+                mp_context=multiprocessing.get_context("spawn"),
+            )
+    logging.info(f"🧵 Varianti web in coda per {os.path.basename(image_path)}")
+    return _variant_pool.submit(make_variants, image_path)
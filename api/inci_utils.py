@@ -1,11 +1,18 @@
 # inci_utils.py
 
 import os
+import io
 import re
 import csv
+import json
 import logging
-from datetime import datetime
-from api import call_fireworks_for_ingredient
+import threading
+import itertools
+from datetime import datetime, timedelta
+from concurrent.futures import ThreadPoolExecutor
+from api import call_fireworks_for_ingredient, call_fireworks_for_ingredients_batch, FIREWORKS_MODEL
+from history_store import save_inci_check
+import tracing
 from dotenv import load_dotenv
 
 load_dotenv()
@@ -15,6 +22,12 @@ ROOT_DIR = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
 # Percorsi CSV presi dagli env, con fallback
 GREEN_CSV = os.getenv("GREEN_CSV", os.path.join(ROOT_DIR, "data", "inci_green.csv"))
 RED_CSV   = os.getenv("RED_CSV",   os.path.join(ROOT_DIR, "data", "inci_red.csv"))
+# Terzo livello: verdetti LLM persistiti, da rivedere/promuovere in green o red
+LEARNED_CSV = os.getenv("LEARNED_CSV", os.path.join(ROOT_DIR, "data", "inci_learned.csv"))
+LEARNED_TTL_DAYS = float(os.getenv("INCI_LEARNED_TTL_DAYS", "90"))
+LEARNED_FIELDS = ["ingrediente", "status", "llm_raw", "model", "timestamp", "reviewed"]
+
+_learned_lock = threading.Lock()
 
 # ✅ Funzione per caricare un CSV in un set
 def load_csv_to_set(path):
@@ -35,84 +48,347 @@ def append_to_csv(path, ingredient):
         writer = csv.writer(f)
         writer.writerow([ingredient.strip().lower()])
 
-# ✅ Salva risultati in CSV
-def save_inci_check(ingredienti, risultati, csv_path=os.path.join(ROOT_DIR, "data", "inci_checks.csv")):
-    os.makedirs(os.path.dirname(csv_path), exist_ok=True)
+# ✅ Dizionario "learned": lettura, scrittura e workflow di revisione
+def load_learned(path=LEARNED_CSV) -> dict:
+    learned = {}
+    if not os.path.exists(path):
+        return learned
+    with open(path, newline='', encoding="utf-8") as f:
+        for row in csv.DictReader(f):
+            if row.get("ingrediente"):
+                learned[row["ingrediente"].strip().lower()] = row
+    return learned
+
+def _write_learned(learned: dict, path=LEARNED_CSV):
+    os.makedirs(os.path.dirname(path), exist_ok=True)
+    tmp_path = path + ".tmp"
+    with open(tmp_path, "w", newline='', encoding="utf-8") as f:
+        writer = csv.DictWriter(f, fieldnames=LEARNED_FIELDS)
+        writer.writeheader()
+        for entry in learned.values():
+            writer.writerow({k: entry.get(k, "") for k in LEARNED_FIELDS})
+    os.replace(tmp_path, path)
+
+def is_learned_fresh(entry: dict) -> bool:
+    # Le voci revisionate non scadono; le altre valgono LEARNED_TTL_DAYS giorni
+    if entry.get("reviewed") == "yes":
+        return True
+    try:
+        learned_at = datetime.fromisoformat(entry["timestamp"])
+    except (KeyError, ValueError):
+        return False
+    return datetime.utcnow() - learned_at < timedelta(days=LEARNED_TTL_DAYS)
+
+def save_learned(verdicts: dict, path=LEARNED_CSV):
+    to_save = {ing: v for ing, v in verdicts.items() if v["status"] != "not_found"}
+    if not to_save:
+        return
     timestamp = datetime.utcnow().isoformat()
-    ingredienti_str = "; ".join(ingredienti)
-    risultati_str = "; ".join([f"{r['ingrediente']}:{r['status']}" for r in risultati])
-    file_exists = os.path.exists(csv_path)
-    with open(csv_path, mode="a", newline="", encoding="utf-8") as f:
-        writer = csv.writer(f)
-        if not file_exists:
-            writer.writerow(["timestamp", "ingredienti", "risultati"])
-        writer.writerow([timestamp, ingredienti_str, risultati_str])
+    with _learned_lock:
+        learned = load_learned(path)
+        for ing, verdict in to_save.items():
+            learned[ing] = {
+                "ingrediente": ing,
+                "status": verdict["status"],
+                "llm_raw": verdict.get("llm_raw", ""),
+                "model": FIREWORKS_MODEL,
+                "timestamp": timestamp,
+                "reviewed": "no",
+            }
+        _write_learned(learned, path)
 
-# ✅ Pipeline principale con CSV e LLM
-def check_ingredients_pipeline(query: str):
-    # Carico i dizionari (ogni chiamata ricarica dai CSV per avere la lista aggiornata)
-    SET_GREEN = load_csv_to_set(GREEN_CSV)
-    SET_RED   = load_csv_to_set(RED_CSV)
+def review_learned(ingredient: str, status: str = None, path=LEARNED_CSV) -> dict:
+    ingredient = ingredient.strip().lower()
+    with _learned_lock:
+        learned = load_learned(path)
+        if ingredient not in learned:
+            raise KeyError(ingredient)
+        entry = learned[ingredient]
+        if status:
+            entry["status"] = status
+        entry["reviewed"] = "yes"
+        _write_learned(learned, path)
+    return entry
 
-    # Parsing ingredienti
-    ingredients = [i.strip().lower() for i in re.split(r"[,\n;]+|\s{2,}", query) if i.strip()]
-    if not ingredients:
-        return {"error": "Empty ingredient list"}
+def forget_learned(ingredient: str, path=LEARNED_CSV) -> dict:
+    ingredient = ingredient.strip().lower()
+    with _learned_lock:
+        learned = load_learned(path)
+        if ingredient not in learned:
+            raise KeyError(ingredient)
+        entry = learned.pop(ingredient)
+        _write_learned(learned, path)
+    return entry
 
-    results = []
-    llm_cache = {}
+def promote_learned(ingredient: str, target: str = None, path=LEARNED_CSV) -> str:
+    """Sposta una voce learned nel CSV green o red; ritorna la lista di destinazione."""
+    ingredient = ingredient.strip().lower()
+    with _learned_lock:
+        learned = load_learned(path)
+        if ingredient not in learned:
+            raise KeyError(ingredient)
+        if not target:
+            target = {"sustainable": "green", "harmful": "red"}.get(learned[ingredient]["status"])
+        if target not in ("green", "red"):
+            raise ValueError("Specificare la lista di destinazione (green o red)")
+        append_to_csv(GREEN_CSV if target == "green" else RED_CSV, ingredient)
+        learned.pop(ingredient)
+        _write_learned(learned, path)
+    return target
+
+# ✅ Classificazione LLM degli ingredienti sconosciuti
+INCI_BATCH_SIZE = int(os.getenv("INCI_BATCH_SIZE", "8"))
+INCI_LLM_CONCURRENCY = int(os.getenv("INCI_LLM_CONCURRENCY", "4"))
+
+VALID_STATUSES = ("harmful", "sustainable", "neutral")
 
+def status_from_llm_response(llm_resp: str) -> str:
+    llm_resp = llm_resp.lower()
+    if any(term in llm_resp for term in ["harmful", "avoid", "toxic"]):
+        return "harmful"
+    if any(term in llm_resp for term in ["sustainable", "natural", "green", "vegetable"]):
+        return "sustainable"
+    return "neutral"
+
+def classify_single_ingredient(ing: str) -> dict:
+    try:
+        llm_resp = call_fireworks_for_ingredient(ing).lower()
+        return {"status": status_from_llm_response(llm_resp), "llm_raw": llm_resp}
+    except Exception as e:
+        logging.error(f"❌ LLM error '{ing}': {e}")
+        return {"status": "not_found", "llm_raw": ""}
+
+def _classify_batch(batch: list) -> dict:
+    try:
+        verdicts = call_fireworks_for_ingredients_batch(batch)
+    except Exception as e:
+        logging.warning(f"⚠️ Batch LLM fallito ({len(batch)} ingredienti), fallback per singolo: {e}")
+        return {}
+
+    classified = {}
+    for ing in batch:
+        verdict = verdicts.get(ing)
+        if not verdict:
+            continue
+        status = verdict["status"]
+        if status not in VALID_STATUSES:
+            status = status_from_llm_response(f"{status} {verdict['reason']}")
+        classified[ing] = {"status": status, "llm_raw": f"{verdict['status']}: {verdict['reason']}".strip()}
+    return classified
+
+def classify_unknown_ingredients(unknowns: list, batch_size: int = None, max_workers: int = None) -> dict:
+    """Classifica tutti gli ingredienti sconosciuti di una richiesta.
+
+    Gli ingredienti vengono inviati a gruppi in prompt strutturati, eseguiti in
+    parallelo (max `max_workers` chiamate contemporanee); quelli che il batch
+    non restituisce vengono riclassificati singolarmente con lo stesso limite.
+    """
+    batch_size = batch_size or INCI_BATCH_SIZE
+    max_workers = max_workers or INCI_LLM_CONCURRENCY
+    unknowns = list(dict.fromkeys(unknowns))
+    if not unknowns:
+        return {}
+
+    verdicts = {}
+    with ThreadPoolExecutor(max_workers=max_workers) as pool:
+        if batch_size > 1:
+            batches = [unknowns[i:i + batch_size] for i in range(0, len(unknowns), batch_size)]
+            for future in [tracing.submit(pool, _classify_batch, batch) for batch in batches]:
+                verdicts.update(future.result())
+
+        missing = [ing for ing in unknowns if ing not in verdicts]
+        if missing:
+            logging.info(f"🔁 Classificazione singola di {len(missing)} ingredienti")
+            futures = [tracing.submit(pool, classify_single_ingredient, ing) for ing in missing]
+            for ing, future in zip(missing, futures):
+                verdicts[ing] = future.result()
+
+    return verdicts
+
+# ✅ Parsing e composizione dei risultati
+def parse_ingredients(query: str) -> list:
+    return [i.strip().lower() for i in re.split(r"[,\n;]+|\s{2,}", query) if i.strip()]
+
+def build_results(ingredients, set_green, set_red, learned, llm_verdicts) -> list:
+    results = []
     for ing in ingredients:
-        # ✅ Primo check sui CSV
-        if ing in SET_GREEN:
+        if ing in set_green:
             results.append({
                 "ingrediente": ing,
                 "status": "sustainable",
                 "source": "dict"
             })
-            continue
-        if ing in SET_RED:
+        elif ing in set_red:
             results.append({
                 "ingrediente": ing,
                 "status": "harmful",
                 "source": "dict"
             })
-            continue
-
-        # ✅ Nessun match locale → controlla cache LLM
-        if ing in llm_cache:
-            status = llm_cache[ing]
+        elif ing in learned:
             results.append({
                 "ingrediente": ing,
-                "status": status,
+                "status": learned[ing]["status"],
+                "source": "learned"
+            })
+        else:
+            results.append({
+                "ingrediente": ing,
+                "status": llm_verdicts[ing]["status"],
                 "source": "llm"
             })
-            continue
+    return results
 
-        # ✅ Chiamata a LLM (Fireworks)
-        try:
-            llm_resp = call_fireworks_for_ingredient(ing).lower()
-            if any(term in llm_resp for term in ["harmful", "avoid", "toxic"]):
-                status = "harmful"
-            elif any(term in llm_resp for term in ["sustainable", "natural", "green", "vegetable"]):
-                status = "sustainable"
-            else:
-                status = "neutral"
-        except Exception as e:
-            logging.error(f"❌ LLM error '{ing}': {e}")
-            status = "not_found"
+def resolve_unknowns(unknowns: list) -> dict:
+    # ✅ Gli sconosciuti vanno all'LLM in un'unica fase e vengono memorizzati
+    llm_verdicts = classify_unknown_ingredients(unknowns)
+    try:
+        save_learned(llm_verdicts)
+    except Exception as e:
+        logging.error(f"❌ Errore salvataggio learned: {e}")
+    return llm_verdicts
+
+# ✅ Pipeline principale con CSV e LLM
+def check_ingredients_pipeline(query: str):
+    # Parsing ingredienti
+    ingredients = parse_ingredients(query)
+    if not ingredients:
+        return {"error": "Empty ingredient list"}
+
+    with tracing.span("inci_lookup"):
+        # Carico i dizionari (ogni chiamata ricarica dai CSV per avere la lista aggiornata)
+        SET_GREEN = load_csv_to_set(GREEN_CSV)
+        SET_RED   = load_csv_to_set(RED_CSV)
 
-        llm_cache[ing] = status
-        results.append({
-            "ingrediente": ing,
-            "status": status,
-            "source": "llm"
-        })
+        # ✅ Primo check sui CSV green/red, poi sulle voci learned ancora valide
+        learned = {ing: e for ing, e in load_learned().items() if is_learned_fresh(e)}
+        unknowns = [ing for ing in ingredients if ing not in SET_GREEN and ing not in SET_RED and ing not in learned]
 
-    # ✅ Salvataggio CSV dei risultati
+    with tracing.span("inci_llm"):
+        llm_verdicts = resolve_unknowns(unknowns)
+    results = build_results(ingredients, SET_GREEN, SET_RED, learned, llm_verdicts)
+
+    # ✅ Salvataggio dei risultati nello storico
     try:
-        save_inci_check(ingredients, results)
+        with tracing.span("inci_history_write"):
+            save_inci_check(ingredients, results)
     except Exception as e:
         logging.error(f"❌ Errore salvataggio INCI: {e}")
 
     return {"results": results}
+
+# ✅ Screening bulk: formulazioni da CSV o da array JSON, lette in streaming
+INCI_BULK_WINDOW = int(os.getenv("INCI_BULK_WINDOW", "100"))
+BULK_QUERY_COLUMNS = ("ingredienti", "ingredients", "inci", "query")
+
+def iter_csv_formulations(fileobj):
+    """Legge un CSV (colonne `id` opzionale e `ingredienti`/`inci`/`query`) riga per riga."""
+    text = io.TextIOWrapper(fileobj, encoding="utf-8-sig", newline="")
+    reader = csv.DictReader(text)
+    fields = {name.strip().lower(): name for name in (reader.fieldnames or [])}
+    query_col = next((fields[c] for c in BULK_QUERY_COLUMNS if c in fields), None)
+    if not query_col:
+        raise ValueError(f"Colonna ingredienti mancante (una tra: {', '.join(BULK_QUERY_COLUMNS)})")
+    id_col = fields.get("id")
+    for n, row in enumerate(reader, start=1):
+        yield (row.get(id_col) if id_col else None) or n, row.get(query_col) or ""
+
+def iter_json_formulations(fileobj, chunk_size: int = 65536):
+    """Decodifica un array JSON un elemento alla volta, senza caricarlo tutto in memoria.
+
+    Ogni elemento può essere una stringa INCI oppure un oggetto con `id` e
+    `ingredienti`/`ingredients`/`inci`/`query` (stringa o lista).
+    """
+    decoder = json.JSONDecoder()
+    text = io.TextIOWrapper(fileobj, encoding="utf-8-sig")
+    buf = text.read(chunk_size).lstrip()
+    if not buf.startswith("["):
+        raise ValueError("Atteso un array JSON di formulazioni")
+    buf = buf[1:]
+    n = 0
+    eof = False
+    while True:
+        buf = buf.lstrip().lstrip(",").lstrip()
+        if buf.startswith("]"):
+            return
+        try:
+            item, end = decoder.raw_decode(buf)
+        except json.JSONDecodeError:
+            if eof:
+                raise ValueError("Array JSON non valido")
+            chunk = text.read(chunk_size)
+            eof = not chunk
+            buf += chunk
+            continue
+        if end == len(buf) and not eof:
+            # l'elemento potrebbe proseguire nel prossimo chunk (es. un numero)
+            chunk = text.read(chunk_size)
+            eof = not chunk
+            buf += chunk
+            continue
+        buf = buf[end:]
+        n += 1
+        if isinstance(item, dict):
+            query = next((item[c] for c in BULK_QUERY_COLUMNS if c in item), "")
+            if isinstance(query, list):
+                query = ", ".join(str(q) for q in query)
+            yield item.get("id") or n, str(query)
+        else:
+            yield n, str(item)
+
+def start_formulations(formulations):
+    """Legge subito la prima formulazione, così un header CSV o un array JSON non validi
+    sollevano ValueError prima che la risposta in streaming sia partita."""
+    first = next(formulations, None)
+    return iter(()) if first is None else itertools.chain([first], formulations)
+
+def iter_bulk_results(formulations):
+    """Genera un risultato per formulazione, non appena è pronto.
+
+    Le formulazioni con soli ingredienti noti escono subito; le altre restano in
+    una finestra di al più INCI_BULK_WINDOW elementi finché i loro sconosciuti
+    non vengono risolti, una sola volta per tutto il batch.
+    """
+    SET_GREEN = load_csv_to_set(GREEN_CSV)
+    SET_RED   = load_csv_to_set(RED_CSV)
+    learned = {ing: e for ing, e in load_learned().items() if is_learned_fresh(e)}
+    resolved = {}  # verdetti LLM già ottenuti in questo batch
+
+    window = []
+    pending = set()
+
+    def finish(fid, ingredients):
+        results = build_results(ingredients, SET_GREEN, SET_RED, learned, resolved)
+        try:
+            save_inci_check(ingredients, results)
+        except Exception as e:
+            logging.error(f"❌ Errore salvataggio INCI: {e}")
+        return {"id": fid, "results": results}
+
+    def flush():
+        resolved.update(resolve_unknowns(sorted(pending)))
+        pending.clear()
+        for fid, ingredients in window:
+            yield finish(fid, ingredients)
+        window.clear()
+
+    for fid, query in formulations:
+        ingredients = parse_ingredients(query)
+        if not ingredients:
+            yield {"id": fid, "error": "Empty ingredient list"}
+            continue
+
+        unknowns = {
+            ing for ing in ingredients
+            if ing not in SET_GREEN and ing not in SET_RED and ing not in learned and ing not in resolved
+        }
+        if not unknowns:
+            yield finish(fid, ingredients)
+            continue
+
+        window.append((fid, ingredients))
+        pending.update(unknowns)
+        if len(window) >= INCI_BULK_WINDOW or len(pending) >= INCI_BATCH_SIZE * INCI_LLM_CONCURRENCY:
+            yield from flush()
+
+    if window:
+        yield from flush()
@@ -1,24 +1,37 @@
 #main API
 
-from fastapi import FastAPI, HTTPException
-from pydantic import BaseModel
+from fastapi import FastAPI, HTTPException, Request
+from fastapi.responses import StreamingResponse
+from pydantic import BaseModel, field_validator
 from api import (
     call_fireworks,
-    save_to_csv,
+    stream_fireworks,
     translate,
-    generate_image,
-    create_product_from_trends,
-    save_product_to_csv
+    create_product_from_trends
 )
+from history_store import save_qa, save_product, get_store, EXPORT_COLUMNS
+from image_jobs import get_image_jobs, FINAL_STATUSES
+from image_store import CONTENT_ADDRESSED_NAME
+from streaming import IncrementalPostCleaner, sse_event
+from pipeline import StageGraph
+from semantic_cache import get_semantic_cache
+from context_packing import pack_context
+import retriever_inprocess
+import tracing
+from trends import load_trend_digest
 import requests
 import os
+import asyncio
 import logging
 from langdetect import detect, LangDetectException
 from dotenv import load_dotenv
 import re
+import io
+import csv
 import json
 from fastapi.staticfiles import StaticFiles
-from inci_utils import check_ingredients_pipeline
+from inci_utils import check_ingredients_pipeline, iter_bulk_results, iter_csv_formulations, iter_json_formulations, start_formulations
+import tempfile
 from fastapi.middleware.cors import CORSMiddleware
 
 app = FastAPI()
@@ -31,8 +44,12 @@ app.add_middleware(
     allow_credentials=True,
     allow_methods=["*"],
     allow_headers=["*"],
+    expose_headers=[tracing.TRACE_HEADER],
 )
 
+# Trace id per richiesta (inoltrato al retriever) e GET /metrics in formato Prometheus
+tracing.install(app, extra=retriever_inprocess.metrics_text)
+
 # Carica variabili ambiente
 load_dotenv()
 logging.basicConfig(level=logging.INFO, format="%(asctime)s - %(levelname)s - %(message)s")
@@ -45,8 +62,19 @@ data_path = os.path.join(ROOT_DIR, "data")
 if not os.path.exists(data_path):
     os.makedirs(data_path)
 
-# monta static per servire immagini salvate
-app.mount("/data", StaticFiles(directory=data_path), name="data")
+class CachedStaticFiles(StaticFiles):
+    """StaticFiles con cache lunga per i file content-addressed (il nome cambia se cambia il contenuto)."""
+
+    def file_response(self, full_path, stat_result, scope, status_code=200):
+        response = super().file_response(full_path, stat_result, scope, status_code)
+        if CONTENT_ADDRESSED_NAME.match(os.path.basename(full_path)):
+            response.headers["Cache-Control"] = "public, max-age=31536000, immutable"
+        else:
+            response.headers["Cache-Control"] = "no-cache"
+        return response
+
+# monta static per servire immagini salvate (ETag/304 gestiti da StaticFiles)
+app.mount("/data", CachedStaticFiles(directory=data_path), name="data")
 
 def extract_json(text: str):
     match = re.search(r"\{.*\}", text, re.DOTALL)
@@ -56,52 +84,103 @@ def extract_json(text: str):
     else:
         raise ValueError("Nessun JSON trovato nel testo")
 
-def getenv_path(env_var: str, root_dir: str, default: str) -> str:
-    val = os.getenv(env_var)
-    if val:
-        if not os.path.isabs(val):
-            abs_path = os.path.abspath(os.path.join(root_dir, val))
-            logging.info(f"📁 Path '{env_var}' risolto in '{abs_path}'")
-            return abs_path
-        else:
-            logging.info(f"📁 Path assoluto da env '{env_var}': {val}")
-            return val
-    return default
-
-CSV_PATH = getenv_path("CSV_PATH", ROOT_DIR, os.path.join(ROOT_DIR, "data", "qa_history_prompt.csv"))
 RETRIEVER_URL = os.getenv("RETRIEVER_URL", "http://localhost:9000/search")
+RETRIEVER_BATCH_URL = os.getenv("RETRIEVER_BATCH_URL", RETRIEVER_URL.rsplit("/", 1)[0] + "/search_batch")
+RETRIEVER_EMBED_URL = os.getenv("RETRIEVER_EMBED_URL", RETRIEVER_URL.rsplit("/", 1)[0] + "/embed")
+# http: retriever come servizio separato (default); inprocess: retriever/main.py importato nell'API
+RETRIEVER_MODE = os.getenv("RETRIEVER_MODE", "http").lower()
+
+# translate: query tradotta in inglese e risposta ritradotta (default)
+# native: retrieval sull'indice multilingue e post scritto direttamente nella lingua rilevata
+GENERATION_MODE = os.getenv("GENERATION_MODE", "translate").lower()
+NATIVE_LANGUAGES = {"it", "fr", "es", "de"}
+MULTILINGUAL_INDEX = "post_multilingual"
 
 class QueryRequest(BaseModel):
     query: str
     platform: str  # twitter / instagram
+    bypass_cache: bool = False  # forza una nuova generazione
 
 class InciRequest(BaseModel):
     query: str
 
+LANGUAGE_NAMES = {
+    "en": "English",
+    "it": "Italian",
+    "fr": "French",
+    "es": "Spanish",
+    "de": "German"
+}
+
 def lang_code_to_name(code: str) -> str:
-    mapping = {
-        "en": "English",
-        "it": "Italian",
-        "fr": "French",
-        "es": "Spanish",
-        "de": "German"
-    }
-    return mapping.get(code.lower(), "English")
+    return LANGUAGE_NAMES.get(code.lower(), "English")
 
+@tracing.traced("retriever_http")
 def get_context_from_query_http(query: str, index_type: str = "post") -> list:
     try:
         resp = requests.post(
             RETRIEVER_URL,
             json={"query": query, "index_type": index_type},
+            headers=tracing.trace_headers(),
             timeout=10
         )
         resp.raise_for_status()
         data = resp.json()
+        if "error" in data:
+            logging.error(f"❌ Errore dal retriever: {data['error']}")
         return data.get("results", [])
     except Exception as e:
         logging.error(f"❌ Errore chiamando retriever: {e}")
         return []
 
+def get_context_from_query(query: str, index_type: str = "post") -> list:
+    if RETRIEVER_MODE != "inprocess":
+        return get_context_from_query_http(query, index_type)
+    try:
+        return retriever_inprocess.search(query, index_type)
+    except Exception as e:
+        logging.error(f"❌ Errore retriever in-process: {e}")
+        return []
+
+def get_contexts_batch(queries: list, index_type: str = "post") -> list:
+    if RETRIEVER_MODE != "inprocess":
+        return get_contexts_batch_http(queries, index_type)
+    try:
+        return retriever_inprocess.search_batch(queries, index_type)
+    except Exception as e:
+        logging.error(f"❌ Errore retriever in-process: {e}")
+        return [[] for _ in queries]
+
+def embed_request(text: str) -> list:
+    """Embedding di una richiesta con il modello del retriever (cache semantica); solleva se non disponibile."""
+    if RETRIEVER_MODE == "inprocess":
+        return retriever_inprocess.embed([text])[0]
+    with tracing.span("retriever_embed"):
+        resp = requests.post(
+            RETRIEVER_EMBED_URL,
+            json={"texts": [text]},
+            headers=tracing.trace_headers(),
+            timeout=5
+        )
+    resp.raise_for_status()
+    return resp.json()["embeddings"][0]
+
+def get_contexts_batch_http(queries: list, index_type: str = "post") -> list:
+    """Una sola richiesta al retriever per più query; ritorna le liste di documenti nello stesso ordine."""
+    try:
+        with tracing.span("retriever_http_batch"):
+            resp = requests.post(
+                RETRIEVER_BATCH_URL,
+                json={"requests": [{"query": q, "index_type": index_type} for q in queries]},
+                headers=tracing.trace_headers(),
+                timeout=60
+            )
+        resp.raise_for_status()
+        return [result.get("results", []) for result in resp.json()["results"]]
+    except Exception as e:
+        logging.error(f"❌ Errore retriever batch, ripiego su ricerche singole: {e}")
+        return [get_context_from_query_http(q, index_type) for q in queries]
+
 def clean_generated_text(text: str, max_len: int = 280) -> str:
     text = re.sub(r"(?i)(here is the translation:?|let me know[^\n]*)", "", text).strip()
     lines = list(dict.fromkeys(text.split("\n")))  # deduplica righe
@@ -110,75 +189,465 @@ def clean_generated_text(text: str, max_len: int = 280) -> str:
         cleaned = cleaned[:max_len].rsplit(" ", 1)[0] + "..."
     return cleaned
 
+def detect_language(text: str) -> str:
+    try:
+        detected_lang = detect(text)
+        logging.info(f"🌐 Lingua rilevata: {detected_lang}")
+    except LangDetectException:
+        detected_lang = "en"
+        logging.warning("⚠️ Lingua non rilevata, default 'en'")
+    return detected_lang
+
+def translate_query(original_query: str, detected_lang: str) -> str:
+    if detected_lang == "en":
+        return original_query
+    try:
+        query_en = translate(original_query, target_language="English")
+        logging.info(f"🈯 Query tradotta in inglese: {query_en}")
+        return query_en
+    except Exception as e:
+        logging.error(f"❌ Errore traduzione query: {e}")
+        return original_query
+
+def get_context_docs(query_en: str, index_type: str = "post") -> list:
+    context_docs = get_context_from_query(query_en, index_type=index_type)
+    logging.info(f"📚 Contesto ricevuto ({sum(len(doc['content']) for doc in context_docs)} caratteri in {len(context_docs)} documenti)")
+    return context_docs
+
+def writes_natively(detected_lang: str) -> bool:
+    return GENERATION_MODE == "native" and detected_lang in NATIVE_LANGUAGES
+
+def prepare_query(original_query: str, detected_lang: str) -> str:
+    # In modalità nativa la query resta nella lingua originale
+    if writes_natively(detected_lang):
+        return original_query
+    return translate_query(original_query, detected_lang)
+
+def retrieve_docs(query: str, original_query: str, detected_lang: str) -> list:
+    if not writes_natively(detected_lang):
+        return get_context_docs(query)
+    context_docs = get_context_docs(query, index_type=MULTILINGUAL_INDEX)
+    if context_docs:
+        return context_docs
+    # Indice multilingue non disponibile: si torna al percorso con traduzione
+    logging.warning("⚠️ Nessun contesto dall'indice multilingue, uso la query tradotta")
+    return get_context_docs(translate_query(original_query, detected_lang))
+
+def generation_language(detected_lang: str) -> str:
+    return lang_code_to_name(detected_lang) if writes_natively(detected_lang) else "English"
+
+def translate_answer(answer: str, detected_lang: str) -> str:
+    if detected_lang == "en" or writes_natively(detected_lang):
+        return answer
+    try:
+        answer_final = translate(answer, target_language=lang_code_to_name(detected_lang))
+        logging.info("✅ Risposta tradotta nella lingua originale")
+        return answer_final
+    except Exception as e:
+        logging.error(f"❌ Errore traduzione risposta: {e}")
+        return answer
+
 @app.get("/health")
 async def healthcheck():
     return {"status": "ok"}
 
+# Storico: apre il database (e importa i vecchi CSV) all'avvio, poi riprende i job immagine
+get_store()
+get_image_jobs()
+get_semantic_cache().embedder = embed_request
+if RETRIEVER_MODE == "inprocess":
+    # Indice caricato all'avvio, non alla prima richiesta; se manca il retriever l'API non parte
+    retriever_inprocess.load_retriever()
+
+def cache_metric_samples():
+    """Hit rate della cache semantica e della coda immagini, letti a ogni scrape di /metrics."""
+    cache = get_semantic_cache().metrics()
+    for result in ("hits", "misses", "bypassed", "unavailable"):
+        yield ("semantic_cache_lookups_total", "counter", "Ricerche nella cache semantica per esito", {"result": result}, cache[result])
+    yield ("semantic_cache_hit_ratio", "gauge", "Quota di hit della cache semantica", {}, cache["hit_rate"])
+    yield ("semantic_cache_entries", "gauge", "Voci nella cache semantica", {}, cache["entries"])
+
+    jobs = dict(get_image_jobs().stats)
+    for result, value in jobs.items():
+        yield ("image_requests_total", "counter", "Richieste di immagini per esito (generata, da cache, agganciata a un job)", {"result": result}, value)
+    total = sum(jobs.values())
+    reused = jobs["cache_hits"] + jobs["coalesced"]
+    yield ("image_cache_hit_ratio", "gauge", "Quota di immagini servite senza nuova generazione", {}, round(reused / total, 3) if total else 0.0)
+
+tracing.register_collector(cache_metric_samples)
+IMAGE_JOB_POLL_SECONDS = 0.5
+
+@app.get("/cache/stats")
+async def cache_stats():
+    return get_semantic_cache().metrics()
+
+@app.get("/history/{table}")
+async def history(table: str, limit: int = 50):
+    if table not in EXPORT_COLUMNS:
+        raise HTTPException(status_code=404, detail=f"Unknown table: {table}")
+    return {"results": get_store().recent(table, limit)}
+
+@app.get("/export/{table}")
+def export_history(table: str):
+    if table not in EXPORT_COLUMNS:
+        raise HTTPException(status_code=404, detail=f"Unknown table: {table}")
+    store = get_store()
+    store.flush()
+
+    def csv_lines():
+        buf = io.StringIO()
+        writer = csv.writer(buf)
+        for row in store.iter_csv_rows(table):
+            writer.writerow(row)
+            yield buf.getvalue()
+            buf.seek(0)
+            buf.truncate()
+
+    return StreamingResponse(
+        csv_lines(),
+        media_type="text/csv",
+        headers={"Content-Disposition": f"attachment; filename={table}.csv"},
+    )
+
+# /generate come grafo di fasi: immagine e traduzione della risposta dipendono
+# solo dal testo generato e partono insieme; il salvataggio nello storico non
+# blocca la risposta.
+def stage_generate(ctx: dict) -> dict:
+    try:
+        answer_en = call_fireworks(
+            ctx["translate_query"], ctx["pack_context"]["text"], ctx["platform"].capitalize(), generation_language(ctx["detect"])
+        )
+        return {"answer_en": clean_generated_text(answer_en), "ok": True}
+    except Exception as e:
+        logging.error(f"❌ Errore generazione risposta: {e}")
+        return {"answer_en": "Sorry, I couldn't get an answer.", "ok": False}
+
+def stage_pack_context(ctx: dict) -> dict:
+    context_str, report = pack_context(ctx["retrieve"])
+    return {"text": context_str, "report": report}
+
+def stage_image(ctx: dict) -> str | None:
+    if ctx["platform"] != "instagram" or not ctx["generate"]["ok"]:
+        return None
+    # L'immagine arriva dopo: il client segue il job via polling o SSE
+    return get_image_jobs().submit(prompt=ctx["generate"]["answer_en"])
+
+def stage_persist(ctx: dict):
+    save_qa(ctx["query"], ctx["translate_answer"])
+
+generate_graph = (
+    StageGraph("/generate")
+    .add("detect", lambda ctx: ctx.get("language") or detect_language(ctx["query"]))
+    .add("translate_query", lambda ctx: prepare_query(ctx["query"], ctx["detect"]), deps=["detect"])
+    .add("retrieve", lambda ctx: retrieve_docs(ctx["translate_query"], ctx["query"], ctx["detect"]), deps=["translate_query"])
+    .add("pack_context", stage_pack_context, deps=["retrieve"])
+    .add("generate", stage_generate, deps=["translate_query", "pack_context"])
+    .add("image", stage_image, deps=["generate"])
+    .add("translate_answer", lambda ctx: translate_answer(ctx["generate"]["answer_en"], ctx["detect"]), deps=["detect", "generate"])
+    .add("persist", stage_persist, deps=["translate_answer"], background=True)
+)
+
 @app.post("/generate")
 async def generate(data: QueryRequest):
     original_query = data.query.strip()
     platform = data.platform.strip().lower()
     logging.info(f"📥 Query ricevuta: {original_query} (platform={platform})")
 
+    # Richieste quasi identiche per la stessa piattaforma e lingua riusano la risposta
+    detected_lang = await asyncio.to_thread(detect_language, original_query)
+    cache_partition = ("generate", platform, detected_lang)
+    cached, similarity = await asyncio.to_thread(get_semantic_cache().lookup, cache_partition, original_query, data.bypass_cache)
+    if cached:
+        save_qa(original_query, cached["answer"])
+        return {**cached, "cached": True, "similarity": round(similarity, 3)}
+
+    ctx, timings = await generate_graph.run(query=original_query, platform=platform, language=detected_lang)
+    response = {
+        "answer": ctx["translate_answer"],
+        "image_url": None,
+        "image_job_id": ctx["image"],
+    }
+    if ctx["generate"]["ok"]:
+        await asyncio.to_thread(get_semantic_cache().store, cache_partition, original_query, response)
+    return {**response, "timings": timings, "context_tokens": ctx["pack_context"]["report"], "cached": False}
+
+def generate_stream_events(original_query: str, platform: str, bypass_cache: bool = False):
+    """Versione streaming di /generate: eventi SSE `token`, poi `done` con il testo finale."""
+    detected_lang = detect_language(original_query)
+    yield sse_event("meta", {"language": detected_lang, "platform": platform})
+
+    cache_partition = ("generate", platform, detected_lang)
+    cached, similarity = get_semantic_cache().lookup(cache_partition, original_query, bypass=bypass_cache)
+    if cached:
+        save_qa(original_query, cached["answer"])
+        yield sse_event("token", {"text": cached["answer"]})
+        yield sse_event("done", {**cached, "cached": True, "similarity": round(similarity, 3)})
+        return
+
+    query_en = prepare_query(original_query, detected_lang)
+    context_str, context_report = pack_context(retrieve_docs(query_en, original_query, detected_lang))
+
+    cleaner = IncrementalPostCleaner()
+    image_job_id = None
     try:
-        detected_lang = detect(original_query)
-        logging.info(f"🌐 Lingua rilevata: {detected_lang}")
-    except LangDetectException:
-        detected_lang = "en"
-        logging.warning("⚠️ Lingua non rilevata, default 'en'")
+        for delta in stream_fireworks(query_en, context_str, platform.capitalize(), generation_language(detected_lang)):
+            text = cleaner.feed(delta)
+            if text:
+                yield sse_event("token", {"text": text})
+            if cleaner.done:
+                break
+        text = cleaner.close()
+        if text:
+            yield sse_event("token", {"text": text})
+        answer_en = cleaner.text
 
-    query_en = original_query
-    if detected_lang != "en":
-        try:
-            query_en = translate(original_query, target_language="English")
-            logging.info(f"🈯 Query tradotta in inglese: {query_en}")
-        except Exception as e:
-            logging.error(f"❌ Errore traduzione query: {e}")
-            query_en = original_query
+        if platform == "instagram":
+            image_job_id = get_image_jobs().submit(prompt=answer_en)
+        generated = True
+    except Exception as e:
+        logging.error(f"❌ Errore generazione risposta: {e}")
+        answer_en = "Sorry, I couldn't get an answer."
+        generated = False
+        yield sse_event("error", {"detail": answer_en})
 
-    context_docs = get_context_from_query_http(query_en, index_type="post")
-    context_str = "\n".join(doc["content"] for doc in context_docs)
-    logging.info(f"📚 Contesto ricevuto ({sum(len(doc['content']) for doc in context_docs)} caratteri in {len(context_docs)} documenti)")
+    # Con la traduzione, per le lingue diverse dall'inglese il testo definitivo arriva con `done`
+    answer_final = translate_answer(answer_en, detected_lang)
 
     try:
-        answer_en = call_fireworks(query_en, context_str, platform.capitalize())
-        answer_en = clean_generated_text(answer_en)
+        save_qa(original_query, answer_final)
+    except Exception as e:
+        logging.error(f"❌ Errore salvataggio storico: {e}")
 
-        image_url = None
-        if platform == "instagram":
-            image_path = generate_image(prompt=answer_en)  # es: .../data/images/post_123.png
-            filename = os.path.basename(image_path)        # post_123.png
-            subfolder = os.path.basename(os.path.dirname(image_path))  # images
-            image_url = f"http://localhost:8000/data/{subfolder}/{filename}"
-            logging.info(f"✅ Immagine disponibile a: {image_url}")
+    response = {"answer": answer_final, "image_url": None, "image_job_id": image_job_id}
+    if generated:
+        get_semantic_cache().store(cache_partition, original_query, response)
+    yield sse_event("done", {**response, "context_tokens": context_report, "cached": False})
 
-    except Exception as e:
-        logging.error(f"❌ Errore generazione risposta: {e}")
-        answer_en = "Sorry, I couldn't get an answer."
-        image_url = None
+@app.post("/generate_stream")
+async def generate_stream(data: QueryRequest):
+    original_query = data.query.strip()
+    platform = data.platform.strip().lower()
+    logging.info(f"📥 Query ricevuta (streaming): {original_query} (platform={platform})")
+    return StreamingResponse(
+        generate_stream_events(original_query, platform, data.bypass_cache),
+        media_type="text/event-stream",
+        headers={"Cache-Control": "no-cache", "X-Accel-Buffering": "no"},
+    )
+
+# --- Campagne: molti post in una richiesta ---
+CAMPAIGN_CONCURRENCY = int(os.getenv("CAMPAIGN_CONCURRENCY", "4"))
+CAMPAIGN_MAX_ITEMS = int(os.getenv("CAMPAIGN_MAX_ITEMS", "200"))
+# Condiviso da tutte le campagne: limita i thread che occupano in attesa di Fireworks,
+# il tetto complessivo sulle chiamate resta FIREWORKS_CONCURRENCY (api.py)
+campaign_llm_slots = asyncio.Semaphore(CAMPAIGN_CONCURRENCY)
+
+class CampaignItem(BaseModel):
+    query: str
+    platform: str               # twitter / instagram
+    language: str | None = None  # lingua del post (it, en, ...); default quella della query
+
+    @field_validator("language")
+    @classmethod
+    def known_language(cls, value):
+        # Un codice sconosciuto diventerebbe inglese in silenzio: meglio un 422
+        if value is not None and value.strip().lower() not in LANGUAGE_NAMES:
+            raise ValueError(f"Unsupported language '{value}' (use one of: {', '.join(LANGUAGE_NAMES)})")
+        return value
+
+class CampaignRequest(BaseModel):
+    items: list[CampaignItem]
+
+class CampaignRun:
+    """Lavoro condiviso tra gli item di una campagna: ogni traduzione o post identico viene calcolato una volta."""
+
+    def __init__(self):
+        self.shared = {}
+        self.stats = {"llm_calls": 0, "shared": 0}
+
+    def once(self, key: tuple, factory):
+        task = self.shared.get(key)
+        if task is None:
+            task = self.shared[key] = asyncio.ensure_future(factory())
+        else:
+            self.stats["shared"] += 1
+        return task
+
+    async def llm(self, fn, *args):
+        async with campaign_llm_slots:
+            self.stats["llm_calls"] += 1
+            return await asyncio.to_thread(fn, *args)
 
-    answer_final = answer_en
-    if detected_lang != "en":
+    async def translate(self, text: str, language_code: str) -> str:
         try:
-            answer_final = translate(answer_en, target_language=lang_code_to_name(detected_lang))
-            logging.info("✅ Risposta tradotta nella lingua originale")
+            return await self.once(
+                ("translate", text, language_code),
+                lambda: self.llm(translate, text, lang_code_to_name(language_code)),
+            )
         except Exception as e:
-            logging.error(f"❌ Errore traduzione risposta: {e}")
+            logging.error(f"❌ Errore traduzione campagna: {e}")
+            return text
 
+    async def post(self, query_en: str, context_str: str, platform: str, language_code: str) -> str:
+        async def generate_post():
+            language = lang_code_to_name(language_code) if language_code != "en" else "English"
+            return clean_generated_text(await self.llm(call_fireworks, query_en, context_str, platform.capitalize(), language))
+        return await self.once(("post", query_en, platform, language_code), generate_post)
+
+async def run_campaign_item(run: CampaignRun, index: int, item: dict, context_str: str) -> dict:
+    result = {"index": index, "query": item["query"], "platform": item["platform"], "language": item["language"]}
     try:
-        save_to_csv(original_query, answer_final, CSV_PATH)
+        if item["language"] != "en" and writes_natively(item["language"]):
+            answer = await run.post(item["query_en"], context_str, item["platform"], item["language"])
+            image_prompt = answer
+        else:
+            # Un solo post inglese per query e piattaforma, poi una traduzione per lingua
+            image_prompt = await run.post(item["query_en"], context_str, item["platform"], "en")
+            answer = image_prompt if item["language"] == "en" else await run.translate(image_prompt, item["language"])
+
+        image_job_id = None
+        if item["platform"] == "instagram":
+            image_job_id = await asyncio.to_thread(get_image_jobs().submit, image_prompt)
+        save_qa(item["query"], answer)
+        return {**result, "answer": answer, "image_url": None, "image_job_id": image_job_id}
     except Exception as e:
-        logging.error(f"❌ Errore salvataggio CSV: {e}")
-
-    return {"answer": answer_final, "image_url": image_url}
+        logging.error(f"❌ Errore item {index} della campagna: {e}")
+        return {**result, "error": str(e)}
+
+async def campaign_lines(items: list):
+    run = CampaignRun()
+    start = asyncio.get_running_loop().time()
+
+    # Lingua e traduzione inglese calcolate una volta per query distinta
+    queries = list(dict.fromkeys(item.query.strip() for item in items))
+    languages = await asyncio.gather(*(asyncio.to_thread(detect_language, q) for q in queries))
+    queries_en = await asyncio.gather(*(
+        run.translate(q, "en") if lang != "en" else asyncio.sleep(0, q)
+        for q, lang in zip(queries, languages)
+    ))
+    query_en = dict(zip(queries, queries_en))
+    query_lang = dict(zip(queries, languages))
+
+    # Tutto il retrieval in una sola richiesta al retriever
+    unique_en = list(dict.fromkeys(queries_en))
+    docs = await asyncio.to_thread(get_contexts_batch, unique_en)
+    contexts = {q: pack_context(d)[0] for q, d in zip(unique_en, docs)}
+    logging.info(f"📚 Contesti campagna: {len(unique_en)} query distinte per {len(items)} item")
+
+    tasks = []
+    for index, item in enumerate(items):
+        query = item.query.strip()
+        normalized = {
+            "query": query,
+            "query_en": query_en[query],
+            "platform": item.platform.strip().lower(),
+            "language": (item.language or query_lang[query]).strip().lower(),
+        }
+        tasks.append(run_campaign_item(run, index, normalized, contexts[query_en[query]]))
+
+    for finished in asyncio.as_completed(tasks):
+        yield json.dumps(await finished, ensure_ascii=False) + "\n"
+
+    elapsed = asyncio.get_running_loop().time() - start
+    summary = {**run.stats, "items": len(items), "seconds": round(elapsed, 2)}
+    logging.info(f"📣 Campagna completata: {summary}")
+    yield json.dumps({"summary": summary}) + "\n"
+
+@app.post("/generate_campaign")
+async def generate_campaign(data: CampaignRequest):
+    """Genera tutti gli item della campagna; risultati in NDJSON, una riga per item appena pronto."""
+    if not data.items:
+        raise HTTPException(status_code=400, detail="No items")
+    if len(data.items) > CAMPAIGN_MAX_ITEMS:
+        raise HTTPException(status_code=413, detail=f"Too many items (max {CAMPAIGN_MAX_ITEMS})")
+    logging.info(f"📥 Campagna ricevuta: {len(data.items)} item")
+    return StreamingResponse(campaign_lines(data.items), media_type="application/x-ndjson")
+
+@app.get("/image_jobs/{job_id}")
+async def image_job_status(job_id: str):
+    job = get_image_jobs().get(job_id)
+    if not job:
+        raise HTTPException(status_code=404, detail="Unknown image job")
+    return job
+
+@app.get("/image_jobs/{job_id}/events")
+async def image_job_events(job_id: str):
+    jobs = get_image_jobs()
+    if not jobs.get(job_id):
+        raise HTTPException(status_code=404, detail="Unknown image job")
+
+    async def events():
+        last_status = None
+        while True:
+            job = jobs.get(job_id)
+            if job["status"] != last_status:
+                last_status = job["status"]
+                yield f"event: status\ndata: {json.dumps(job)}\n\n"
+            if job["status"] in FINAL_STATUSES:
+                return
+            await asyncio.sleep(IMAGE_JOB_POLL_SECONDS)
+
+    return StreamingResponse(events(), media_type="text/event-stream", headers={"Cache-Control": "no-cache"})
 
 @app.post("/check_inci")
 async def check_inci(data: InciRequest):
     query = data.query.strip()
-    result = check_ingredients_pipeline(query)
-    return result
+    # Fuori dall'event loop: la pipeline attende le chiamate Fireworks dei suoi thread
+    return await asyncio.to_thread(check_ingredients_pipeline, query)
 
-from inci_utils import append_to_csv, GREEN_CSV, RED_CSV
+def ndjson_lines(formulations):
+    try:
+        for item in iter_bulk_results(formulations):
+            yield json.dumps(item, ensure_ascii=False) + "\n"
+    except ValueError as e:
+        # Errore a metà file: lo stato 200 è già stato inviato
+        logging.error(f"❌ Errore lettura formulazioni: {e}")
+        yield json.dumps({"error": str(e)}) + "\n"
+
+@app.post("/check_inci_bulk")
+async def check_inci_bulk(request: Request):
+    """Screening di molte formulazioni: file CSV/JSON (multipart, campo `file`) o array JSON nel body.
+
+    I risultati tornano come NDJSON, una riga per formulazione appena pronta.
+    """
+    content_type = request.headers.get("content-type", "")
+
+    if content_type.startswith("multipart/form-data"):
+        # Starlette salva l'upload su un file temporaneo (in memoria solo i primi MB)
+        form = await request.form()
+        upload = form.get("file")
+        if upload is None or isinstance(upload, str):
+            raise HTTPException(status_code=400, detail="Missing file")
+        is_json = (upload.filename or "").lower().endswith(".json") or upload.content_type == "application/json"
+        source = upload.file
+    elif content_type.startswith("application/json"):
+        # Il body viene copiato a blocchi su file temporaneo e decodificato in streaming
+        source = tempfile.SpooledTemporaryFile(max_size=1024 * 1024)
+        async for chunk in request.stream():
+            source.write(chunk)
+        source.seek(0)
+        is_json = True
+    else:
+        raise HTTPException(status_code=415, detail="Use multipart/form-data or application/json")
+
+    formulations = iter_json_formulations(source) if is_json else iter_csv_formulations(source)
+    try:
+        # Errori di formato prima dello streaming: 400, non una riga di errore con stato 200
+        formulations = start_formulations(formulations)
+    except ValueError as e:
+        logging.error(f"❌ Formulazioni non valide: {e}")
+        raise HTTPException(status_code=400, detail=str(e))
+    return StreamingResponse(ndjson_lines(formulations), media_type="application/x-ndjson")
+
+from inci_utils import (
+    append_to_csv,
+    GREEN_CSV,
+    RED_CSV,
+    load_learned,
+    is_learned_fresh,
+    review_learned,
+    forget_learned,
+    promote_learned
+)
 
 class IngredientRequest(BaseModel):
     ingredient: str
@@ -205,24 +674,82 @@ async def add_red(data: IngredientRequest):
     except Exception as e:
         raise HTTPException(status_code=500, detail=f"Errore scrittura CSV: {e}")
 
+class LearnedReviewRequest(BaseModel):
+    ingredient: str
+    status: str | None = None  # sustainable / harmful / neutral
+
+class LearnedPromoteRequest(BaseModel):
+    ingredient: str
+    list: str | None = None  # green / red (default: dedotto dallo status)
+
+@app.get("/learned")
+async def list_learned():
+    entries = []
+    for entry in load_learned().values():
+        entries.append({**entry, "expired": not is_learned_fresh(entry)})
+    return {"results": entries}
+
+@app.post("/review_learned")
+async def review_learned_entry(data: LearnedReviewRequest):
+    if data.status and data.status not in ("sustainable", "harmful", "neutral"):
+        raise HTTPException(status_code=400, detail="Invalid status")
+    try:
+        entry = review_learned(data.ingredient, data.status)
+        return {"status": "ok", "entry": entry}
+    except KeyError:
+        raise HTTPException(status_code=404, detail="Ingredient not in learned list")
+
+@app.post("/promote_learned")
+async def promote_learned_entry(data: LearnedPromoteRequest):
+    try:
+        target = promote_learned(data.ingredient, data.list)
+        return {"status": "ok", "ingredient": data.ingredient.strip().lower(), "list": target}
+    except KeyError:
+        raise HTTPException(status_code=404, detail="Ingredient not in learned list")
+    except ValueError as e:
+        raise HTTPException(status_code=400, detail=str(e))
+
+@app.post("/forget_learned")
+async def forget_learned_entry(data: IngredientRequest):
+    try:
+        entry = forget_learned(data.ingredient)
+        return {"status": "ok", "entry": entry}
+    except KeyError:
+        raise HTTPException(status_code=404, detail="Ingredient not in learned list")
+
 class ProductRequest(BaseModel):
     hint: str | None = None
+    bypass_cache: bool = False  # forza un nuovo prodotto
 
 @app.post("/create_product")
 async def create_product(data: ProductRequest):
     hint = (data.hint or "").strip()
     logging.info(f"🧪 Richiesta creazione prodotto (hint={hint})")
 
+    # Senza suggerimento il prodotto dipende dal trend digest, non dal testo: niente cache
+    use_cache = bool(hint)
+    cached, similarity = None, 0.0
+    if use_cache:
+        cache_partition = ("create_product", "product", detect_language(hint))
+        cached, similarity = await asyncio.to_thread(get_semantic_cache().lookup, cache_partition, hint, data.bypass_cache)
+    if cached:
+        return {**cached, "cached": True, "similarity": round(similarity, 3)}
+
     try:
-        context_docs = get_context_from_query_http(hint or "trend skincare green", index_type="post")
-        context_str = "\n".join(doc.get("content", "") for doc in context_docs)
-        logging.info(f"📚 Contesto per create_product: {len(context_docs)} documenti")
+        if not hint and load_trend_digest():
+            # Senza suggerimento bastano i trend del digest: nessun retrieval
+            context_str = ""
+            logging.info("📈 Contesto per create_product dal trend digest")
+        else:
+            context_docs = await asyncio.to_thread(get_context_from_query, hint or "trend skincare green", "post")
+            context_str, _ = pack_context(context_docs)
+            logging.info(f"📚 Contesto per create_product: {len(context_docs)} documenti")
     except Exception as e:
         logging.error(f"❌ Errore recupero contesto: {e}")
         raise HTTPException(status_code=500, detail="Errore recupero contesto")
 
     try:
-        raw_output = create_product_from_trends(context_str, hint)
+        raw_output = await asyncio.to_thread(create_product_from_trends, context_str, hint)
         logging.info(f"📝 Output LLM (grezzo): {raw_output}")
 
         if isinstance(raw_output, dict) and "nome_prodotto" in raw_output:
@@ -245,26 +772,20 @@ async def create_product(data: ProductRequest):
                 logging.error(f"⚠️ Errore parsing JSON: {e}\n---STRINGA CHE HA FALLITO---\n{json_str}\n--------------------------")
                 raise HTTPException(status_code=500, detail=f"Errore parsing JSON: {e}")
 
-        if "image_prompt" in product and "image_url" not in product:
-            try:
-                from api import generate_image, ROOT_DIR
-                image_path = generate_image(product["image_prompt"], output_dir="data/product_images")
-                
-                filename = os.path.basename(image_path)        
-                subfolder = os.path.basename(os.path.dirname(image_path))  
-                product["image_url"] = f"http://localhost:8000/data/{subfolder}/{filename}"
-
-                logging.info(f"✅ Immagine disponibile a: {product['image_url']}")
-
-            except Exception as e:
-                logging.error(f"⚠️ Errore generazione immagine: {e}")
+        # Una sola generazione per prodotto: l'URL arriva sempre dal job (cache o nuova immagine)
+        product.pop("image_url", None)
+        if product.get("image_prompt") and "image_job_id" not in product:
+            product["image_job_id"] = await asyncio.to_thread(get_image_jobs().submit, product["image_prompt"], "data/product_images")
 
         try:
-            save_product_to_csv(product)
+            with tracing.span("product_history_write"):
+                save_product(product)
         except Exception as e:
-            logging.error(f"⚠️ Errore salvataggio CSV prodotto: {e}")
+            logging.error(f"⚠️ Errore salvataggio storico prodotto: {e}")
 
-        return product
+        if use_cache:
+            await asyncio.to_thread(get_semantic_cache().store, cache_partition, hint, product)
+        return {**product, "cached": False}
 
     except Exception as e:
         logging.error(f"❌ Errore creazione prodotto: {e}")
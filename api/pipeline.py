@@ -0,0 +1,92 @@
+# pipeline.py
+#
+# Esecutore minimale a grafo per le fasi di una richiesta: ogni fase dichiara
+# le fasi da cui dipende e parte appena queste sono terminate, quindi fasi
+# indipendenti girano in parallelo. Le fasi sincrone (chiamate HTTP bloccanti)
+# vanno su un thread; quelle marcate `background` non bloccano la risposta.
+
+import time
+import asyncio
+import inspect
+import logging
+
+import tracing
+
+# Riferimenti ai task in background: il loop ne tiene solo riferimenti deboli
+_background_tasks = set()
+
+
+class Stage:
+    def __init__(self, name: str, fn, deps=(), background: bool = False):
+        self.name = name
+        self.fn = fn
+        self.deps = tuple(deps)
+        self.background = background
+
+
+class StageGraph:
+    def __init__(self, name: str):
+        self.name = name
+        self.stages = {}
+
+    def add(self, name: str, fn, deps=(), background: bool = False):
+        """Registra una fase; `fn(ctx)` riceve gli input e i risultati delle fasi precedenti."""
+        for dep in deps:
+            if dep not in self.stages:
+                raise ValueError(f"Fase '{name}': dipendenza sconosciuta '{dep}'")
+        self.stages[name] = Stage(name, fn, deps, background)
+        return self
+
+    async def run(self, **inputs) -> tuple:
+        """Esegue il grafo; ritorna (ctx con i risultati, tempi per fase in ms)."""
+        ctx = dict(inputs)
+        timings = {}
+        tasks = {}
+        start = time.perf_counter()
+
+        async def run_stage(stage: Stage):
+            if stage.deps:
+                await asyncio.gather(*(tasks[dep] for dep in stage.deps))
+            t0 = time.perf_counter()
+            try:
+                if inspect.iscoroutinefunction(stage.fn):
+                    result = await stage.fn(ctx)
+                else:
+                    result = await asyncio.to_thread(stage.fn, ctx)
+            finally:
+                elapsed = time.perf_counter() - t0
+                timings[stage.name] = round(elapsed * 1000, 1)
+                tracing.record_span(f"{self.name.strip('/')}.{stage.name}", elapsed)
+            ctx[stage.name] = result
+            return result
+
+        for stage in self.stages.values():
+            tasks[stage.name] = asyncio.create_task(run_stage(stage))
+
+        foreground = [tasks[s.name] for s in self.stages.values() if not s.background]
+        try:
+            await asyncio.gather(*foreground)
+        except BaseException:
+            # Una fase è fallita: si fermano le altre e se ne raccolgono gli esiti,
+            # così nessun task resta orfano con un'eccezione mai letta
+            pending = [task for task in tasks.values() if not task.done()]
+            for task in pending:
+                task.cancel()
+            await asyncio.gather(*tasks.values(), return_exceptions=True)
+            raise
+        timings["total"] = round((time.perf_counter() - start) * 1000, 1)
+
+        background = [tasks[s.name] for s in self.stages.values() if s.background]
+        if background:
+            task = asyncio.create_task(self._log_background(background, timings))
+            _background_tasks.add(task)
+            task.add_done_callback(_background_tasks.discard)
+        logging.info(f"⏱️ Tempi {self.name}: {timings}")
+        return ctx, dict(timings)
+
+    async def _log_background(self, background: list, timings: dict):
+        results = await asyncio.gather(*background, return_exceptions=True)
+        for task_result in results:
+            if isinstance(task_result, Exception):
+                logging.error(f"❌ Fase in background di {self.name} fallita: {task_result}")
+        logging.info(f"⏱️ Fasi in background {self.name} completate: {timings}")
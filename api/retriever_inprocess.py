@@ -0,0 +1,100 @@
+# retriever_inprocess.py
+#
+# Modalità retriever in-process (RETRIEVER_MODE=inprocess) per i deployment su
+# un solo nodo: invece di passare dall'HTTP, l'API importa retriever/main.py
+# e ne chiama direttamente le funzioni di ricerca. L'indice FAISS e il modello
+# di embedding vengono caricati una volta e condivisi; le ricerche girano su
+# un thread pool dedicato. Richiede le dipendenze del retriever installate
+# nello stesso ambiente dell'API: è pensata per l'esecuzione locale, l'immagine
+# Docker dell'API contiene solo api/. Se il retriever non si carica l'avvio
+# fallisce, invece di rispondere con contesti vuoti.
+
+import os
+import logging
+import threading
+import importlib.util
+from concurrent.futures import ThreadPoolExecutor
+from dotenv import load_dotenv
+
+import tracing
+
+load_dotenv()
+
+BASE_DIR = os.path.dirname(os.path.abspath(__file__))
+ROOT_DIR = os.path.dirname(BASE_DIR)
+
+RETRIEVER_MAIN = os.getenv("RETRIEVER_MAIN", os.path.join(ROOT_DIR, "retriever", "main.py"))
+if not os.path.isabs(RETRIEVER_MAIN):
+    RETRIEVER_MAIN = os.path.abspath(os.path.join(ROOT_DIR, RETRIEVER_MAIN))
+RETRIEVER_THREADS = int(os.getenv("RETRIEVER_THREADS", "4"))
+
+_module = None
+_module_lock = threading.Lock()
+_pool = ThreadPoolExecutor(max_workers=RETRIEVER_THREADS, thread_name_prefix="retriever")
+
+
+def load_retriever():
+    """Importa retriever/main.py una sola volta (carica documenti e indici)."""
+    global _module
+    with _module_lock:
+        if _module is None:
+            logging.info(f"📦 Caricamento retriever in-process da {RETRIEVER_MAIN}")
+            if not os.path.isfile(RETRIEVER_MAIN):
+                raise RuntimeError(
+                    f"RETRIEVER_MODE=inprocess ma {RETRIEVER_MAIN} non esiste: la modalità in-process "
+                    "funziona solo in locale (l'immagine Docker dell'API non contiene retriever/), usa RETRIEVER_MODE=http"
+                )
+            # Nome diverso da `main` per non collidere con il modulo dell'API
+            spec = importlib.util.spec_from_file_location("retriever_main", RETRIEVER_MAIN)
+            module = importlib.util.module_from_spec(spec)
+            try:
+                spec.loader.exec_module(module)
+            except ImportError as e:
+                raise RuntimeError(
+                    f"RETRIEVER_MODE=inprocess ma il retriever non si importa ({e}): "
+                    "installa retriever/requirements.txt nell'ambiente dell'API o usa RETRIEVER_MODE=http"
+                ) from e
+            _module = module
+            logging.info("✅ Retriever in-process pronto")
+    return _module
+
+
+def _run_traced(module, fn, *args):
+    """Esegue `fn` sul pool con il trace id della richiesta corrente (gli span del retriever restano collegati)."""
+    trace_id = tracing.current_trace_id()
+
+    def run():
+        with module.telemetry.trace(trace_id):
+            return fn(*args)
+
+    with tracing.span("retriever_inprocess"):
+        return _pool.submit(run).result()
+
+
+def search(query: str, index_type: str = "post") -> list:
+    module = load_retriever()
+    result = _run_traced(module, module.search_documents, query, index_type)
+    if "error" in result:
+        raise ValueError(result["error"])
+    return result["results"]
+
+
+def search_batch(queries: list, index_type: str = "post") -> list:
+    module = load_retriever()
+    results = _run_traced(module, module.search_documents_batch, queries, index_type)
+    docs = []
+    for result in results:
+        if "error" in result:
+            logging.error(f"❌ Errore dal retriever in-process: {result['error']}")
+        docs.append(result.get("results", []))
+    return docs
+
+
+def embed(texts: list) -> list:
+    module = load_retriever()
+    return _run_traced(module, module.embed_texts, texts)
+
+
+def metrics_text() -> str:
+    """Metriche del retriever in-process, aggiunte a GET /metrics dell'API."""
+    return _module.telemetry.render() if _module is not None else ""
@@ -0,0 +1,196 @@
+# semantic_cache.py
+#
+# Cache semantica delle risposte: richieste quasi identiche ("post about
+# refillable shampoo" / "refillable shampoo post") riusano la risposta già
+# generata invece di rifare retrieval, completamento Fireworks e immagine.
+#
+# La richiesta normalizzata viene trasformata in un embedding dal modello di
+# frasi del retriever (stesso modello dell'indice "post"): un bag of words non
+# distingue "microplastics" da "no microplastics". Se l'embedding non è
+# disponibile la cache si comporta come un miss. Le voci sono separate per
+# endpoint, piattaforma e lingua. Un hit richiede una similarità coseno sopra
+# la soglia e una voce non scaduta; oltre la capacità si scartano le voci
+# usate meno di recente. I vettori stanno in una matrice numpy (una riga per
+# voce): una ricerca è un solo prodotto matrice-vettore, non un ciclo Python.
+
+import os
+import re
+import time
+import logging
+import threading
+import unicodedata
+from collections import OrderedDict
+
+import numpy as np
+from dotenv import load_dotenv
+
+load_dotenv()
+
+SEMANTIC_CACHE_ENABLED = os.getenv("SEMANTIC_CACHE_ENABLED", "true").lower() in ("1", "true", "yes")
+# Punto di partenza, non ancora misurato: tararla con benchmarks/calibrate_semantic_cache.py
+SEMANTIC_CACHE_THRESHOLD = float(os.getenv("SEMANTIC_CACHE_THRESHOLD", "0.93"))
+SEMANTIC_CACHE_TTL_SECONDS = int(os.getenv("SEMANTIC_CACHE_TTL_SECONDS", "3600"))
+SEMANTIC_CACHE_CAPACITY = int(os.getenv("SEMANTIC_CACHE_CAPACITY", "1000"))
+
+# Embedding delle richieste recenti: lookup e store della stessa richiesta fanno una sola chiamata
+EMBEDDING_MEMO_SIZE = 256
+
+
+def normalize_request(text: str) -> str:
+    text = unicodedata.normalize("NFKC", text).lower()
+    text = re.sub(r"[^\w#\s]", " ", text)
+    return re.sub(r"\s+", " ", text).strip()
+
+
+def unit_vector(vector) -> np.ndarray | None:
+    vector = np.asarray(vector, dtype=np.float32)
+    norm = float(np.linalg.norm(vector))
+    return vector / norm if norm else None
+
+
+class SemanticCache:
+    def __init__(
+        self,
+        threshold: float = SEMANTIC_CACHE_THRESHOLD,
+        ttl_seconds: int = SEMANTIC_CACHE_TTL_SECONDS,
+        capacity: int = SEMANTIC_CACHE_CAPACITY,
+        enabled: bool = SEMANTIC_CACHE_ENABLED,
+        embedder=None,
+    ):
+        self.embedder = embedder  # fn(testo) -> vettore denso, fornita da main.py (retriever)
+        self.threshold = threshold
+        self.ttl_seconds = ttl_seconds
+        self.capacity = capacity
+        self.enabled = enabled
+        self._values = OrderedDict()   # riga -> valore, in ordine LRU
+        self._vectors = None           # matrice capacity x dim, creata al primo store
+        self._partitions = np.full(capacity, -1, dtype=np.int64)   # id partizione per riga, -1 = libera
+        self._created = np.zeros(capacity)
+        self._partition_ids = {}       # partizione -> id
+        self._free = list(range(capacity - 1, -1, -1))
+        self._memo = OrderedDict()     # testo normalizzato -> vettore
+        self._lock = threading.Lock()
+        self.stats = {"hits": 0, "misses": 0, "bypassed": 0, "unavailable": 0, "stored": 0, "expired": 0, "evicted": 0}
+
+    def _embed(self, text: str) -> np.ndarray | None:
+        key = normalize_request(text)
+        with self._lock:
+            if key in self._memo:
+                self._memo.move_to_end(key)
+                return self._memo[key]
+        if self.embedder is None:
+            return None
+        try:
+            vector = unit_vector(self.embedder(key))
+        except Exception as e:
+            logging.warning(f"⚠️ Cache semantica: embedding non disponibile ({e})")
+            return None
+        if vector is not None:
+            with self._lock:
+                self._memo[key] = vector
+                while len(self._memo) > EMBEDDING_MEMO_SIZE:
+                    self._memo.popitem(last=False)
+        return vector
+
+    def lookup(self, partition: tuple, text: str, bypass: bool = False):
+        """Ritorna (valore, similarità) della voce più simile sopra soglia, oppure (None, miglior similarità)."""
+        if not self.enabled or bypass:
+            with self._lock:
+                self.stats["bypassed"] += 1
+            return None, 0.0
+
+        vector = self._embed(text)
+        if vector is None:
+            with self._lock:
+                self.stats["unavailable"] += 1
+            return None, 0.0
+
+        with self._lock:
+            self._expire(time.time())
+            partition_id = self._partition_ids.get(partition)
+            if partition_id is None or self._vectors is None or not self._compatible(vector):
+                self.stats["misses"] += 1
+                return None, 0.0
+
+            # Similarità con tutte le righe in un colpo; le altre partizioni e le righe libere non contano
+            scores = np.where(self._partitions == partition_id, self._vectors @ vector, -1.0)
+            row = int(np.argmax(scores))
+            best_score = float(scores[row])
+            if best_score >= self.threshold:
+                self._values.move_to_end(row)
+                self.stats["hits"] += 1
+                logging.info(f"🎯 Cache semantica: hit {partition} (similarità {best_score:.2f})")
+                return self._values[row], best_score
+
+            self.stats["misses"] += 1
+        return None, max(best_score, 0.0)
+
+    def store(self, partition: tuple, text: str, value):
+        if not self.enabled or self.capacity <= 0:
+            return
+        vector = self._embed(text)
+        if vector is None:
+            return
+        with self._lock:
+            if not self._compatible(vector):
+                # Il retriever è passato a un modello con altra dimensione: le voci vecchie non sono confrontabili
+                logging.warning("⚠️ Cache semantica: dimensione degli embedding cambiata, cache svuotata")
+                self._clear()
+            if self._vectors is None:
+                self._vectors = np.zeros((self.capacity, vector.shape[0]), dtype=np.float32)
+            if not self._free:
+                self._release(next(iter(self._values)))
+                self.stats["evicted"] += 1
+            row = self._free.pop()
+            self._vectors[row] = vector
+            self._partitions[row] = self._partition_ids.setdefault(partition, len(self._partition_ids))
+            self._created[row] = time.time()
+            self._values[row] = value
+            self.stats["stored"] += 1
+
+    # --- Righe della matrice (da chiamare con il lock) ---
+    def _compatible(self, vector: np.ndarray) -> bool:
+        return self._vectors is None or self._vectors.shape[1] == vector.shape[0]
+
+    def _expire(self, now: float):
+        expired = np.flatnonzero((self._partitions >= 0) & (now - self._created > self.ttl_seconds))
+        for row in expired:
+            self._release(int(row))
+        self.stats["expired"] += len(expired)
+
+    def _release(self, row: int):
+        self._partitions[row] = -1
+        del self._values[row]
+        self._free.append(row)
+
+    def _clear(self):
+        self._values.clear()
+        self._memo.clear()
+        self._vectors = None
+        self._partitions[:] = -1
+        self._free = list(range(self.capacity - 1, -1, -1))
+
+    def metrics(self) -> dict:
+        with self._lock:
+            lookups = self.stats["hits"] + self.stats["misses"]
+            return {
+                **self.stats,
+                "entries": len(self._values),
+                "hit_rate": round(self.stats["hits"] / lookups, 3) if lookups else 0.0,
+                "threshold": self.threshold,
+                "ttl_seconds": self.ttl_seconds,
+                "capacity": self.capacity,
+                "enabled": self.enabled,
+            }
+
+
+_cache = None
+_cache_lock = threading.Lock()
+
+
+def get_semantic_cache() -> SemanticCache:
+    global _cache
+    with _cache_lock:
+        if _cache is None:
+            _cache = SemanticCache()
+    return _cache
@@ -0,0 +1,126 @@
+# streaming.py
+#
+# Pulizia incrementale dei post generati in streaming e formattazione SSE.
+# Applica le stesse regole di call_fireworks + clean_generated_text
+# (niente puntini finali, frasi di servizio rimosse, righe duplicate
+# eliminate, limite di 280 caratteri) trattenendo solo la coda di testo che
+# potrebbe ancora cambiare: l'ultima parola, i punti finali, un possibile
+# inizio di frase da rimuovere o una riga che ripete una precedente.
+
+import re
+import json
+
+SERVICE_PHRASES = ("here is the translation", "let me know")
+SERVICE_PHRASES_RE = re.compile(r"(?i)(here is the translation:?|let me know[^\n]*)")
+TRAILING_DOTS = ".… \t"
+
+
+def sse_event(event: str, data: dict) -> str:
+    return f"event: {event}\ndata: {json.dumps(data, ensure_ascii=False)}\n\n"
+
+
+def _clean_line(line: str) -> str:
+    return SERVICE_PHRASES_RE.sub("", line).strip()
+
+
+def _phrase_prefix_start(text: str) -> int:
+    """Indice da cui `text` termina con l'inizio di una frase di servizio, o -1."""
+    lower = text.lower()
+    for start in range(len(lower)):
+        if start > 0 and not lower[start - 1].isspace():
+            continue
+        tail = lower[start:]
+        if tail and any(phrase.startswith(tail) for phrase in SERVICE_PHRASES):
+            return start
+    return -1
+
+
+class IncrementalPostCleaner:
+    def __init__(self, max_len: int = 280):
+        self.max_len = max_len
+        self.text = ""           # testo già emesso al client
+        self.seen_lines = []     # righe complete già emesse (per la deduplica)
+        self.line = ""           # riga corrente, grezza
+        self.line_emitted = 0    # caratteri della riga corrente (pulita) già emessi
+        self.pending_tail = ""   # punteggiatura finale della riga precedente, trattenuta
+        self.done = False        # raggiunto il limite di lunghezza
+
+    # --- Emissione ---
+    def _emit(self, chunk: str) -> str:
+        if not chunk or self.done:
+            return ""
+        if len(self.text) + len(chunk) > self.max_len:
+            cut = (self.text + chunk)[:self.max_len].rsplit(" ", 1)[0]
+            chunk = cut[len(self.text):] + "..."
+            self.done = True
+        self.text += chunk
+        return chunk
+
+    def _emit_line_part(self, cleaned: str) -> str:
+        part = cleaned[self.line_emitted:]
+        if not part:
+            return ""
+        if self.line_emitted == 0 and self.text:
+            part = self.pending_tail + " " + part
+            self.pending_tail = ""
+        self.line_emitted = len(cleaned)
+        return self._emit(part)
+
+    def _duplicates_seen_line(self, cleaned: str) -> bool:
+        return self.line_emitted == 0 and any(seen.startswith(cleaned) for seen in self.seen_lines)
+
+    # --- Righe ---
+    def _partial_line(self) -> str:
+        raw = self.line
+        # l'ultima parola può ancora crescere
+        cut = max(raw.rfind(" "), raw.rfind("\t"))
+        raw = raw[:cut] if cut >= 0 else ""
+        # un possibile inizio di frase di servizio resta in attesa
+        start = _phrase_prefix_start(raw)
+        if start >= 0:
+            raw = raw[:start]
+        cleaned = _clean_line(raw).rstrip(TRAILING_DOTS)
+        if not cleaned or self._duplicates_seen_line(cleaned):
+            return ""
+        return self._emit_line_part(cleaned)
+
+    def _finish_line(self, raw: str) -> str:
+        cleaned = _clean_line(raw)
+        self.line = ""
+        if not cleaned or (self.line_emitted == 0 and cleaned in self.seen_lines):
+            self.line_emitted = 0
+            return ""
+        self.seen_lines.append(cleaned)
+        body = cleaned.rstrip(TRAILING_DOTS)
+        emitted = self._emit_line_part(body)
+        self.pending_tail = cleaned[len(body):].strip()
+        self.line_emitted = 0
+        return emitted
+
+    # --- API ---
+    def feed(self, delta: str) -> str:
+        """Aggiunge un frammento del modello; ritorna il testo pulito emettibile ora."""
+        if self.done:
+            return ""
+        out = ""
+        self.line += delta
+        while "\n" in self.line and not self.done:
+            line, rest = self.line.split("\n", 1)
+            out += self._finish_line(line)
+            self.line = rest
+        if not self.done:
+            out += self._partial_line()
+        return out
+
+    def close(self) -> str:
+        """Fine dello stream: emette la coda trattenuta con la chiusura corretta."""
+        if self.done:
+            return ""
+        out = self._finish_line(self.line)
+        tail = self.pending_tail
+        while tail.endswith("...") or tail.endswith("…"):
+            tail = tail[:-3] if tail.endswith("...") else tail[:-1]
+        if self.text and not (self.text + tail).endswith((".", "!", "?")):
+            tail += "."
+        self.pending_tail = ""
+        return out + self._emit(tail)
@@ -0,0 +1,228 @@
+# tracing.py
+#
+# Tracing delle richieste e metriche in-process in formato Prometheus. Ogni
+# richiesta HTTP riceve un trace id (dall'header X-Trace-Id se presente) che
+# viene inoltrato al retriever, così i log dei due servizi si ricollegano. Le
+# fasi registrate con `span` finiscono in istogrammi a bucket fissi (un lock e
+# qualche somma per osservazione, nessuna dipendenza esterna) e nel riepilogo
+# della traccia scritto a fine richiesta. GET /metrics espone istogrammi,
+# contatori e i valori letti al momento dai collector registrati (hit rate
+# delle cache, job immagine).
+#
+# DA TENERE ALLINEATO con retriever/telemetry.py: Trace, span/record_span,
+# BUCKETS, struttura degli istogrammi, _format_labels, render e middleware
+# sono lo stesso codice (i due servizi hanno contesti Docker separati e non
+# possono importarsi a vicenda). Una correzione qui va fatta anche lì.
+
+import time
+import uuid
+import bisect
+import logging
+import functools
+import threading
+import contextvars
+from contextlib import contextmanager
+from fastapi.responses import PlainTextResponse
+
+TRACE_HEADER = "X-Trace-Id"
+METRICS_PREFIX = "api_"
+CONTENT_TYPE = "text/plain; version=0.0.4; charset=utf-8"
+BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0, 30.0, 60.0)
+
+METRICS = {
+    "request_seconds": ("histogram", "Durata delle richieste HTTP per endpoint"),
+    "stage_seconds": ("histogram", "Durata delle fasi tracciate (span)"),
+    "upstream_errors_total": ("counter", "Risposte di errore da Fireworks e Together"),
+    "upstream_retries_total": ("counter", "Nuovi tentativi verso gli upstream"),
+}
+
+
+class Trace:
+    def __init__(self, trace_id: str):
+        self.id = trace_id
+        self.spans = []   # (nome, ms) in ordine di fine
+
+
+_current = contextvars.ContextVar("trace", default=None)
+_lock = threading.Lock()
+_histograms = {}   # (nome, etichette) -> [conteggi per bucket + overflow, somma, totale]
+_counters = {}     # (nome, etichette) -> valore
+_collectors = []
+
+
+# =====================================
+# TRACCE
+# =====================================
+def current_trace_id() -> str | None:
+    trace = _current.get()
+    return trace.id if trace else None
+
+
+def trace_headers() -> dict:
+    """Header da aggiungere alle chiamate verso il retriever."""
+    trace_id = current_trace_id()
+    return {TRACE_HEADER: trace_id} if trace_id else {}
+
+
+@contextmanager
+def trace(trace_id: str = None):
+    current = Trace(trace_id or uuid.uuid4().hex[:16])
+    token = _current.set(current)
+    try:
+        yield current
+    finally:
+        _current.reset(token)
+
+
+def record_span(name: str, seconds: float):
+    observe("stage_seconds", seconds, stage=name)
+    current = _current.get()
+    if current is not None:
+        current.spans.append((name, round(seconds * 1000, 1)))
+
+
+@contextmanager
+def span(name: str):
+    start = time.perf_counter()
+    try:
+        yield
+    finally:
+        record_span(name, time.perf_counter() - start)
+
+
+def submit(pool, fn, *args):
+    """`pool.submit` con una copia del contesto corrente: gli span del thread restano nella traccia."""
+    return pool.submit(contextvars.copy_context().run, fn, *args)
+
+
+def traced(name: str):
+    """Decoratore: l'intera chiamata (retry compresi) diventa uno span."""
+    def decorator(fn):
+        @functools.wraps(fn)
+        def wrapper(*args, **kwargs):
+            with span(name):
+                return fn(*args, **kwargs)
+        return wrapper
+    return decorator
+
+
+# =====================================
+# METRICHE
+# =====================================
+def _labels_key(labels: dict) -> tuple:
+    return tuple(sorted((k, str(v)) for k, v in labels.items()))
+
+
+def observe(name: str, seconds: float, **labels):
+    key = (name, _labels_key(labels))
+    index = bisect.bisect_left(BUCKETS, seconds)
+    with _lock:
+        entry = _histograms.get(key)
+        if entry is None:
+            entry = _histograms[key] = [[0] * (len(BUCKETS) + 1), 0.0, 0]
+        entry[0][index] += 1
+        entry[1] += seconds
+        entry[2] += 1
+
+
+def increment(name: str, value: float = 1, **labels):
+    key = (name, _labels_key(labels))
+    with _lock:
+        _counters[key] = _counters.get(key, 0) + value
+
+
+def count_upstream_error(service: str, status):
+    increment("upstream_errors_total", service=service, status=status)
+
+
+def count_retry(retry_state):
+    """Callback `before_sleep` di tenacity: conta i nuovi tentativi per funzione."""
+    increment("upstream_retries_total", function=retry_state.fn.__name__)
+    logging.warning(f"🔁 Nuovo tentativo {retry_state.attempt_number + 1} di {retry_state.fn.__name__}")
+
+
+def register_collector(fn):
+    """`fn()` ritorna tuple (nome, tipo, descrizione, etichette, valore) lette a ogni scrape."""
+    _collectors.append(fn)
+
+
+def _format_labels(labels, extra: tuple = ()) -> str:
+    pairs = list(labels) + list(extra)
+    if not pairs:
+        return ""
+    escaped = (v.replace("\\", "\\\\").replace('"', '\\"').replace("\n", "\\n") for _, v in pairs)
+    return "{" + ",".join(f'{k}="{v}"' for (k, _), v in zip(pairs, escaped)) + "}"
+
+
+def render() -> str:
+    with _lock:
+        histograms = {key: [list(entry[0]), entry[1], entry[2]] for key, entry in _histograms.items()}
+        counters = dict(_counters)
+
+    lines = []
+    for name, (kind, description) in METRICS.items():
+        full_name = METRICS_PREFIX + name
+        lines += [f"# HELP {full_name} {description}", f"# TYPE {full_name} {kind}"]
+        if kind == "histogram":
+            for (metric, labels), (buckets, total, count) in sorted(histograms.items()):
+                if metric != name:
+                    continue
+                cumulative = 0
+                for bound, n in zip(BUCKETS, buckets):
+                    cumulative += n
+                    lines.append(f"{full_name}_bucket{_format_labels(labels, (('le', str(bound)),))} {cumulative}")
+                lines.append(f"{full_name}_bucket{_format_labels(labels, (('le', '+Inf'),))} {count}")
+                lines.append(f"{full_name}_sum{_format_labels(labels)} {round(total, 6)}")
+                lines.append(f"{full_name}_count{_format_labels(labels)} {count}")
+        else:
+            for (metric, labels), value in sorted(counters.items()):
+                if metric == name:
+                    lines.append(f"{full_name}{_format_labels(labels)} {value}")
+
+    described = set()
+    for collector in _collectors:
+        try:
+            samples = list(collector())
+        except Exception as e:
+            logging.error(f"❌ Collector metriche fallito: {e}")
+            continue
+        for name, kind, description, labels, value in samples:
+            full_name = METRICS_PREFIX + name
+            if full_name not in described:
+                described.add(full_name)
+                lines += [f"# HELP {full_name} {description}", f"# TYPE {full_name} {kind}"]
+            lines.append(f"{full_name}{_format_labels(_labels_key(labels))} {value}")
+    return "\n".join(lines) + "\n"
+
+
+# =====================================
+# FASTAPI
+# =====================================
+def install(app, extra=None):
+    """Middleware di tracing e GET /metrics; `extra()` aggiunge testo Prometheus di altri moduli."""
+
+    @app.middleware("http")
+    async def trace_requests(request, call_next):
+        with trace(request.headers.get(TRACE_HEADER)) as current:
+            start = time.perf_counter()
+            status = 500
+            try:
+                response = await call_next(request)
+                status = response.status_code
+            finally:
+                elapsed = time.perf_counter() - start
+                # Template della route (es. /history/{table}), non il path: etichette in numero limitato
+                route = getattr(request.scope.get("route"), "path", "other")
+                observe("request_seconds", elapsed, method=request.method, path=route, status=status)
+                if current.spans:
+                    spans = ", ".join(f"{name} {ms} ms" for name, ms in current.spans)
+                    logging.info(f"🧭 Traccia {current.id} {request.method} {route} {status} in {elapsed * 1000:.0f} ms: {spans}")
+        response.headers[TRACE_HEADER] = current.id
+        return response
+
+    @app.get("/metrics", include_in_schema=False)
+    def metrics():
+        text = render()
+        if extra is not None:
+            text += extra()
+        return PlainTextResponse(text, media_type=CONTENT_TYPE)
@@ -0,0 +1,62 @@
+# trends.py
+#
+# Lettura del trend digest prodotto dal retriever (retriever/trend_digest.py):
+# hashtag e termini più frequenti e cluster di argomenti pesati per sentiment,
+# con tweet di esempio. Il file è condiviso tramite la cartella data e viene
+# riletto solo quando cambia.
+
+import os
+import json
+import logging
+import threading
+from dotenv import load_dotenv
+
+load_dotenv()
+
+BASE_DIR = os.path.dirname(os.path.abspath(__file__))
+ROOT_DIR = os.path.dirname(BASE_DIR)
+
+TREND_DIGEST_PATH = os.getenv("TREND_DIGEST_PATH", os.path.join(ROOT_DIR, "data", "trend_digest.json"))
+if not os.path.isabs(TREND_DIGEST_PATH):
+    TREND_DIGEST_PATH = os.path.abspath(os.path.join(ROOT_DIR, TREND_DIGEST_PATH))
+TREND_PROMPT_CLUSTERS = int(os.getenv("TREND_PROMPT_CLUSTERS", "5"))
+
+_digest = {"mtime": None, "data": None}
+_digest_lock = threading.Lock()
+
+
+def load_trend_digest() -> dict | None:
+    try:
+        mtime = os.path.getmtime(TREND_DIGEST_PATH)
+    except OSError:
+        return None
+    with _digest_lock:
+        if _digest["mtime"] != mtime:
+            try:
+                with open(TREND_DIGEST_PATH, encoding="utf-8") as f:
+                    _digest["data"] = json.load(f)
+                _digest["mtime"] = mtime
+                logging.info(f"📈 Trend digest caricato ({_digest['data'].get('tweets')} tweet)")
+            except (OSError, ValueError) as e:
+                logging.error(f"❌ Trend digest non leggibile: {e}")
+                return None
+        return _digest["data"]
+
+
+def trend_summary(max_clusters: int = TREND_PROMPT_CLUSTERS) -> str:
+    """Testo compatto del digest per il prompt; stringa vuota se il digest non c'è."""
+    digest = load_trend_digest()
+    if not digest:
+        return ""
+    lines = [
+        f"Analisi di {digest.get('tweets', 0)} tweet.",
+        "Hashtag più usati: " + ", ".join(f"{tag} ({count})" for tag, count, _ in digest.get("hashtags", [])[:10]),
+        "Termini più frequenti: " + ", ".join(term for term, _, _ in digest.get("terms", [])[:15]),
+        "Argomenti principali (dal più rilevante, sentiment da -1 a +1):",
+    ]
+    for cluster in digest.get("clusters", [])[:max_clusters]:
+        keywords = ", ".join(cluster["keywords"] + cluster["hashtags"])
+        lines.append(f"- {cluster['label']} ({cluster['size']} tweet, sentiment {cluster['sentiment']:+.2f}): {keywords}")
+        for exemplar in cluster.get("exemplars", [])[:2]:
+            lines.append(f"  • \"{exemplar['text']}\"")
+    return "\n".join(lines)
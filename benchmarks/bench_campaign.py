@@ -0,0 +1,115 @@
+# bench_campaign.py
+#
+# Throughput di una campagna (argomenti x piattaforme x lingue) contro gli
+# stub locali: una chiamata singola alla volta per item, come farebbe oggi il
+# team contenuti con /generate, contro /generate_campaign (retrieval in batch,
+# post e traduzioni condivisi, chiamate Fireworks concorrenti).
+#
+#   python benchmarks/bench_campaign.py --topics 5 --languages en,it,fr
+
+import os
+import sys
+import time
+import json
+import argparse
+import tempfile
+
+ROOT_DIR = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, os.path.join(ROOT_DIR, "api"))
+sys.path.insert(0, os.path.dirname(os.path.abspath(__file__)))
+
+from stub_fireworks import StubConfig, start_stub
+from stub_retriever import RetrieverStubConfig, start_retriever_stub
+
+TOPICS = [
+    "refillable shampoo bottles",
+    "solid conditioner bars",
+    "microplastic-free scrubs",
+    "compostable cotton pads",
+    "organic aloe vera gel",
+    "zero waste deodorant",
+    "bamboo toothbrushes",
+    "vegan lipstick",
+]
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--topics", type=int, default=5)
+    parser.add_argument("--platforms", default="twitter,instagram")
+    parser.add_argument("--languages", default="en,it,fr")
+    parser.add_argument("--concurrency", type=int, default=4)
+    parser.add_argument("--base-latency", type=float, default=0.4)
+    parser.add_argument("--token-latency", type=float, default=0.005)
+    parser.add_argument("--retriever-latency", type=float, default=0.15)
+    args = parser.parse_args()
+
+    config = StubConfig(args.base_latency, args.token_latency)
+    _, fireworks_url = start_stub(config=config)
+    retriever_config = RetrieverStubConfig(args.retriever_latency)
+    _, retriever_url = start_retriever_stub(config=retriever_config)
+
+    workdir = tempfile.mkdtemp(prefix="bench_campaign_")
+    os.environ["FIREWORKS_URL"] = fireworks_url
+    os.environ["RETRIEVER_URL"] = retriever_url
+    os.environ["HISTORY_DB"] = os.path.join(workdir, "history.db")
+    os.environ["CAMPAIGN_CONCURRENCY"] = str(args.concurrency)
+    os.environ["SEMANTIC_CACHE_ENABLED"] = "false"
+    os.environ.setdefault("FIREWORKS_API_KEY_MIA", "bench")
+    os.environ.setdefault("TOGETHER_API_KEY", "bench")
+    os.chdir(workdir)
+
+    from PIL import Image
+    fake_image = os.path.join(workdir, "data", "images", "bench.png")
+    os.makedirs(os.path.dirname(fake_image), exist_ok=True)
+    Image.new("RGB", (64, 64), "white").save(fake_image)
+
+    import image_jobs
+    image_jobs.generate_image = lambda prompt, output_dir="data/images": fake_image
+    import main as api_main
+    from fastapi.testclient import TestClient
+
+    items = [
+        {"query": topic, "platform": platform, "language": language}
+        for topic in TOPICS[:args.topics]
+        for platform in args.platforms.split(",")
+        for language in args.languages.split(",")
+    ]
+    print(f"{len(items)} item, Fireworks {args.base_latency}s + {args.token_latency}s/token, "
+          f"retriever {args.retriever_latency}s, concorrenza {args.concurrency}\n")
+
+    def single(item):
+        # Una richiesta per item: retrieval, post in inglese e traduzione nella lingua richiesta
+        # Stesso percorso di /generate per una query inglese: retrieval e packing del contesto
+        context_str, _ = api_main.pack_context(api_main.retrieve_docs(item["query"], item["query"], "en"))
+        answer = api_main.clean_generated_text(
+            api_main.call_fireworks(item["query"], context_str, item["platform"].capitalize())
+        )
+        if item["language"] != "en":
+            answer = api_main.translate(answer, api_main.lang_code_to_name(item["language"]))
+        return answer
+
+    calls, retrievals = config.calls, retriever_config.calls
+    start = time.perf_counter()
+    for item in items:
+        single(item)
+    sequential = time.perf_counter() - start
+    print(f"singole sequenziali   {sequential:6.1f} s   {len(items) / sequential:5.1f} item/s   "
+          f"{config.calls - calls:3d} chiamate LLM   {retriever_config.calls - retrievals:3d} richieste retriever")
+
+    calls, retrievals = config.calls, retriever_config.calls
+    with TestClient(api_main.app) as client:
+        start = time.perf_counter()
+        with client.stream("POST", "/generate_campaign", json={"items": items}) as resp:
+            for line in resp.iter_lines():
+                row = json.loads(line)
+                if "error" in row:
+                    print(f"  errore item {row['index']}: {row['error']}")
+        campaign = time.perf_counter() - start
+    print(f"/generate_campaign    {campaign:6.1f} s   {len(items) / campaign:5.1f} item/s   "
+          f"{config.calls - calls:3d} chiamate LLM   {retriever_config.calls - retrievals:3d} richieste retriever")
+    print(f"\nspeedup: {sequential / campaign:.1f}x")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,114 @@
+# bench_generate.py
+#
+# Latenza end-to-end di /generate contro upstream locali (stub Fireworks,
+# stub retriever, generazione immagine simulata): catena sequenziale delle
+# fasi, come nel vecchio endpoint con immagine e salvataggio in linea, contro
+# il grafo di fasi. Stampa anche il dettaglio medio dei tempi per fase.
+#
+#   python benchmarks/bench_generate.py --requests 10 --base-latency 0.4
+
+import os
+import sys
+import time
+import asyncio
+import argparse
+import tempfile
+import statistics
+
+ROOT_DIR = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, os.path.join(ROOT_DIR, "api"))
+sys.path.insert(0, os.path.dirname(os.path.abspath(__file__)))
+
+from stub_fireworks import StubConfig, start_stub
+from stub_retriever import RetrieverStubConfig, start_retriever_stub
+
+QUERIES = [
+    ("Come ridurre la plastica nella skincare?", "instagram"),
+    ("How can I reduce plastic in my beauty routine?", "twitter"),
+]
+
+
+def p95(values: list) -> float:
+    ordered = sorted(values)
+    return ordered[min(len(ordered) - 1, round(0.95 * (len(ordered) - 1)))]
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--requests", type=int, default=10)
+    parser.add_argument("--base-latency", type=float, default=0.4)
+    parser.add_argument("--token-latency", type=float, default=0.005)
+    parser.add_argument("--retriever-latency", type=float, default=0.15)
+    parser.add_argument("--image-latency", type=float, default=2.0)
+    args = parser.parse_args()
+
+    _, fireworks_url = start_stub(config=StubConfig(args.base_latency, args.token_latency))
+    _, retriever_url = start_retriever_stub(config=RetrieverStubConfig(args.retriever_latency))
+
+    workdir = tempfile.mkdtemp(prefix="bench_generate_")
+    os.environ["FIREWORKS_URL"] = fireworks_url
+    os.environ["RETRIEVER_URL"] = retriever_url
+    os.environ["HISTORY_DB"] = os.path.join(workdir, "history.db")
+    os.environ.setdefault("FIREWORKS_API_KEY_MIA", "bench")
+    os.environ.setdefault("TOGETHER_API_KEY", "bench")
+    os.chdir(workdir)
+
+    from PIL import Image
+    fake_image = os.path.join(workdir, "data", "images", "bench.png")
+    os.makedirs(os.path.dirname(fake_image), exist_ok=True)
+    Image.new("RGB", (64, 64), "white").save(fake_image)
+
+    def fake_generate_image(prompt, output_dir="data/images"):
+        time.sleep(args.image_latency)
+        return fake_image
+
+    import image_jobs
+    image_jobs.generate_image = fake_generate_image
+    import main as api_main
+    from history_store import get_store
+
+    def sequential(query, platform):
+        # Vecchio /generate: fasi una dopo l'altra, immagine e storico in linea
+        ctx = {"query": query, "platform": platform}
+        ctx["detect"] = api_main.detect_language(query)
+        ctx["translate_query"] = api_main.translate_query(query, ctx["detect"])
+        ctx["retrieve"] = api_main.get_context_docs(ctx["translate_query"])
+        ctx["pack_context"] = api_main.stage_pack_context(ctx)
+        ctx["generate"] = api_main.stage_generate(ctx)
+        if platform == "instagram":
+            fake_generate_image(ctx["generate"]["answer_en"])
+        ctx["translate_answer"] = api_main.translate_answer(ctx["generate"]["answer_en"], ctx["detect"])
+        api_main.stage_persist(ctx)
+        get_store().flush()
+
+    print(f"{args.requests} richieste per query, Fireworks {args.base_latency}s + {args.token_latency}s/token, "
+          f"retriever {args.retriever_latency}s, immagine {args.image_latency}s\n")
+
+    for query, platform in QUERIES:
+        seq = []
+        for _ in range(args.requests):
+            start = time.perf_counter()
+            sequential(query, platform)
+            seq.append((time.perf_counter() - start) * 1000)
+
+        async def run_graph():
+            for _ in range(args.requests):
+                start = time.perf_counter()
+                _, timings = await api_main.generate_graph.run(query=query, platform=platform)
+                dag.append((time.perf_counter() - start) * 1000)
+                for name, ms in timings.items():
+                    stages.setdefault(name, []).append(ms)
+            await asyncio.sleep(0.1)  # lascia terminare il salvataggio in background
+
+        dag, stages = [], {}
+        asyncio.run(run_graph())
+
+        print(f"[{platform}] {query}")
+        print(f"  sequenziale   media {statistics.mean(seq):7.0f} ms   p95 {p95(seq):7.0f} ms")
+        print(f"  grafo         media {statistics.mean(dag):7.0f} ms   p95 {p95(dag):7.0f} ms")
+        print("  fasi (media ms): " + ", ".join(f"{name}={statistics.mean(ms):.0f}" for name, ms in stages.items()))
+        print()
+
+
+if __name__ == "__main__":
+    main()
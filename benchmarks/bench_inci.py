@@ -0,0 +1,71 @@
+# bench_inci.py
+#
+# Latenza della classificazione LLM degli ingredienti sconosciuti contro lo
+# stub locale di Fireworks: loop sequenziale (comportamento originale),
+# chiamate singole concorrenti e prompt batch.
+#
+#   python benchmarks/bench_inci.py --unknowns 15 --base-latency 0.4
+
+import os
+import sys
+import time
+import argparse
+
+ROOT_DIR = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, os.path.join(ROOT_DIR, "api"))
+sys.path.insert(0, os.path.dirname(os.path.abspath(__file__)))
+
+from stub_fireworks import StubConfig, start_stub
+
+
+def timed(label, fn, calls_before, config):
+    start = time.perf_counter()
+    verdicts = fn()
+    elapsed = time.perf_counter() - start
+    print(f"{label:<28} {elapsed * 1000:8.0f} ms   {config.calls - calls_before:3d} chiamate LLM   {len(verdicts)} verdetti")
+    return elapsed
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--unknowns", type=int, default=15)
+    parser.add_argument("--base-latency", type=float, default=0.4)
+    parser.add_argument("--token-latency", type=float, default=0.005)
+    parser.add_argument("--concurrency", type=int, default=4)
+    parser.add_argument("--batch-size", type=int, default=8)
+    args = parser.parse_args()
+
+    config = StubConfig(args.base_latency, args.token_latency)
+    server, url = start_stub(config=config)
+
+    os.environ["FIREWORKS_URL"] = url
+    os.environ.setdefault("FIREWORKS_API_KEY_MIA", "bench")
+    os.environ.setdefault("TOGETHER_API_KEY", "bench")
+
+    import inci_utils
+    from api import call_fireworks_for_ingredient
+
+    unknowns = [f"bench ingredient {i}" for i in range(args.unknowns)]
+    print(f"{len(unknowns)} ingredienti sconosciuti, latenza stub {args.base_latency}s + {args.token_latency}s/token\n")
+
+    sequential = timed(
+        "sequenziale (originale)",
+        lambda: {ing: call_fireworks_for_ingredient(ing) for ing in unknowns},
+        config.calls, config,
+    )
+    timed(
+        f"singole concorrenti (x{args.concurrency})",
+        lambda: inci_utils.classify_unknown_ingredients(unknowns, batch_size=1, max_workers=args.concurrency),
+        config.calls, config,
+    )
+    batched = timed(
+        f"batch (size {args.batch_size})",
+        lambda: inci_utils.classify_unknown_ingredients(unknowns, batch_size=args.batch_size, max_workers=args.concurrency),
+        config.calls, config,
+    )
+    print(f"\nspeedup batch vs sequenziale: {sequential / batched:.1f}x")
+    server.shutdown()
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,118 @@
+# bench_multilingual.py
+#
+# Percorso con traduzione contro generazione nativa per query non inglesi.
+#
+# 1. Latenza di /generate (grafo di fasi) contro gli stub locali, nelle due
+#    modalità di GENERATION_MODE, con il numero di chiamate LLM per richiesta.
+# 2. Sovrapposizione del contesto: con --retriever-url (retriever reale avviato
+#    con ENABLE_MULTILINGUAL_INDEX=true) confronta i documenti restituiti
+#    dall'indice inglese per la query tradotta e dall'indice multilingue per la
+#    query originale (Jaccard sugli id).
+#
+#   python benchmarks/bench_multilingual.py --requests 5
+#   python benchmarks/bench_multilingual.py --retriever-url http://localhost:9000/search
+
+import os
+import sys
+import time
+import asyncio
+import argparse
+import tempfile
+import statistics
+
+import requests
+
+ROOT_DIR = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, os.path.join(ROOT_DIR, "api"))
+sys.path.insert(0, os.path.dirname(os.path.abspath(__file__)))
+
+from stub_fireworks import StubConfig, start_stub
+from stub_retriever import RetrieverStubConfig, start_retriever_stub
+
+# Query originale e traduzione inglese di riferimento
+QUERIES = [
+    ("Come ridurre la plastica nella skincare quotidiana?", "How to reduce plastic in daily skincare?"),
+    ("Scrivi un post sui benefici dello shampoo solido", "Write a post about the benefits of solid shampoo"),
+    ("Comment choisir des cosmétiques vraiment écologiques ?", "How to choose truly eco-friendly cosmetics?"),
+    ("¿Por qué elegir envases recargables para la belleza?", "Why choose refillable packaging for beauty?"),
+    ("Warum sind Mikroplastik-freie Kosmetika wichtig?", "Why are microplastic-free cosmetics important?"),
+]
+
+
+def search_ids(url: str, query: str, index_type: str) -> set:
+    resp = requests.post(url, json={"query": query, "index_type": index_type}, timeout=30)
+    resp.raise_for_status()
+    data = resp.json()
+    if "error" in data:
+        raise RuntimeError(data["error"])
+    return {doc.get("id") or doc["content"] for doc in data.get("results", [])}
+
+
+def context_overlap(url: str):
+    print("Sovrapposizione del contesto (indice inglese su query tradotta vs indice multilingue su query originale)")
+    scores = []
+    for original, english in QUERIES:
+        reference = search_ids(url, english, "post")
+        native = search_ids(url, original, "post_multilingual")
+        union = reference | native
+        score = len(reference & native) / len(union) if union else 1.0
+        scores.append(score)
+        print(f"  {score:5.2f}  {original}")
+    print(f"  media Jaccard: {statistics.mean(scores):.2f}\n")
+
+
+def latency(args):
+    config = StubConfig(args.base_latency, args.token_latency)
+    _, fireworks_url = start_stub(config=config)
+    _, retriever_url = start_retriever_stub(config=RetrieverStubConfig(args.retriever_latency))
+
+    workdir = tempfile.mkdtemp(prefix="bench_multilingual_")
+    os.environ["FIREWORKS_URL"] = fireworks_url
+    os.environ["RETRIEVER_URL"] = retriever_url
+    os.environ["HISTORY_DB"] = os.path.join(workdir, "history.db")
+    os.environ.setdefault("FIREWORKS_API_KEY_MIA", "bench")
+    os.environ.setdefault("TOGETHER_API_KEY", "bench")
+    os.chdir(workdir)
+
+    import main as api_main
+
+    print(f"Latenza /generate su {len(QUERIES)} query non inglesi x {args.requests}, "
+          f"Fireworks {args.base_latency}s + {args.token_latency}s/token, retriever {args.retriever_latency}s")
+
+    async def run_mode(mode: str):
+        api_main.GENERATION_MODE = mode
+        elapsed = []
+        calls_before = config.calls
+        for _ in range(args.requests):
+            for original, _ in QUERIES:
+                start = time.perf_counter()
+                await api_main.generate_graph.run(query=original, platform="twitter")
+                elapsed.append((time.perf_counter() - start) * 1000)
+        await asyncio.sleep(0.1)  # lascia terminare il salvataggio in background
+        calls = (config.calls - calls_before) / len(elapsed)
+        print(f"  {mode:<10} media {statistics.mean(elapsed):7.0f} ms   max {max(elapsed):7.0f} ms   {calls:.1f} chiamate LLM/richiesta")
+        return statistics.mean(elapsed)
+
+    translated = asyncio.run(run_mode("translate"))
+    native = asyncio.run(run_mode("native"))
+    print(f"  speedup nativo vs traduzione: {translated / native:.1f}x\n")
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--requests", type=int, default=5)
+    parser.add_argument("--base-latency", type=float, default=0.4)
+    parser.add_argument("--token-latency", type=float, default=0.005)
+    parser.add_argument("--retriever-latency", type=float, default=0.15)
+    parser.add_argument("--retriever-url", help="retriever reale per il controllo di sovrapposizione del contesto")
+    args = parser.parse_args()
+
+    latency(args)
+    if args.retriever_url:
+        context_overlap(args.retriever_url)
+    else:
+        print("Sovrapposizione del contesto saltata: passa --retriever-url con ENABLE_MULTILINGUAL_INDEX=true")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,95 @@
+# bench_retriever_mode.py
+#
+# Latenza del retrieval dall'API: servizio HTTP separato contro retriever
+# in-process (RETRIEVER_MODE=inprocess). Entrambe le modalità usano lo stesso
+# indice caricato una volta: il retriever viene importato e la sua app FastAPI
+# servita con uvicorn su una porta locale, quindi la differenza misurata è
+# solo il trasporto (connessione, serializzazione JSON, thread del server).
+# Richiede le dipendenze del retriever (retriever/requirements.txt).
+#
+#   python benchmarks/bench_retriever_mode.py --requests 50 --concurrency 4
+
+import os
+import sys
+import time
+import socket
+import argparse
+import tempfile
+import threading
+import statistics
+from concurrent.futures import ThreadPoolExecutor
+
+ROOT_DIR = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, os.path.join(ROOT_DIR, "api"))
+
+QUERIES = [
+    "refillable shampoo bottles",
+    "sustainable skincare packaging",
+    "ESG reporting in cosmetics",
+    "microplastic-free scrubs",
+    "natural ingredients for sensitive skin",
+]
+
+
+def free_port() -> int:
+    with socket.socket() as sock:
+        sock.bind(("127.0.0.1", 0))
+        return sock.getsockname()[1]
+
+
+def measure(label: str, fn, requests_count: int, concurrency: int):
+    def one(i):
+        start = time.perf_counter()
+        docs = fn(QUERIES[i % len(QUERIES)], "post")
+        return (time.perf_counter() - start) * 1000, len(docs)
+
+    start = time.perf_counter()
+    with ThreadPoolExecutor(max_workers=concurrency) as pool:
+        results = list(pool.map(one, range(requests_count)))
+    elapsed = time.perf_counter() - start
+    latencies = sorted(ms for ms, _ in results)
+    p95 = latencies[min(len(latencies) - 1, round(0.95 * (len(latencies) - 1)))]
+    print(f"{label:<12} p50 {statistics.median(latencies):7.1f} ms   p95 {p95:7.1f} ms   "
+          f"{requests_count / elapsed:6.1f} req/s   {statistics.mean(n for _, n in results):.1f} documenti")
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--requests", type=int, default=50)
+    parser.add_argument("--concurrency", type=int, default=4)
+    args = parser.parse_args()
+
+    workdir = tempfile.mkdtemp(prefix="bench_retriever_")
+    os.environ["HISTORY_DB"] = os.path.join(workdir, "history.db")
+    os.environ.setdefault("FIREWORKS_API_KEY_MIA", "bench")
+    os.environ.setdefault("TOGETHER_API_KEY", "bench")
+
+    import uvicorn
+    import retriever_inprocess
+
+    retriever = retriever_inprocess.load_retriever()
+    port = free_port()
+    server = uvicorn.Server(uvicorn.Config(retriever.app, host="127.0.0.1", port=port, log_level="warning"))
+    threading.Thread(target=server.run, daemon=True).start()
+    while not server.started:
+        time.sleep(0.05)
+
+    os.environ["RETRIEVER_URL"] = f"http://127.0.0.1:{port}/search"
+    import main as api_main
+
+    # Riscaldamento: prima ricerca di ogni query (cache del modello, JIT di torch)
+    for query in QUERIES:
+        retriever_inprocess.search(query)
+
+    print(f"{args.requests} ricerche, concorrenza {args.concurrency}\n")
+    for concurrency in sorted({1, args.concurrency}):
+        print(f"concorrenza {concurrency}")
+        for mode in ("http", "inprocess"):
+            api_main.RETRIEVER_MODE = mode
+            measure(mode, api_main.get_context_from_query, args.requests, concurrency)
+        print()
+    server.should_exit = True
+
+
+if __name__ == "__main__":
+    main()
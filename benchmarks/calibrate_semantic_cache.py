@@ -0,0 +1,79 @@
+# calibrate_semantic_cache.py
+#
+# Taratura di SEMANTIC_CACHE_THRESHOLD sul modello di embedding del retriever.
+# Chiede a POST /embed del retriever reale gli embedding di coppie di richieste
+# che devono condividere la risposta (parafrasi, riordini) e di coppie che non
+# devono (negazioni, prodotti o argomenti diversi), stampa la similarità coseno
+# di ogni coppia e suggerisce una soglia tra la parafrasi meno simile e la
+# coppia diversa più simile. Se i due gruppi si sovrappongono lo segnala.
+#
+#   python benchmarks/calibrate_semantic_cache.py --embed-url http://localhost:9000/embed
+
+import os
+import sys
+import argparse
+
+import requests
+
+ROOT_DIR = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, os.path.join(ROOT_DIR, "api"))
+
+from semantic_cache import normalize_request, unit_vector, SEMANTIC_CACHE_THRESHOLD
+
+# Stessa richiesta, parole diverse: devono essere hit
+SAME = [
+    ("post about refillable shampoo", "refillable shampoo post"),
+    ("write a post about solid shampoo bars", "post on solid shampoo bars"),
+    ("benefits of bamboo toothbrushes", "why bamboo toothbrushes are good"),
+    ("zero waste skincare routine", "a zero-waste skincare routine"),
+    ("tips to reduce plastic in the bathroom", "how to reduce plastic in the bathroom"),
+    ("why choose microplastic-free cosmetics", "reasons to pick cosmetics without microplastics"),
+]
+
+# Richieste diverse (negazioni comprese): devono essere miss
+DIFFERENT = [
+    ("cosmetics with microplastics", "cosmetics with no microplastics"),
+    ("shampoo with sulfates", "shampoo without sulfates"),
+    ("post about refillable shampoo", "post about refillable conditioner"),
+    ("benefits of palm oil in soap", "problems of palm oil in soap"),
+    ("vegan lipstick", "vegan mascara"),
+    ("recyclable packaging", "non-recyclable packaging"),
+]
+
+
+def embed(url: str, texts: list) -> list:
+    # Stessa normalizzazione della cache dell'api
+    resp = requests.post(url, json={"texts": [normalize_request(t) for t in texts]}, timeout=60)
+    resp.raise_for_status()
+    return [unit_vector(v) for v in resp.json()["embeddings"]]
+
+
+def scores(url: str, pairs: list) -> list:
+    vectors = embed(url, [text for pair in pairs for text in pair])
+    return [float(vectors[i] @ vectors[i + 1]) for i in range(0, len(vectors), 2)]
+
+
+def report(title: str, pairs: list, values: list):
+    print(title)
+    for (a, b), score in zip(pairs, values):
+        print(f"  {score:.3f}  {a!r} / {b!r}")
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Taratura della soglia della cache semantica")
+    parser.add_argument("--embed-url", default="http://localhost:9000/embed", help="POST /embed del retriever")
+    args = parser.parse_args()
+
+    same = scores(args.embed_url, SAME)
+    different = scores(args.embed_url, DIFFERENT)
+    report("Stessa richiesta (devono essere hit)", SAME, same)
+    report("Richieste diverse (devono essere miss)", DIFFERENT, different)
+
+    low, high = min(same), max(different)
+    print(f"\nParafrasi meno simile: {low:.3f}, coppia diversa più simile: {high:.3f}")
+    print(f"Soglia attuale: {SEMANTIC_CACHE_THRESHOLD}")
+    if low > high:
+        print(f"Soglia suggerita: {round((low + high) / 2, 3)}")
+    else:
+        print("⚠️ I due gruppi si sovrappongono: nessuna soglia li separa, meglio una soglia alta (meno hit, nessuna risposta sbagliata)")
+        print(f"Soglia minima senza falsi hit: {round(high + 0.005, 3)}")
@@ -0,0 +1,303 @@
+# load_test.py
+#
+# Load test dell'api contro upstream locali: stub Fireworks, stub Together e
+# stub del retriever (o un retriever vero con --retriever-url). L'app FastAPI
+# gira con uvicorn su una porta libera, con storico e learned INCI in una
+# cartella temporanea e cache semantica disattivata. Ogni endpoint riceve
+# --requests richieste a --concurrency richieste in parallelo; per ognuno si
+# riportano throughput e latenze p50/p95/p99. Con --save il risultato diventa
+# una baseline JSON in benchmarks/baselines/, con --compare viene confrontato
+# con una baseline e il processo esce con codice 1 se qualcosa è peggiorato.
+#
+#   python benchmarks/load_test.py --requests 40 --concurrency 8 --save stub
+#   python benchmarks/load_test.py --requests 40 --concurrency 8 --compare stub
+#   python benchmarks/load_test.py --endpoints search --retriever-url http://localhost:9000/search
+
+import os
+import sys
+import json
+import time
+import socket
+import shutil
+import logging
+import argparse
+import tempfile
+import datetime
+import threading
+import statistics
+from concurrent.futures import ThreadPoolExecutor
+
+import requests
+
+ROOT_DIR = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+BENCH_DIR = os.path.dirname(os.path.abspath(__file__))
+BASELINES_DIR = os.path.join(BENCH_DIR, "baselines")
+IMAGE_DIRS = [os.path.join(ROOT_DIR, "data", "images"), os.path.join(ROOT_DIR, "data", "product_images")]
+sys.path.insert(0, os.path.join(ROOT_DIR, "api"))
+sys.path.insert(0, BENCH_DIR)
+
+from stub_fireworks import StubConfig, start_stub
+from stub_together import TogetherStubConfig, start_together_stub
+from stub_retriever import RetrieverStubConfig, start_retriever_stub
+
+ENDPOINTS = ("generate", "check_inci", "create_product", "search")
+
+TOPICS = [
+    "ridurre la plastica nella skincare",
+    "refillable shampoo bars",
+    "solari reef safe per l'estate",
+    "microplastics in cosmetics",
+    "packaging compostabile per creme",
+    "waterless beauty routine",
+]
+INCI_KNOWN = ["coconut oil", "jojoba oil", "petrolatum", "paraffinum liquidum"]
+
+
+def percentile(values: list, q: float) -> float:
+    ordered = sorted(values)
+    return ordered[min(len(ordered) - 1, round(q * (len(ordered) - 1)))]
+
+
+def free_port() -> int:
+    with socket.socket() as s:
+        s.bind(("127.0.0.1", 0))
+        return s.getsockname()[1]
+
+
+# =====================================
+# RICHIESTE
+# =====================================
+def make_request(endpoint: str, i: int, api_url: str, search_url: str) -> tuple:
+    """(metodo, url, body JSON) dell'i-esima richiesta; i testi variano per non riusare immagini già generate."""
+    topic = f"{TOPICS[i % len(TOPICS)]} #{i}"
+    if endpoint == "generate":
+        platform = "instagram" if i % 2 == 0 else "twitter"
+        return "POST", f"{api_url}/generate", {"query": topic, "platform": platform}
+    if endpoint == "check_inci":
+        unknowns = [f"bench extract {i}", f"bench ester {i % 5}"]
+        return "POST", f"{api_url}/check_inci", {"query": ", ".join(INCI_KNOWN[: 1 + i % 4] + unknowns)}
+    if endpoint == "create_product":
+        return "POST", f"{api_url}/create_product", {"hint": topic if i % 3 else None}
+    return "POST", search_url, {"query": topic, "index_type": "post"}
+
+
+def run_endpoint(endpoint: str, n: int, concurrency: int, api_url: str, search_url: str) -> tuple:
+    """Ritorna (statistiche, id dei job immagine restituiti)."""
+    local = threading.local()
+
+    def one(i: int):
+        if not hasattr(local, "session"):
+            local.session = requests.Session()
+        method, url, body = make_request(endpoint, i, api_url, search_url)
+        t0 = time.perf_counter()
+        try:
+            resp = local.session.request(method, url, json=body, timeout=120)
+            ok = resp.status_code == 200
+            job_id = resp.json().get("image_job_id") if ok else None
+        except requests.RequestException:
+            ok, job_id = False, None
+        return (time.perf_counter() - t0) * 1000, ok, job_id
+
+    start = time.perf_counter()
+    with ThreadPoolExecutor(max_workers=concurrency) as pool:
+        results = list(pool.map(one, range(n)))
+    wall = time.perf_counter() - start
+
+    latencies = [ms for ms, ok, _ in results if ok]
+    stats = {
+        "requests": n,
+        "errors": sum(1 for _, ok, _ in results if not ok),
+        "wall_s": round(wall, 3),
+        "throughput_rps": round(len(latencies) / wall, 2),
+    }
+    if latencies:
+        stats.update({
+            "p50_ms": round(percentile(latencies, 0.50), 1),
+            "p95_ms": round(percentile(latencies, 0.95), 1),
+            "p99_ms": round(percentile(latencies, 0.99), 1),
+            "mean_ms": round(statistics.mean(latencies), 1),
+        })
+    return stats, [job_id for _, _, job_id in results if job_id]
+
+
+def wait_image_jobs(api_url: str, job_ids: list, timeout: float = 120) -> dict:
+    """Attende i job immagine e riporta quanti sono finiti e con quale esito."""
+    pending, outcome = set(job_ids), {"done": 0, "error": 0, "timeout": 0}
+    deadline = time.time() + timeout
+    while pending and time.time() < deadline:
+        for job_id in list(pending):
+            job = requests.get(f"{api_url}/image_jobs/{job_id}", timeout=10).json()
+            if job.get("status") in ("done", "error"):
+                outcome[job["status"]] += 1
+                pending.discard(job_id)
+        time.sleep(0.2)
+    outcome["timeout"] = len(pending)
+    return outcome
+
+
+# =====================================
+# BASELINE
+# =====================================
+def baseline_path(name: str) -> str:
+    if name.endswith(".json") or os.sep in name:
+        return name
+    return os.path.join(BASELINES_DIR, f"{name}.json")
+
+
+def compare(current: dict, baseline: dict, tolerance: float) -> list:
+    """Regressioni rispetto alla baseline: latenze oltre la tolleranza, throughput sotto, nuovi errori."""
+    regressions = []
+    for endpoint, stats in current["endpoints"].items():
+        base = baseline.get("endpoints", {}).get(endpoint)
+        if not base:
+            continue
+        for key in ("p50_ms", "p95_ms", "p99_ms"):
+            if key in stats and key in base and stats[key] > base[key] * (1 + tolerance):
+                regressions.append(f"{endpoint}: {key} {base[key]} → {stats[key]}")
+        if stats["throughput_rps"] < base["throughput_rps"] * (1 - tolerance):
+            regressions.append(f"{endpoint}: throughput {base['throughput_rps']} → {stats['throughput_rps']} req/s")
+        base_rate = base["errors"] / base["requests"]
+        rate = stats["errors"] / stats["requests"]
+        if rate > base_rate + tolerance * max(base_rate, 0.05):
+            regressions.append(f"{endpoint}: errori {base['errors']}/{base['requests']} → {stats['errors']}/{stats['requests']}")
+    return regressions
+
+
+def print_report(report: dict):
+    print(f"\n{'endpoint':<16}{'req':>5}{'err':>5}{'req/s':>9}{'p50 ms':>10}{'p95 ms':>10}{'p99 ms':>10}")
+    for endpoint, s in report["endpoints"].items():
+        label = endpoint + (" (stub)" if s.get("stub") else "")
+        print(f"{label:<16}{s['requests']:>5}{s['errors']:>5}{s['throughput_rps']:>9}"
+              f"{s.get('p50_ms', '-'):>10}{s.get('p95_ms', '-'):>10}{s.get('p99_ms', '-'):>10}")
+    print(f"\nupstream: {report['upstream']}")
+    if report.get("image_jobs"):
+        print(f"job immagine: {report['image_jobs']}")
+
+
+# =====================================
+# MAIN
+# =====================================
+def main():
+    parser = argparse.ArgumentParser(description="Load test di api e retriever contro upstream locali")
+    parser.add_argument("--endpoints", default=",".join(ENDPOINTS), help=f"sottoinsieme di {','.join(ENDPOINTS)}")
+    parser.add_argument("--requests", type=int, default=20, help="richieste per endpoint")
+    parser.add_argument("--concurrency", type=int, default=4)
+    parser.add_argument("--base-latency", type=float, default=0.4, help="latenza base Fireworks (s)")
+    parser.add_argument("--token-latency", type=float, default=0.005, help="latenza per token Fireworks (s)")
+    parser.add_argument("--error-rate", type=float, default=0.0, help="frazione di 429 da Fireworks e Together")
+    parser.add_argument("--completion-chars", type=int, default=0, help="lunghezza minima dei post generati")
+    parser.add_argument("--image-latency", type=float, default=2.0, help="latenza Together (s)")
+    parser.add_argument("--image-size", type=int, default=512, help="lato in pixel delle immagini Together")
+    parser.add_argument("--retriever-latency", type=float, default=0.15, help="latenza dello stub retriever (s)")
+    parser.add_argument("--retriever-url", help="/search di un retriever vero (default: stub)")
+    parser.add_argument("--save", metavar="NAME", help="salva il risultato come baseline")
+    parser.add_argument("--compare", metavar="NAME", help="confronta con una baseline (nome o percorso)")
+    parser.add_argument("--tolerance", type=float, default=0.2, help="peggioramento tollerato (0.2 = 20%%)")
+    parser.add_argument("--verbose", action="store_true", help="mostra i log dell'api")
+    args = parser.parse_args()
+
+    endpoints = [e.strip() for e in args.endpoints.split(",") if e.strip()]
+    unknown = set(endpoints) - set(ENDPOINTS)
+    if unknown:
+        parser.error(f"endpoint sconosciuti: {', '.join(sorted(unknown))}")
+
+    fireworks_config = StubConfig(args.base_latency, args.token_latency, args.error_rate, args.completion_chars)
+    together_config = TogetherStubConfig(args.image_latency, args.error_rate, args.image_size)
+    retriever_config = RetrieverStubConfig(args.retriever_latency)
+    _, fireworks_url = start_stub(config=fireworks_config)
+    _, together_url = start_together_stub(config=together_config)
+    _, retriever_url = start_retriever_stub(config=retriever_config)
+    search_url = args.retriever_url or retriever_url
+
+    workdir = tempfile.mkdtemp(prefix="load_test_")
+    api_port = free_port()
+    os.environ.update({
+        "FIREWORKS_URL": fireworks_url,
+        "TOGETHER_BASE_URL": together_url,
+        "RETRIEVER_URL": search_url,
+        "RETRIEVER_MODE": "http",
+        "HISTORY_DB": os.path.join(workdir, "history.db"),
+        "LEARNED_CSV": os.path.join(workdir, "inci_learned.csv"),
+        "SEMANTIC_CACHE_ENABLED": "false",
+        "FIREWORKS_RETRY_WAIT_SECONDS": "0.2",
+        "PUBLIC_BASE_URL": f"http://127.0.0.1:{api_port}",
+    })
+    os.environ.setdefault("FIREWORKS_API_KEY_MIA", "bench")
+    os.environ.setdefault("TOGETHER_API_KEY", "bench")
+
+    existing_images = {d: set(os.listdir(d)) if os.path.isdir(d) else None for d in IMAGE_DIRS}
+
+    import uvicorn
+    import main as api_main
+    if not args.verbose:
+        logging.getLogger().setLevel(logging.WARNING)
+
+    server = uvicorn.Server(uvicorn.Config(api_main.app, host="127.0.0.1", port=api_port, log_level="warning"))
+    threading.Thread(target=server.run, daemon=True).start()
+    while not server.started:
+        time.sleep(0.05)
+    api_url = f"http://127.0.0.1:{api_port}"
+
+    print(f"{args.requests} richieste per endpoint, concorrenza {args.concurrency}, "
+          f"Fireworks {args.base_latency}s + {args.token_latency}s/token, Together {args.image_latency}s, "
+          f"429 {args.error_rate:.0%}, retriever {'reale' if args.retriever_url else 'stub'}")
+
+    report = {
+        "name": args.save or "",
+        "created_at": datetime.datetime.now().isoformat(timespec="seconds"),
+        "config": {k: v for k, v in vars(args).items() if k not in ("save", "compare", "tolerance", "verbose")},
+        "endpoints": {},
+    }
+    job_ids = []
+    try:
+        for endpoint in endpoints:
+            stats, jobs = run_endpoint(endpoint, args.requests, args.concurrency, api_url, search_url)
+            if endpoint == "search":
+                stats["stub"] = not args.retriever_url
+            report["endpoints"][endpoint] = stats
+            job_ids.extend(jobs)
+            print(f"  {endpoint}: {stats['throughput_rps']} req/s, {stats['errors']} errori")
+        if job_ids:
+            report["image_jobs"] = wait_image_jobs(api_url, job_ids)
+            time.sleep(1)  # varianti WebP create in background dopo il download
+    finally:
+        server.should_exit = True
+        # Le immagini finte dello stub non restano in data/
+        for directory, before in existing_images.items():
+            if before is None:
+                shutil.rmtree(directory, ignore_errors=True)
+            elif os.path.isdir(directory):
+                for name in set(os.listdir(directory)) - before:
+                    os.remove(os.path.join(directory, name))
+        shutil.rmtree(workdir, ignore_errors=True)
+
+    report["upstream"] = {
+        "fireworks_calls": fireworks_config.calls,
+        "fireworks_429": fireworks_config.errors,
+        "together_calls": together_config.calls,
+        "together_429": together_config.errors,
+        "retriever_stub_calls": retriever_config.calls,
+    }
+    print_report(report)
+
+    if args.save:
+        os.makedirs(BASELINES_DIR, exist_ok=True)
+        path = baseline_path(args.save)
+        with open(path, "w", encoding="utf-8") as f:
+            json.dump(report, f, ensure_ascii=False, indent=2)
+        print(f"\nbaseline salvata in {path}")
+
+    if args.compare:
+        with open(baseline_path(args.compare), encoding="utf-8") as f:
+            baseline = json.load(f)
+        regressions = compare(report, baseline, args.tolerance)
+        if regressions:
+            print(f"\n❌ {len(regressions)} regressioni rispetto a {args.compare} (tolleranza {args.tolerance:.0%}):")
+            for line in regressions:
+                print(f"  - {line}")
+            sys.exit(1)
+        print(f"\n✅ nessuna regressione rispetto a {args.compare} (tolleranza {args.tolerance:.0%})")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,163 @@
+# stub_fireworks.py
+#
+# Stand-in locale dell'endpoint chat/completions di Fireworks per i benchmark.
+# La latenza simulata è: base + tempo per token generato. Con `error_rate` una
+# frazione delle richieste riceve 429 (rate limit), con `completion_chars` i
+# post generati vengono allungati fino a quella dimensione.
+
+import re
+import json
+import time
+import random
+import threading
+import argparse
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+
+class StubConfig:
+    def __init__(
+        self,
+        base_latency: float = 0.4,
+        token_latency: float = 0.005,
+        error_rate: float = 0.0,
+        completion_chars: int = 0,
+        seed: int = 0,
+    ):
+        self.base_latency = base_latency
+        self.token_latency = token_latency
+        self.error_rate = error_rate
+        self.completion_chars = completion_chars
+        self.calls = 0
+        self.errors = 0
+        self.lock = threading.Lock()
+        self.random = random.Random(seed)
+
+    def should_fail(self) -> bool:
+        with self.lock:
+            self.calls += 1
+            if self.random.random() < self.error_rate:
+                self.errors += 1
+                return True
+        return False
+
+
+FILLER = " Small daily choices add up: refill, reuse and choose certified green formulas."
+
+
+def fake_product(prompt: str) -> str:
+    hint = re.search(r"Suggerimento utente \(opzionale\): (.*)", prompt)
+    hint = hint.group(1).strip() if hint and hint.group(1).strip() else "trend green"
+    return json.dumps({
+        "nome_prodotto": f"Shampoo solido {hint[:40]}",
+        "descrizione": "Shampoo solido ricaricabile con tensioattivi delicati di origine vegetale.",
+        "categoria": "shampoo",
+        "ingredienti": ["Sodium Coco-Sulfate", "Aloe Barbadensis Leaf Juice", "Glycerin"],
+        "note_sostenibilita": "Zero plastica, confezione in carta riciclata.",
+        "image_prompt": f"shampoo solido {hint[:60]} visto frontalmente, dettagli realistici",
+    }, ensure_ascii=False)
+
+
+def fake_completion(prompt: str, completion_chars: int = 0) -> str:
+    if '"nome_prodotto"' in prompt:
+        return fake_product(prompt)
+    batch = re.search(r"Ingredients \(JSON\): (\[.*?\])\n", prompt)
+    if batch:
+        ingredients = json.loads(batch.group(1))
+        return json.dumps([
+            {"ingredient": ing, "status": "neutral", "reason": "commonly used, no known concerns"}
+            for ing in ingredients
+        ])
+    if "Ingredient:" in prompt:
+        return "neutral, commonly used with no known concerns."
+    translation = re.match(r"Translate the following text to (\w+)\..*?\n\n(.*)", prompt, re.DOTALL)
+    if translation:
+        return f"[{translation.group(1)}] {translation.group(2)}"
+    request = re.search(r'User Request:\n"(.*?)"', prompt)
+    if request and "refill" not in request.group(1).lower():
+        post = f"Small swaps, big impact: {request.group(1)[:120]} for a greener routine! #zerowaste #greenbeauty"
+    else:
+        post = "Refill your routine, not the planet. Our shampoo bars cut plastic waste! #zerowaste #greenbeauty"
+    while len(post) < completion_chars:
+        post += FILLER
+    return post
+
+
+def make_handler(config: StubConfig):
+    class Handler(BaseHTTPRequestHandler):
+        protocol_version = "HTTP/1.1"
+
+        def do_POST(self):
+            length = int(self.headers.get("Content-Length", 0))
+            payload = json.loads(self.rfile.read(length) or b"{}")
+            prompt = payload.get("messages", [{}])[-1].get("content", "")
+            content = fake_completion(prompt, config.completion_chars)
+
+            if config.should_fail():
+                self._send_json(429, {"error": {"message": "rate limit exceeded (stub)"}})
+                return
+
+            if payload.get("stream"):
+                self._stream(content)
+                return
+
+            time.sleep(config.base_latency + config.token_latency * (len(content) / 4))
+            self._send_json(200, {"choices": [{"message": {"role": "assistant", "content": content}}]})
+
+        def _send_json(self, status: int, data: dict):
+            body = json.dumps(data).encode()
+            self.send_response(status)
+            self.send_header("Content-Type", "application/json")
+            self.send_header("Content-Length", str(len(body)))
+            self.end_headers()
+            self.wfile.write(body)
+
+        def _stream(self, content: str):
+            # Risposta SSE come Fireworks con "stream": true, un frammento per parola
+            self.send_response(200)
+            self.send_header("Content-Type", "text/event-stream")
+            self.send_header("Transfer-Encoding", "chunked")
+            self.end_headers()
+            time.sleep(config.base_latency)
+            for piece in re.findall(r"\S+\s*", content):
+                time.sleep(config.token_latency * max(1, len(piece) / 4))
+                chunk = {"choices": [{"delta": {"content": piece}}]}
+                self._write_chunk(f"data: {json.dumps(chunk)}\n\n".encode())
+            self._write_chunk(b"data: [DONE]\n\n")
+            self._write_chunk(b"")
+
+        def _write_chunk(self, data: bytes):
+            self.wfile.write(f"{len(data):X}\r\n".encode() + data + b"\r\n")
+            self.wfile.flush()
+
+        def log_message(self, *args):
+            pass
+
+    return Handler
+
+
+def start_stub(port: int = 0, config: StubConfig = None):
+    """Avvia lo stub in un thread daemon; ritorna (server, url)."""
+    config = config or StubConfig()
+    server = ThreadingHTTPServer(("127.0.0.1", port), make_handler(config))
+    server.config = config
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+    url = f"http://127.0.0.1:{server.server_address[1]}/inference/v1/chat/completions"
+    return server, url
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Stub locale Fireworks chat/completions")
+    parser.add_argument("--port", type=int, default=8100)
+    parser.add_argument("--base-latency", type=float, default=0.4)
+    parser.add_argument("--token-latency", type=float, default=0.005)
+    parser.add_argument("--error-rate", type=float, default=0.0, help="frazione di risposte 429")
+    parser.add_argument("--completion-chars", type=int, default=0, help="lunghezza minima dei post generati")
+    args = parser.parse_args()
+
+    config = StubConfig(args.base_latency, args.token_latency, args.error_rate, args.completion_chars)
+    server, url = start_stub(args.port, config)
+    print(f"Stub Fireworks in ascolto su {url}")
+    try:
+        threading.Event().wait()
+    except KeyboardInterrupt:
+        server.shutdown()
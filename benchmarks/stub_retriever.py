@@ -0,0 +1,87 @@
+# stub_retriever.py
+#
+# Stand-in locale degli endpoint /search, /search_batch e /embed del retriever per i
+# benchmark: risponde con documenti fissi dopo una latenza simulata. Gli embedding
+# sono parole con hashing, sufficienti a far funzionare la cache semantica dell'api.
+
+import json
+import time
+import zlib
+import threading
+import argparse
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+STUB_DOCS = [
+    {"content": "Switching to solid shampoo bars saves plastic bottles every month. #zerowaste", "metadata": {"sentiment": "positive"}},
+    {"content": "Refillable packaging is the new normal for clean beauty brands. #greenbeauty", "metadata": {"sentiment": "positive"}},
+    {"content": "Microplastics in cosmetics are still a big concern for consumers.", "metadata": {"sentiment": "negative"}},
+]
+
+
+EMBEDDING_DIM = 64
+
+
+def stub_embedding(text: str) -> list:
+    vector = [0.0] * EMBEDDING_DIM
+    for word in text.lower().split():
+        vector[zlib.crc32(word.encode("utf-8")) % EMBEDDING_DIM] += 1.0
+    return vector
+
+
+class RetrieverStubConfig:
+    def __init__(self, latency: float = 0.15):
+        self.latency = latency
+        self.calls = 0
+        self.lock = threading.Lock()
+
+
+def make_handler(config: RetrieverStubConfig):
+    class Handler(BaseHTTPRequestHandler):
+        protocol_version = "HTTP/1.1"
+
+        def do_POST(self):
+            length = int(self.headers.get("Content-Length", 0))
+            payload = json.loads(self.rfile.read(length) or b"{}")
+            with config.lock:
+                config.calls += 1
+            time.sleep(config.latency)
+            if self.path.endswith("/embed"):
+                body = json.dumps({"model": "stub", "embeddings": [stub_embedding(t) for t in payload.get("texts", [])]}).encode()
+            elif self.path.endswith("/search_batch"):
+                # Una sola andata e ritorno per tutte le query del batch
+                body = json.dumps({"results": [{"results": STUB_DOCS} for _ in payload.get("requests", [])]}).encode()
+            else:
+                body = json.dumps({"results": STUB_DOCS}).encode()
+            self.send_response(200)
+            self.send_header("Content-Type", "application/json")
+            self.send_header("Content-Length", str(len(body)))
+            self.end_headers()
+            self.wfile.write(body)
+
+        def log_message(self, *args):
+            pass
+
+    return Handler
+
+
+def start_retriever_stub(port: int = 0, config: RetrieverStubConfig = None):
+    """Avvia lo stub in un thread daemon; ritorna (server, url di /search)."""
+    config = config or RetrieverStubConfig()
+    server = ThreadingHTTPServer(("127.0.0.1", port), make_handler(config))
+    server.config = config
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+    return server, f"http://127.0.0.1:{server.server_address[1]}/search"
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Stub locale del retriever /search")
+    parser.add_argument("--port", type=int, default=9100)
+    parser.add_argument("--latency", type=float, default=0.15)
+    args = parser.parse_args()
+
+    server, url = start_retriever_stub(args.port, RetrieverStubConfig(args.latency))
+    print(f"Stub retriever in ascolto su {url}")
+    try:
+        threading.Event().wait()
+    except KeyboardInterrupt:
+        server.shutdown()
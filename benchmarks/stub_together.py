@@ -0,0 +1,120 @@
+# stub_together.py
+#
+# Stand-in locale dell'endpoint images/generations di Together per i benchmark.
+# Risponde dopo una latenza simulata con l'URL di un PNG servito dallo stub
+# stesso (lato configurabile); con `error_rate` una frazione delle richieste
+# riceve 429. Ogni immagine è diversa, così la cache content-addressed dell'api
+# non nasconde il costo di download e salvataggio.
+
+import io
+import json
+import time
+import random
+import threading
+import argparse
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+from PIL import Image
+
+
+class TogetherStubConfig:
+    def __init__(self, latency: float = 2.0, error_rate: float = 0.0, image_size: int = 512, seed: int = 0):
+        self.latency = latency
+        self.error_rate = error_rate
+        self.image_size = image_size
+        self.calls = 0
+        self.errors = 0
+        self.images = {}   # nome file -> PNG
+        self.lock = threading.Lock()
+        self.random = random.Random(seed)
+
+    def should_fail(self) -> bool:
+        with self.lock:
+            self.calls += 1
+            if self.random.random() < self.error_rate:
+                self.errors += 1
+                return True
+        return False
+
+    def new_image(self) -> str:
+        # Pixel casuali: il PNG non si comprime, il peso cresce con il lato (~3 byte per pixel)
+        with self.lock:
+            name = f"{len(self.images)}.png"
+            pixels = self.random.randbytes(self.image_size * self.image_size * 3)
+            self.images[name] = b""
+        buffer = io.BytesIO()
+        Image.frombytes("RGB", (self.image_size, self.image_size), pixels).save(buffer, format="PNG")
+        with self.lock:
+            self.images[name] = buffer.getvalue()
+        return name
+
+
+def make_handler(config: TogetherStubConfig):
+    class Handler(BaseHTTPRequestHandler):
+        protocol_version = "HTTP/1.1"
+
+        def do_POST(self):
+            length = int(self.headers.get("Content-Length", 0))
+            payload = json.loads(self.rfile.read(length) or b"{}")
+            if not self.path.endswith("/images/generations"):
+                self._send(404, b"{}", "application/json")
+                return
+            if config.should_fail():
+                body = json.dumps({"error": {"message": "rate limit exceeded (stub)"}}).encode()
+                self._send(429, body, "application/json")
+                return
+
+            time.sleep(config.latency)
+            name = config.new_image()
+            host = f"http://127.0.0.1:{self.server.server_address[1]}"
+            body = json.dumps({
+                "id": f"stub-{name}",
+                "model": payload.get("model", ""),
+                "object": "list",
+                "data": [{"index": 0, "url": f"{host}/files/{name}"}],
+            }).encode()
+            self._send(200, body, "application/json")
+
+        def do_GET(self):
+            image = config.images.get(self.path.rsplit("/", 1)[-1])
+            if image is None:
+                self._send(404, b"", "text/plain")
+                return
+            self._send(200, image, "image/png")
+
+        def _send(self, status: int, body: bytes, content_type: str):
+            self.send_response(status)
+            self.send_header("Content-Type", content_type)
+            self.send_header("Content-Length", str(len(body)))
+            self.end_headers()
+            self.wfile.write(body)
+
+        def log_message(self, *args):
+            pass
+
+    return Handler
+
+
+def start_together_stub(port: int = 0, config: TogetherStubConfig = None):
+    """Avvia lo stub in un thread daemon; ritorna (server, base_url da usare come TOGETHER_BASE_URL)."""
+    config = config or TogetherStubConfig()
+    server = ThreadingHTTPServer(("127.0.0.1", port), make_handler(config))
+    server.config = config
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+    return server, f"http://127.0.0.1:{server.server_address[1]}/v1"
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Stub locale Together images/generations")
+    parser.add_argument("--port", type=int, default=8200)
+    parser.add_argument("--latency", type=float, default=2.0)
+    parser.add_argument("--error-rate", type=float, default=0.0, help="frazione di risposte 429")
+    parser.add_argument("--image-size", type=int, default=512, help="lato in pixel dei PNG restituiti")
+    args = parser.parse_args()
+
+    server, url = start_together_stub(args.port, TogetherStubConfig(args.latency, args.error_rate, args.image_size))
+    print(f"Stub Together in ascolto su {url}")
+    try:
+        threading.Event().wait()
+    except KeyboardInterrupt:
+        server.shutdown()
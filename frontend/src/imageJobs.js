@@ -0,0 +1,22 @@
+// Segue un job immagine del backend via server-sent events e restituisce l'URL finale
+export function waitForImage(jobId) {
+  return new Promise((resolve, reject) => {
+    const source = new EventSource(`http://localhost:8000/image_jobs/${jobId}/events`);
+
+    source.addEventListener("status", (event) => {
+      const job = JSON.parse(event.data);
+      if (job.status === "done") {
+        source.close();
+        resolve(job.image_url);
+      } else if (job.status === "error") {
+        source.close();
+        reject(new Error(job.error || "Image generation failed"));
+      }
+    });
+
+    source.onerror = () => {
+      source.close();
+      reject(new Error("Lost connection to image job"));
+    };
+  });
+}
@@ -1,5 +1,6 @@
 import { useState } from "react";
 import Navbar from "../components/Navbar";
+import { waitForImage } from "../imageJobs";
 
 function CreateProduct() {
   const [hint, setHint] = useState("");
@@ -39,6 +40,15 @@ function CreateProduct() {
         notes: data.note_sostenibilita,
         imageUrl: data.image_url,
       });
+
+      if (data.image_job_id) {
+        try {
+          const imageUrl = await waitForImage(data.image_job_id);
+          setProductDetails((details) => ({ ...details, imageUrl }));
+        } catch (err) {
+          setError(`Image error: ${err.message}`);
+        }
+      }
     } catch (err) {
       setError(`Connection error: ${err.message}`);
     }
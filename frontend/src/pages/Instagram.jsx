@@ -1,10 +1,13 @@
 import { useState } from "react";
 import Navbar from "../components/Navbar";
+import { waitForImage } from "../imageJobs";
+import { postEventStream } from "../sse";
 
 function Instagram() {
   const [question, setQuestion] = useState("");
   const [answer, setAnswer] = useState("");
   const [imageUrl, setImageUrl] = useState(null);
+  const [imageLoading, setImageLoading] = useState(false);
   const [error, setError] = useState(null);
 
   // Stati demo
@@ -27,20 +30,32 @@ function Instagram() {
     }
 
     try {
-      const res = await fetch("http://localhost:8000/generate", {
-        method: "POST",
-        headers: { "Content-Type": "application/json" },
-        body: JSON.stringify({ query: question, platform: "instagram" }),
-      });
-
-      if (!res.ok) {
-        setError(`Backend error: ${res.status}`);
-        return;
+      // I token arrivano man mano; l'evento `done` porta il testo definitivo e il job immagine
+      let imageJobId = null;
+      await postEventStream(
+        "http://localhost:8000/generate_stream",
+        { query: question, platform: "instagram" },
+        (event, data) => {
+          if (event === "token") setAnswer((text) => text + data.text);
+          else if (event === "done") {
+            setAnswer(data.answer || "No response");
+            setImageUrl(data.image_url || null);
+            imageJobId = data.image_job_id;
+          }
+        }
+      );
+
+      // Il testo arriva subito, l'immagine appena il job in background è pronto
+      if (imageJobId) {
+        setImageLoading(true);
+        try {
+          setImageUrl(await waitForImage(imageJobId));
+        } catch (err) {
+          setError(`Image error: ${err.message}`);
+        } finally {
+          setImageLoading(false);
+        }
       }
-
-      const data = await res.json();
-      setAnswer(data.answer || "No response");
-      setImageUrl(data.image_url || null);
     } catch (err) {
       setError(`Connection error: ${err.message}`);
     }
@@ -126,6 +141,8 @@ function Instagram() {
           </div>
         )}
 
+        {imageLoading && <p className="text-white mt-6">Generating image...</p>}
+
         {imageUrl && (
           <div className="mt-6 w-full max-w-3xl">
             <h2 className="font-bold text-xl mb-2 text-white">Generated Image:</h2>
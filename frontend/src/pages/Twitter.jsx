@@ -1,5 +1,6 @@
 import { useState } from "react";
 import Navbar from "../components/Navbar";
+import { postEventStream } from "../sse";
 
 function Twitter() {
   const [question, setQuestion] = useState("");
@@ -27,20 +28,18 @@ function Twitter() {
     }
 
     try {
-      const res = await fetch("http://localhost:8000/generate", {
-        method: "POST",
-        headers: { "Content-Type": "application/json" },
-        body: JSON.stringify({ query: question, platform: "twitter" }),
-      });
-
-      if (!res.ok) {
-        setError(`Backend error: ${res.status}`);
-        return;
-      }
-
-      const data = await res.json();
-      setAnswer(data.answer || "No response");
-      setImageUrl(data.image_url || null);
+      // I token arrivano man mano; l'evento `done` porta il testo definitivo (eventualmente tradotto)
+      await postEventStream(
+        "http://localhost:8000/generate_stream",
+        { query: question, platform: "twitter" },
+        (event, data) => {
+          if (event === "token") setAnswer((text) => text + data.text);
+          else if (event === "done") {
+            setAnswer(data.answer || "No response");
+            setImageUrl(data.image_url || null);
+          }
+        }
+      );
     } catch (err) {
       setError(`Connection error: ${err.message}`);
     }
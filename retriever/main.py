@@ -10,11 +10,17 @@ from langchain.text_splitter import RecursiveCharacterTextSplitter
 from langchain_community.vectorstores import FAISS
 from langchain_huggingface import HuggingFaceEmbeddings
 import re
+import sys
 import numpy as np
 import csv
 import datetime
 from scipy.spatial.distance import cosine
 
+# trend_digest sits next to this file (also when imported in-process by the api)
+sys.path.append(os.path.dirname(os.path.abspath(__file__)))
+from trend_digest import parse_tweet_records, ensure_digest, read_digest, TREND_DIGEST_PATH
+import telemetry
+
 # =====================================
 # LOGGING & ENV CONFIGURATION
 # =====================================
@@ -50,8 +56,14 @@ def getenv_path(env_var, root_dir, default):
 
 INDEX_PATHS = {
     "post": getenv_path("INDEX_PATH_POST", ROOT_DIR, os.path.join(DATA_DIR, "faiss_index_post")),
+    "post_multilingual": getenv_path("INDEX_PATH_POST_MULTILINGUAL", ROOT_DIR, os.path.join(DATA_DIR, "faiss_index_post_multilingual")),
 }
 
+EMBEDDING_MODEL = "all-MiniLM-L6-v2"
+# Indice multilingue opzionale: query in it/fr/es/de cercano direttamente sui tweet, senza traduzione
+ENABLE_MULTILINGUAL_INDEX = os.getenv("ENABLE_MULTILINGUAL_INDEX", "false").lower() in ("1", "true", "yes")
+MULTILINGUAL_EMBEDDING_MODEL = os.getenv("MULTILINGUAL_EMBEDDING_MODEL", "paraphrase-multilingual-MiniLM-L12-v2")
+
 FILE_METADATA_POST = {
     getenv_path("TWEETS_ESG", ROOT_DIR, os.path.join(DATA_DIR, "tweets_ESG.txt")): "tweet_ESG",
     getenv_path("TWEETS_GREEN", ROOT_DIR, os.path.join(DATA_DIR, "tweets_green.txt")): "tweet_green",
@@ -72,42 +84,13 @@ def parse_tweet_blocks(file_path, category):
     with open(file_path, encoding="utf-8") as f:
         raw_text = f.read()
 
-    blocks = raw_text.split('---')
     documents = []
-    seen_ids = set()
-
-    for block in blocks:
-        lines = block.strip().splitlines()
-        if not lines:
-            continue
-
-        tweet_text = ""
+    for record in parse_tweet_records(raw_text):
         metadata = {"source": os.path.basename(file_path), "category": category}
-        tweet_id = None
-
-        for line in lines:
-            line = line.strip()
-            if line.startswith("ID:"):
-                tweet_id = line[len("ID:"):].strip()
-                metadata["id"] = tweet_id
-            elif line.startswith("Text:"):
-                tweet_text = line[len("Text:"):].strip()
-            elif re.match(r"(?i)^Sentiment:", line):
-                metadata["sentiment"] = line.split(":", 1)[1].strip()
-            elif re.match(r"(?i)^Confidence:", line):
-                try:
-                    metadata["confidence"] = float(line.split(":", 1)[1].strip())
-                except:
-                    metadata["confidence"] = None
-
-        if tweet_id and tweet_id in seen_ids:
-            logger.debug(f"🔁 Duplicate document with ID {tweet_id}, skipped.")
-            continue
-
-        if tweet_text:
-            documents.append(Document(page_content=tweet_text, metadata=metadata))
-            if tweet_id:
-                seen_ids.add(tweet_id)
+        for key in ("id", "sentiment", "confidence"):
+            if record[key] is not None:
+                metadata[key] = record[key]
+        documents.append(Document(page_content=record["text"], metadata=metadata))
 
     logger.info(f"📄 Parsed {len(documents)} tweet documents from {file_path}")
     return documents
@@ -146,12 +129,31 @@ def load_documents_from_files(files_map: dict) -> List[Document]:
 # =====================================
 # VECTORSTORE
 # =====================================
-def get_vectorstore(docs: List[Document], index_path: str):
-    embedding = HuggingFaceEmbeddings(model_name="all-MiniLM-L6-v2")
-    if not os.path.exists(index_path):
-        logger.info("🧐 Creating new FAISS index")
+MODEL_MARKER = "embedding_model.txt"
+
+
+def read_index_model(index_path: str):
+    marker = os.path.join(index_path, MODEL_MARKER)
+    if not os.path.exists(marker):
+        return None
+    with open(marker, encoding="utf-8") as f:
+        return f.read().strip()
+
+
+def get_vectorstore(docs: List[Document], index_path: str, model_name: str = EMBEDDING_MODEL):
+    embedding = HuggingFaceEmbeddings(model_name=model_name)
+    # The index stores vectors only: loading it with a different model would silently
+    # mix embedding spaces, so the model that built it is kept next to it
+    index_model = read_index_model(index_path) if os.path.exists(index_path) else None
+    if index_model != model_name:
+        if os.path.exists(index_path):
+            logger.warning(f"♻️ FAISS index at {index_path} was built with {index_model or 'an unknown model'}, rebuilding with {model_name}")
+        else:
+            logger.info(f"🧐 Creating new FAISS index with {model_name}")
         vectorstore = FAISS.from_documents(docs, embedding)
         vectorstore.save_local(index_path)
+        with open(os.path.join(index_path, MODEL_MARKER), "w", encoding="utf-8") as f:
+            f.write(model_name)
         logger.info(f"💾 FAISS index saved at {index_path}")
     else:
         logger.info("📂 Loading existing FAISS index")
@@ -168,53 +170,58 @@ def get_context_stratified(
     k: int = 5,
     search_k: int = 50,
     allowed_categories: list = None,
+    query_embedding: list = None,
 ) -> dict:
-    results = vectorstore.similarity_search(query, k=search_k)
+    if query_embedding is None:
+        with telemetry.span("embed_query"):
+            query_embedding = vectorstore.embedding_function.embed_query(query)
+    with telemetry.span("faiss_search"):
+        results = vectorstore.similarity_search_by_vector(query_embedding, k=search_k)
     logger.info(f"🔍 Found {len(results)} initial documents for query: '{query}'")
 
-    results.sort(key=lambda d: float(d.metadata.get("confidence") or 0), reverse=True)
-
-    def filter_by_sentiment_confidence(sentiment: str, min_conf: float):
-        return [
-            doc for doc in results
-            if doc.metadata.get("sentiment", "").lower() == sentiment.lower()
-            and float(doc.metadata.get("confidence") or 0) >= min_conf
-            and (allowed_categories is None or doc.metadata.get("category") in allowed_categories)
-        ]
-
-    positives = filter_by_sentiment_confidence("positive", 0.8)
-    if len(positives) < 20:
-        positives = filter_by_sentiment_confidence("positive", 0.6)
-
-    def get_embedding(text):
-        return vectorstore.embedding_function.embed_query(text)
-
-    query_embedding = get_embedding(query)
-
-    def similarity(doc):
-        doc_embedding = get_embedding(doc.page_content)
-        return 1 - cosine(query_embedding, doc_embedding)  # usa scipy cosine
-
-    positives.sort(key=similarity, reverse=True)
-    selected = positives[:k]
-
-    if len(selected) < k:
-        remaining = k - len(selected)
-        neutrals = filter_by_sentiment_confidence("neutral", 0.5)
-        neutrals.sort(key=similarity, reverse=True)
-        selected += neutrals[:remaining]
-
-    if len(selected) < k:
-        remaining = k - len(selected)
-        unknowns = [
-            doc for doc in results
-            if doc.metadata.get("sentiment", "").lower() not in ("positive", "neutral")
-            and (allowed_categories is None or doc.metadata.get("category") in allowed_categories)
-        ]
-        unknowns.sort(key=similarity, reverse=True)
-        selected += unknowns[:remaining]
-
-    selected = selected[:k]
+    # Rerank: every candidate is re-embedded and compared with the query
+    with telemetry.span("rerank"):
+        results.sort(key=lambda d: float(d.metadata.get("confidence") or 0), reverse=True)
+
+        def filter_by_sentiment_confidence(sentiment: str, min_conf: float):
+            return [
+                doc for doc in results
+                if doc.metadata.get("sentiment", "").lower() == sentiment.lower()
+                and float(doc.metadata.get("confidence") or 0) >= min_conf
+                and (allowed_categories is None or doc.metadata.get("category") in allowed_categories)
+            ]
+
+        positives = filter_by_sentiment_confidence("positive", 0.8)
+        if len(positives) < 20:
+            positives = filter_by_sentiment_confidence("positive", 0.6)
+
+        def get_embedding(text):
+            return vectorstore.embedding_function.embed_query(text)
+
+        def similarity(doc):
+            doc_embedding = get_embedding(doc.page_content)
+            return 1 - cosine(query_embedding, doc_embedding)  # usa scipy cosine
+
+        positives.sort(key=similarity, reverse=True)
+        selected = positives[:k]
+
+        if len(selected) < k:
+            remaining = k - len(selected)
+            neutrals = filter_by_sentiment_confidence("neutral", 0.5)
+            neutrals.sort(key=similarity, reverse=True)
+            selected += neutrals[:remaining]
+
+        if len(selected) < k:
+            remaining = k - len(selected)
+            unknowns = [
+                doc for doc in results
+                if doc.metadata.get("sentiment", "").lower() not in ("positive", "neutral")
+                and (allowed_categories is None or doc.metadata.get("category") in allowed_categories)
+            ]
+            unknowns.sort(key=similarity, reverse=True)
+            selected += unknowns[:remaining]
+
+        selected = selected[:k]
 
     final = []
     for doc in selected:
@@ -230,7 +237,7 @@ def get_context_stratified(
     logger.info(f"✅ Filtered and selected documents: {len(final)}")
 
     # 📁 Logging to CSV
-    with open(CONTEXT_LOG_PATH, "a", newline="", encoding="utf-8") as f:
+    with telemetry.span("context_log_write"), open(CONTEXT_LOG_PATH, "a", newline="", encoding="utf-8") as f:
         writer = csv.DictWriter(f, fieldnames=["timestamp", "query", "id", "category", "sentiment", "confidence", "content"])
         if f.tell() == 0:
             writer.writeheader()
@@ -268,10 +275,26 @@ vectorstores = {
     "nuovo_prodotto": vs_post,
 }
 
+if ENABLE_MULTILINGUAL_INDEX:
+    vectorstores["post_multilingual"] = get_vectorstore(
+        docs_post,
+        index_path=INDEX_PATHS["post_multilingual"],
+        model_name=MULTILINGUAL_EMBEDDING_MODEL,
+    )
+    logger.info(f"✅ Vectorstore 'post_multilingual' loaded with {MULTILINGUAL_EMBEDDING_MODEL}.")
+
+# Trend digest for /create_product: rebuilt only if the tweet files changed
+try:
+    ensure_digest()
+except Exception as e:
+    logger.error(f"❌ Trend digest not built: {e}")
+
 # =====================================
 # FASTAPI SETUP
 # =====================================
 app = FastAPI()
+# Trace id from the api's X-Trace-Id header, span histograms on GET /metrics
+telemetry.install(app)
 
 class QueryRequest(BaseModel):
     query: str
@@ -283,10 +306,63 @@ class QueryRequest(BaseModel):
 def health():
     return {"status": "ok"}
 
+@app.get("/trend_digest")
+def trend_digest(refresh: bool = False):
+    """Current digest; with refresh=true it is rebuilt first if the corpus changed."""
+    digest = ensure_digest() if refresh else read_digest(TREND_DIGEST_PATH)
+    if digest is None:
+        return {"error": "Trend digest not available"}
+    return digest
+
+class BatchQueryRequest(BaseModel):
+    requests: List[QueryRequest]
+
+class EmbedRequest(BaseModel):
+    texts: List[str]
+
 @app.post("/search")
 def search(data: QueryRequest):
     logger.info(f"🔎 Received search request - query: '{data.query}', index_type: '{data.index_type}', categories: {data.categories}")
-    
+    return run_search(data)
+
+@app.post("/search_batch")
+def search_batch(data: BatchQueryRequest):
+    """Many searches in one round trip; query embeddings are computed in a single batch per index."""
+    logger.info(f"🔎 Received batch search request - {len(data.requests)} queries")
+    return {"results": run_search_batch(data.requests)}
+
+@app.post("/embed")
+def embed(data: EmbedRequest):
+    """Sentence embeddings of the "post" index model (used by the api's semantic cache)."""
+    return {"model": EMBEDDING_MODEL, "embeddings": embed_texts(data.texts)}
+
+# =====================================
+# PLAIN FUNCTIONS (also used in-process by the api service)
+# =====================================
+def embed_texts(texts: List[str]) -> list:
+    """Same as POST /embed, without HTTP."""
+    with telemetry.span("embed_texts"):
+        return vectorstores["post"].embedding_function.embed_documents(list(texts))
+
+def search_documents(query: str, index_type: str = "post", categories: List[str] = None) -> dict:
+    """Same as POST /search, without HTTP: returns {"results": [...]} or {"error": ...}."""
+    return run_search(QueryRequest(query=query, index_type=index_type, categories=categories or []))
+
+def run_search_batch(requests: List[QueryRequest]) -> list:
+    embeddings = {}
+    for index_type in {req.index_type for req in requests if req.index_type in vectorstores}:
+        queries = [req.query for req in requests if req.index_type == index_type]
+        with telemetry.span("embed_batch"):
+            vectors = vectorstores[index_type].embedding_function.embed_documents(queries)
+        embeddings.update({(index_type, query): vector for query, vector in zip(queries, vectors)})
+
+    return [run_search(req, embeddings.get((req.index_type, req.query))) for req in requests]
+
+def search_documents_batch(queries: List[str], index_type: str = "post") -> list:
+    """Same as POST /search_batch, without HTTP."""
+    return run_search_batch([QueryRequest(query=q, index_type=index_type) for q in queries])
+
+def run_search(data: QueryRequest, query_embedding: list = None) -> dict:
     if data.index_type not in vectorstores:
         error_msg = f"Index_type '{data.index_type}' is invalid. Use one of: {list(vectorstores.keys())}"
         logger.error(error_msg)
@@ -317,13 +393,14 @@ def search(data: QueryRequest):
         query=data.query,
         allowed_categories=allowed_categories,
         k=5,
-        search_k=20
+        search_k=20,
+        query_embedding=query_embedding,
     )
 
     filtered_contexts = result.get("filtered", [])
     logger.info(f"Filtered results: {len(filtered_contexts)} documents")
 
-    with open(SEARCH_LOG_PATH, "a", encoding="utf-8") as f:
+    with telemetry.span("search_log_write"), open(SEARCH_LOG_PATH, "a", encoding="utf-8") as f:
         f.write("\n=== New Search Request ===\n")
         f.write(f"Query: {data.query}\n")
         f.write(f"Index_type: {data.index_type}\n")
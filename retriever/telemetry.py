@@ -0,0 +1,160 @@
+# telemetry.py
+#
+# Request tracing and in-process Prometheus metrics for the retriever. The
+# trace id comes from the api's X-Trace-Id header (a new one is created for
+# direct calls) and is echoed back, so retriever spans can be matched with
+# the api request that caused them. Spans are kept in fixed-bucket histograms
+# (one lock and a few additions per observation, no external dependency) and
+# summarised in one log line per request; GET /metrics exposes them.
+#
+# Not named tracing.py: in RETRIEVER_MODE=inprocess this file is imported by
+# the api process, which has its own tracing module.
+#
+# KEEP IN SYNC with api/tracing.py: Trace, span/record_span, BUCKETS, the
+# histogram layout, _format_labels, render and the middleware are the same
+# code (the two services are built from separate Docker contexts, so neither
+# can import the other). A fix in one file belongs in both.
+
+import time
+import uuid
+import bisect
+import logging
+import threading
+import contextvars
+from contextlib import contextmanager
+from fastapi.responses import PlainTextResponse
+
+logger = logging.getLogger(__name__)
+
+TRACE_HEADER = "X-Trace-Id"
+METRICS_PREFIX = "retriever_"
+CONTENT_TYPE = "text/plain; version=0.0.4; charset=utf-8"
+BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0, 30.0, 60.0)
+
+METRICS = {
+    "request_seconds": ("histogram", "HTTP request duration per endpoint"),
+    "stage_seconds": ("histogram", "Duration of traced stages (spans)"),
+}
+
+
+class Trace:
+    def __init__(self, trace_id: str):
+        self.id = trace_id
+        self.spans = []   # (name, ms) in completion order
+
+
+_current = contextvars.ContextVar("trace", default=None)
+_lock = threading.Lock()
+_histograms = {}   # (name, labels) -> [per-bucket counts + overflow, sum, count]
+
+
+# =====================================
+# TRACES
+# =====================================
+def current_trace_id():
+    trace = _current.get()
+    return trace.id if trace else None
+
+
+@contextmanager
+def trace(trace_id: str = None):
+    current = Trace(trace_id or uuid.uuid4().hex[:16])
+    token = _current.set(current)
+    try:
+        yield current
+    finally:
+        _current.reset(token)
+
+
+def record_span(name: str, seconds: float):
+    observe("stage_seconds", seconds, stage=name)
+    current = _current.get()
+    if current is not None:
+        current.spans.append((name, round(seconds * 1000, 1)))
+
+
+@contextmanager
+def span(name: str):
+    start = time.perf_counter()
+    try:
+        yield
+    finally:
+        record_span(name, time.perf_counter() - start)
+
+
+# =====================================
+# METRICS
+# =====================================
+def _labels_key(labels: dict) -> tuple:
+    return tuple(sorted((k, str(v)) for k, v in labels.items()))
+
+
+def observe(name: str, seconds: float, **labels):
+    key = (name, _labels_key(labels))
+    index = bisect.bisect_left(BUCKETS, seconds)
+    with _lock:
+        entry = _histograms.get(key)
+        if entry is None:
+            entry = _histograms[key] = [[0] * (len(BUCKETS) + 1), 0.0, 0]
+        entry[0][index] += 1
+        entry[1] += seconds
+        entry[2] += 1
+
+
+def _format_labels(labels, extra: tuple = ()) -> str:
+    pairs = list(labels) + list(extra)
+    if not pairs:
+        return ""
+    escaped = (v.replace("\\", "\\\\").replace('"', '\\"').replace("\n", "\\n") for _, v in pairs)
+    return "{" + ",".join(f'{k}="{v}"' for (k, _), v in zip(pairs, escaped)) + "}"
+
+
+def render() -> str:
+    with _lock:
+        histograms = {key: [list(entry[0]), entry[1], entry[2]] for key, entry in _histograms.items()}
+
+    lines = []
+    for name, (kind, description) in METRICS.items():
+        full_name = METRICS_PREFIX + name
+        lines += [f"# HELP {full_name} {description}", f"# TYPE {full_name} {kind}"]
+        for (metric, labels), (buckets, total, count) in sorted(histograms.items()):
+            if metric != name:
+                continue
+            cumulative = 0
+            for bound, n in zip(BUCKETS, buckets):
+                cumulative += n
+                lines.append(f"{full_name}_bucket{_format_labels(labels, (('le', str(bound)),))} {cumulative}")
+            lines.append(f"{full_name}_bucket{_format_labels(labels, (('le', '+Inf'),))} {count}")
+            lines.append(f"{full_name}_sum{_format_labels(labels)} {round(total, 6)}")
+            lines.append(f"{full_name}_count{_format_labels(labels)} {count}")
+    return "\n".join(lines) + "\n"
+
+
+# =====================================
+# FASTAPI
+# =====================================
+def install(app):
+    """Tracing middleware and GET /metrics."""
+
+    @app.middleware("http")
+    async def trace_requests(request, call_next):
+        with trace(request.headers.get(TRACE_HEADER)) as current:
+            start = time.perf_counter()
+            status = 500
+            try:
+                response = await call_next(request)
+                status = response.status_code
+            finally:
+                elapsed = time.perf_counter() - start
+                # Route template, not the raw path, to keep label cardinality bounded
+                route = getattr(request.scope.get("route"), "path", "other")
+                observe("request_seconds", elapsed, method=request.method, path=route, status=status)
+                if current.spans:
+                    spans = ", ".join(f"{name} {ms} ms" for name, ms in current.spans)
+                    logger.info(f"🧭 Trace {current.id} {request.method} {route} {status} in {elapsed * 1000:.0f} ms: {spans}")
+        response.headers[TRACE_HEADER] = current.id
+        return response
+
+    @app.get("/metrics", include_in_schema=False)
+    def metrics():
+        return PlainTextResponse(render(), media_type=CONTENT_TYPE)
@@ -0,0 +1,294 @@
+# trend_digest.py
+#
+# Offline trend aggregation over the tweet corpora loaded by the retriever.
+# Produces a compact JSON digest (hashtag and term frequencies, sentiment-
+# weighted topic clusters with their top exemplar tweets) that the api reads
+# for /create_product instead of retrieving a handful of chunks per request.
+# The digest stores a fingerprint of the corpus and is rebuilt only when the
+# tweet files change.
+#
+#   python retriever/trend_digest.py [--force]
+
+import os
+import re
+import html
+import json
+import math
+import hashlib
+import logging
+import argparse
+import datetime
+from collections import Counter
+from dotenv import load_dotenv
+
+logger = logging.getLogger(__name__)
+load_dotenv()
+
+BASE_DIR = os.path.dirname(os.path.abspath(__file__))
+ROOT_DIR = os.path.dirname(BASE_DIR)
+DATA_DIR = os.path.join(ROOT_DIR, "data")
+
+
+def getenv_path(env_var, root_dir, default):
+    val = os.getenv(env_var)
+    if val:
+        return os.path.abspath(os.path.join(root_dir, val)) if not os.path.isabs(val) else val
+    return default
+
+
+TWEET_FILES = {
+    getenv_path("TWEETS_ESG", ROOT_DIR, os.path.join(DATA_DIR, "tweets_ESG.txt")): "tweet_ESG",
+    getenv_path("TWEETS_GREEN", ROOT_DIR, os.path.join(DATA_DIR, "tweets_green.txt")): "tweet_green",
+}
+TREND_DIGEST_PATH = getenv_path("TREND_DIGEST_PATH", ROOT_DIR, os.path.join(DATA_DIR, "trend_digest.json"))
+TREND_DIGEST_CLUSTERS = int(os.getenv("TREND_DIGEST_CLUSTERS", "8"))
+EXEMPLARS_PER_CLUSTER = 3
+MIN_CLUSTER_DF = 5
+MAX_SEED_DF_SHARE = 0.3   # terms in more than 30% of tweets are too generic to define a topic
+MAX_SEED_OVERLAP = 0.4    # a seed sharing more than 40% of its tweets with a chosen one is the same topic
+
+URL_RE = re.compile(r"(?i)\b(?:https?://|www\.|t\.co/)\S+")
+MENTION_RE = re.compile(r"@\w+")
+HASHTAG_RE = re.compile(r"#(\w+)")
+WORD_RE = re.compile(r"[a-z][a-z'\-]{2,}")
+SENTIMENT_SIGN = {"positive": 1.0, "neutral": 0.0, "negative": -1.0}
+STOPWORDS = set("""
+a about above after again against all also am an and any are as at be because been before being below between
+both but by can could did do does doing down during each even every few for from further get got had has have
+having he her here hers him his how i if in into is it its itself just let like more most my no nor not now of
+off on once only or other our ours out over own same she should so some such than that the their theirs them
+then there these they this those through to too under until up very via was we were what when where which while
+who whom why will with would you your yours amp rt new one day today make made see know want need way many much
+really still well back use using used time good great best love don't it's i'm you're we're can't
+""".split())
+
+
+# =====================================
+# CORPUS
+# =====================================
+def parse_tweet_records(raw_text: str) -> list:
+    """Tweet blocks separated by '---' with ID/Text/Sentiment/Confidence lines; duplicate IDs are skipped."""
+    records = []
+    seen_ids = set()
+    for block in raw_text.split("---"):
+        record = {"id": None, "text": "", "sentiment": None, "confidence": None}
+        for line in block.strip().splitlines():
+            line = line.strip()
+            if line.startswith("ID:"):
+                record["id"] = line[len("ID:"):].strip()
+            elif line.startswith("Text:"):
+                record["text"] = line[len("Text:"):].strip()
+            elif re.match(r"(?i)^Sentiment:", line):
+                record["sentiment"] = line.split(":", 1)[1].strip()
+            elif re.match(r"(?i)^Confidence:", line):
+                try:
+                    record["confidence"] = float(line.split(":", 1)[1].strip())
+                except ValueError:
+                    record["confidence"] = None
+        if record["id"] and record["id"] in seen_ids:
+            continue
+        if record["text"]:
+            records.append(record)
+            if record["id"]:
+                seen_ids.add(record["id"])
+    return records
+
+
+def corpus_fingerprint(files: dict = None) -> str:
+    digest = hashlib.sha256()
+    for path in sorted(files or TWEET_FILES):
+        digest.update(path.encode("utf-8"))
+        if os.path.isfile(path):
+            with open(path, "rb") as f:
+                for chunk in iter(lambda: f.read(1024 * 1024), b""):
+                    digest.update(chunk)
+    return digest.hexdigest()
+
+
+def load_corpus(files: dict = None) -> list:
+    tweets = []
+    for path, category in (files or TWEET_FILES).items():
+        if not os.path.isfile(path):
+            logger.warning(f"⚠️ Tweet file not found, skipping: {path}")
+            continue
+        with open(path, encoding="utf-8") as f:
+            for record in parse_tweet_records(f.read()):
+                tweets.append({**record, "category": category})
+    return tweets
+
+
+# =====================================
+# FEATURES
+# =====================================
+def clean_text(text: str) -> str:
+    text = re.sub(r"&\s+amp;", "&", text)  # "& amp;" as it appears in the scraped corpus
+    text = URL_RE.sub("", html.unescape(html.unescape(text)))
+    return re.sub(r"\s+", " ", text).strip()
+
+
+def hashtags_of(text: str) -> set:
+    return {"#" + tag.lower() for tag in HASHTAG_RE.findall(text)}
+
+
+def features(text: str) -> set:
+    """Terms of a tweet for clustering; hashtags count as their word (#esg == esg)."""
+    text = MENTION_RE.sub(" ", clean_text(text)).lower().replace("#", " ")
+    words = {w.strip("'-") for w in WORD_RE.findall(text)}
+    return {w for w in words if len(w) > 2 and w not in STOPWORDS}
+
+
+def sentiment_weight(tweet: dict) -> float:
+    sign = SENTIMENT_SIGN.get((tweet.get("sentiment") or "").lower(), 0.0)
+    confidence = tweet.get("confidence")
+    return sign * (confidence if confidence is not None else 0.5)
+
+
+# =====================================
+# DIGEST
+# =====================================
+def build_digest(tweets: list, fingerprint: str, n_clusters: int = TREND_DIGEST_CLUSTERS) -> dict:
+    docs = [features(t["text"]) for t in tweets]
+    tags = [hashtags_of(t["text"]) for t in tweets]
+    weights = [sentiment_weight(t) for t in tweets]
+
+    df, weighted = Counter(), Counter()
+    tag_df, tag_weighted = Counter(), Counter()
+    for feats, doc_tags, w in zip(docs, tags, weights):
+        df.update(feats)
+        tag_df.update(doc_tags)
+        for feat in feats:
+            weighted[feat] += w
+        for tag in doc_tags:
+            tag_weighted[tag] += w
+
+    top_hashtags = [tag for tag, _ in tag_df.most_common(30)]
+    top_terms = [term for term, _ in df.most_common(40)]
+
+    # Topic seeds: frequent but specific features, ranked by positive-weighted frequency
+    max_df = MAX_SEED_DF_SHARE * len(docs)
+    candidates = [f for f in df if MIN_CLUSTER_DF <= df[f] <= max_df]
+    candidates.sort(key=lambda f: df[f] + weighted[f], reverse=True)
+    postings = {}
+    seeds = []
+    for feat in candidates:
+        members = {i for i, feats in enumerate(docs) if feat in feats}
+        if any(len(members & postings[s]) > MAX_SEED_OVERLAP * len(members) for s in seeds):
+            continue
+        seeds.append(feat)
+        postings[feat] = members
+        if len(seeds) == n_clusters:
+            break
+
+    # Each tweet joins the highest-ranked seed it contains
+    assigned = {seed: [] for seed in seeds}
+    for i, feats in enumerate(docs):
+        for seed in seeds:
+            if seed in feats:
+                assigned[seed].append(i)
+                break
+
+    clusters = []
+    for seed, members in assigned.items():
+        if not members:
+            continue
+        local, local_tags = Counter(), Counter()
+        for i in members:
+            local.update(docs[i])
+            local_tags.update(tags[i])
+        min_count = max(3, len(members) // 100)
+
+        def relevance(count: int, total: int) -> float:
+            # frequent in the cluster and more frequent than in the whole corpus
+            lift = (count / len(members)) / (total / len(docs))
+            return count * math.log(1 + lift)
+
+        top_keywords = sorted(
+            (f for f in local if f != seed and local[f] >= min_count),
+            key=lambda f: relevance(local[f], df[f]),
+            reverse=True,
+        )[:6]
+        top_tags = sorted(
+            (t for t in local_tags if local_tags[t] >= min_count),
+            key=lambda t: relevance(local_tags[t], tag_df[t]),
+            reverse=True,
+        )[:5]
+        sentiment = sum(weights[i] for i in members) / len(members)
+
+        ranked = sorted(
+            members,
+            key=lambda i: weights[i] + 0.1 * len(docs[i] & set(top_keywords)),
+            reverse=True,
+        )
+        exemplars, seen = [], set()
+        for i in ranked:
+            text = clean_text(tweets[i]["text"])
+            key = text.lower()[:80]
+            if not text or key in seen:
+                continue
+            seen.add(key)
+            exemplars.append({
+                "id": tweets[i]["id"],
+                "category": tweets[i]["category"],
+                "sentiment": tweets[i]["sentiment"],
+                "text": text[:280],
+            })
+            if len(exemplars) == EXEMPLARS_PER_CLUSTER:
+                break
+
+        clusters.append({
+            "label": seed,
+            "keywords": top_keywords,
+            "hashtags": top_tags,
+            "size": len(members),
+            "sentiment": round(sentiment, 3),
+            "score": round(len(members) * (1 + sentiment), 2),
+            "exemplars": exemplars,
+        })
+    clusters.sort(key=lambda c: c["score"], reverse=True)
+
+    return {
+        "generated_at": datetime.datetime.now().isoformat(),
+        "fingerprint": fingerprint,
+        "tweets": len(tweets),
+        "hashtags": [[t, tag_df[t], round(tag_weighted[t], 2)] for t in top_hashtags],
+        "terms": [[f, df[f], round(weighted[f], 2)] for f in top_terms],
+        "clusters": clusters,
+    }
+
+
+def read_digest(path: str = TREND_DIGEST_PATH) -> dict | None:
+    if not os.path.isfile(path):
+        return None
+    try:
+        with open(path, encoding="utf-8") as f:
+            return json.load(f)
+    except (OSError, ValueError) as e:
+        logger.error(f"❌ Unreadable trend digest {path}: {e}")
+        return None
+
+
+def ensure_digest(path: str = TREND_DIGEST_PATH, force: bool = False) -> dict:
+    """Returns the digest, rebuilding it only if the corpus fingerprint changed."""
+    fingerprint = corpus_fingerprint()
+    current = read_digest(path)
+    if current and current.get("fingerprint") == fingerprint and not force:
+        logger.info("📈 Trend digest up to date")
+        return current
+
+    tweets = load_corpus()
+    digest = build_digest(tweets, fingerprint)
+    tmp_path = path + ".tmp"
+    with open(tmp_path, "w", encoding="utf-8") as f:
+        json.dump(digest, f, ensure_ascii=False, indent=1)
+    os.replace(tmp_path, path)
+    logger.info(f"📈 Trend digest rebuilt: {len(tweets)} tweets, {len(digest['clusters'])} clusters -> {path}")
+    return digest
+
+
+if __name__ == "__main__":
+    logging.basicConfig(level=logging.INFO, format="%(asctime)s %(levelname)s %(message)s")
+    parser = argparse.ArgumentParser(description="Build the trend digest used by /create_product")
+    parser.add_argument("--force", action="store_true", help="rebuild even if the corpus did not change")
+    parser.add_argument("--output", default=TREND_DIGEST_PATH)
+    args = parser.parse_args()
+    ensure_digest(args.output, force=args.force)